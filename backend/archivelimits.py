@@ -0,0 +1,125 @@
+import io as _io
+import os as _os
+import sys as _sys
+import json as _json
+import tarfile as _tarfile
+import zipfile as _zipfile
+import tempfile as _tempfile
+import typing as _typing
+
+from courses import archives as _archives
+
+
+"""
+Проверка пределов импорта урока из архива.
+Скрипт собирает во временной папке архивы tar.gz и zip с файлом, не упомянутым в манифесте,
+размер которого больше LESSON_ARCHIVE_MAX_UNPACKED, и tar с числом записей больше
+LESSON_ARCHIVE_MAX_FILES. Такие архивы должны отклоняться по заголовкам,
+без распаковки содержимого. Корректный архив должен распаковываться.
+Запуск: python archivelimits.py, код возврата 1 при найденных ошибках
+
+"""
+
+
+MANIFEST = _json.dumps({"steps": [{"text": "intro.txt"}]}).encode()
+
+# сколько байт распаковки допустимо до отказа: манифест и тексты
+READ_LIMIT = 1048576
+
+
+class _Zeros(_io.RawIOBase):
+
+    """
+    Поток из size нулевых байт, без хранения в памяти
+    """
+
+    def __init__(self, size: int):
+        self.left = size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), self.left)
+        buffer[:size] = bytes(size)
+        self.left -= size
+        return size
+
+
+def _tar(path: str, files: _typing.List[_typing.Tuple[str, int, _typing.Optional[bytes]]]):
+    # files: (имя, размер, содержимое или None для нулей; размер -1 - папка)
+    with _tarfile.open(path, "w:gz" if path.endswith(".tgz") else "w") as tar:
+        for name, size, content in files:
+            info = _tarfile.TarInfo(name)
+            if size < 0:
+                info.type = _tarfile.DIRTYPE
+                tar.addfile(info)
+                continue
+            info.size = size
+            tar.addfile(info, _io.BytesIO(content) if content is not None else _io.BufferedReader(_Zeros(size)))
+
+
+def _zip(path: str, files: _typing.List[_typing.Tuple[str, int, _typing.Optional[bytes]]]):
+    with _zipfile.ZipFile(path, "w", _zipfile.ZIP_DEFLATED, compresslevel=1) as zip:
+        for name, size, content in files:
+            with zip.open(name, "w", force_zip64=True) as file:
+                if content is not None:
+                    file.write(content)
+                    continue
+                zeros = _Zeros(size)
+                while chunk := zeros.read(1048576):
+                    file.write(chunk)
+
+
+def _unpack(directory: str, path: str) -> _typing.Tuple[_typing.Optional[str], int]:
+    folder = _tempfile.mkdtemp(dir=directory)
+    unpacked = _archives._Unpacked(folder)
+    try:
+        _archives._unpack_archive(path, unpacked)
+        _archives._resolve(unpacked)
+    except _archives.ArchiveError as e:
+        return str(e), unpacked.unpacked
+    finally:
+        unpacked.discard()
+    return None, unpacked.unpacked
+
+
+def check(directory: str) -> _typing.List[str]:
+
+    """
+    Собирает архивы в папке directory и проверяет отказы. Возвращает список ошибок
+    """
+
+    junk = _archives.LESSON_ARCHIVE_MAX_UNPACKED + 1
+    valid = [("manifest.json", len(MANIFEST), MANIFEST), ("intro.txt", 5, b"hello")]
+    folders = [(f"folder{i}", -1, None) for i in range(_archives.LESSON_ARCHIVE_MAX_FILES)]
+    cases = {
+        "junk after manifest.tgz": (_tar, valid + [("junk.bin", junk, None)], "unpacks to more than"),
+        "junk before manifest.tgz": (_tar, [("junk.bin", junk, None)] + valid, "unpacks to more than"),
+        "junk.zip": (_zip, valid + [("junk.bin", junk, None)], "unpacks to more than"),
+        "many entries.tar": (_tar, valid + folders, "files"),
+        "valid.tgz": (_tar, valid, None),
+        "valid.zip": (_zip, valid, None),
+    }
+    errors = []
+    for name, (build, files, expected) in cases.items():
+        path = f"{directory}/{name}"
+        build(path, files)
+        error, read = _unpack(directory, path)
+        _os.remove(path)
+        if expected is None and error is not None:
+            errors.append(f"{name}: rejected: {error}")
+        elif expected is not None and (error is None or expected not in error):
+            errors.append(f"{name}: expected '{expected}', got {error!r}")
+        if read > READ_LIMIT:
+            errors.append(f"{name}: {read} bytes unpacked before the decision")
+    return errors
+
+
+if __name__ == "__main__":
+    with _tempfile.TemporaryDirectory() as directory:
+        errors = check(directory)
+    for error in errors:
+        print(f"FAILED {error}")
+    print("OK" if not errors else f"{len(errors)} errors")
+    _sys.exit(1 if errors else 0)
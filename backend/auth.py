@@ -0,0 +1,100 @@
+import typing as _typing
+
+import fastapi as _fastapi
+from sqlalchemy.ext import asyncio as _asyncio
+
+import cookies as _cookies
+import services as _services
+
+
+"""
+Зависимости FastAPI для определения владельца cookie.
+Владелец определяется не больше одного раза за запрос и сохраняется в request.state,
+отметка присутствия ставится фоновой задачей после отправки ответа.
+Проверки ролей при отказе бросают UnauthorizedError, на которую приложение
+отвечает 401 с удалением cookie
+
+"""
+
+
+cookietype = _typing.Annotated[_typing.Union[str, None], _fastapi.Cookie()]
+
+
+class UnauthorizedError(Exception):
+    pass
+
+
+def _mark_online(
+        request: _fastapi.Request,
+        background: _fastapi.BackgroundTasks,
+        principal: _typing.Optional[_cookies.Principal]
+):
+    if principal is not None and not getattr(request.state, "marked_online", False):
+        request.state.marked_online = True
+        background.add_task(_services.mark_online, principal)
+
+
+async def get_account(
+        request: _fastapi.Request,
+        background: _fastapi.BackgroundTasks,
+        user: cookietype = None,
+        session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
+) -> _typing.Optional[_cookies.Account]:
+
+    """
+    Владелец cookie с загруженными моделями или None
+    """
+
+    if not hasattr(request.state, "account"):
+        account = await _services.get_account(user, session)
+        request.state.account = account
+        request.state.principal = account.principal if account else None
+        _mark_online(request, background, request.state.principal)
+    return request.state.account
+
+
+async def get_principal(
+        request: _fastapi.Request,
+        background: _fastapi.BackgroundTasks,
+        user: cookietype = None,
+        session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
+) -> _typing.Optional[_cookies.Principal]:
+
+    """
+    Владелец cookie без загрузки моделей или None.
+    Для открытых страниц: нужен только для отметки присутствия
+    """
+
+    if not hasattr(request.state, "principal"):
+        request.state.principal = await _services.get_principal(user, session)
+        _mark_online(request, background, request.state.principal)
+    return request.state.principal
+
+
+def role(*roles: str):
+
+    """
+    Создает зависимость, пропускающую только владельцев cookie с ролями roles
+    """
+
+    async def guard(
+            account: _typing.Optional[_cookies.Account] = _fastapi.Depends(get_account)
+    ) -> _cookies.Account:
+        if account is None or account.role not in roles:
+            raise UnauthorizedError
+        return account
+
+    return guard
+
+
+admin = role("admin")
+
+student = role("student")
+
+teacher = role("teacher")
+
+# студент или учитель
+user = role("student", "teacher")
+
+# любой владелец действительной cookie
+signed = role("admin", "student", "teacher")
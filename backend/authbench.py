@@ -0,0 +1,103 @@
+import sys as _sys
+import time as _time
+import asyncio as _aio
+import tempfile as _tempfile
+import collections as _collections
+import typing as _typing
+
+import sqlalchemy as _sql
+from sqlalchemy.ext import asyncio as _asyncio
+
+import models as _models
+import services as _services
+import cookies as _cookies
+import migrations as _migrations
+
+
+"""
+Замер стоимости определения владельца cookie по ролям.
+Скрипт создает временную базу SQLite с админом, студентом и учителем
+и для каждой роли и каждого вида cookie вызывает services.get_account,
+считая выполненные запросы и коммиты.
+Запуск: python authbench.py [число повторов]
+
+"""
+
+
+def _accounts(se: _asyncio.AsyncSession):
+    company = _models.Company(name="Company")
+    admin = _models.Admin(login="admin", password="", sign="admin")
+    student = _models.User(
+        role="student", email="s@x", password="", fname="S", lname="S",
+        sign="student", confirmed=True
+    )
+    teacher = _models.User(
+        role="teacher", email="t@x", password="", fname="T", lname="T",
+        sign="teacher", confirmed=True
+    )
+    se.add_all([company, admin, student, teacher])
+    return company, {"admin": admin, "student": student, "teacher": teacher}
+
+
+async def _bench(path: str, repeats: int) -> _typing.List[_typing.Tuple[str, str, float, float, float]]:
+    engine = _asyncio.create_async_engine(f"sqlite+aiosqlite:///{path}")
+    counters = _collections.Counter()
+    _sql.event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: counters.update(["queries"]))
+    _sql.event.listen(engine.sync_engine, "commit", lambda *args: counters.update(["commits"]))
+
+    results = []
+    async with _asyncio.AsyncSession(engine, expire_on_commit=False) as se:
+        company, models = _accounts(se)
+        await se.flush()
+        se.add(_models.Teacher(user_id=models["teacher"].id, company_id=company.id))
+        await se.commit()
+
+        for role, model in models.items():
+            cookies = {
+                "sign": f"{model.id}.{model.sign}",
+                "device": await _cookies.genetate_cookie(model, se),
+                "token": _cookies.encode_token(model),
+            }
+            for kind, cookie in cookies.items():
+                _cookies.principals.clear()
+                counters.clear()
+                started = _time.perf_counter()
+                for _ in range(repeats):
+                    se.expunge_all()
+                    account = await _services.get_account(cookie, se)
+                    if account.role != role:
+                        raise RuntimeError(f"{kind} cookie of {role} resolved as {account.role}")
+                elapsed = _time.perf_counter() - started
+                results.append((
+                    role,
+                    kind,
+                    counters["queries"] / repeats,
+                    counters["commits"] / repeats,
+                    elapsed * 1000 / repeats
+                ))
+    await engine.dispose()
+    return results
+
+
+def bench(path: str, repeats: int = 200):
+
+    """
+    Выполняет замер на базе по пути path.
+    Возвращает строки (роль, вид cookie, запросов, коммитов, мс) на один вызов
+    """
+
+    engine = _sql.create_engine(f"sqlite:///{path}")
+    _migrations.migrate(engine)
+    engine.dispose()
+    return _aio.run(_bench(path, repeats))
+
+
+if __name__ == "__main__":
+    # для замера cookie-токенов достаточно любого ключа
+    _cookies.COOKIE_TOKEN_SECRET = _cookies.COOKIE_TOKEN_SECRET or "authbench"
+    repeats = int(_sys.argv[1]) if len(_sys.argv) > 1 else 200
+    with _tempfile.TemporaryDirectory() as directory:
+        results = bench(f"{directory}/authbench.db", repeats)
+    print(f"{'role':10}{'cookie':8}{'queries':>9}{'commits':>9}{'ms':>8}")
+    for role, kind, queries, commits, ms in results:
+        print(f"{role:10}{kind:8}{queries:9.1f}{commits:9.1f}{ms:8.2f}")
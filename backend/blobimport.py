@@ -0,0 +1,118 @@
+import os as _os
+import re as _re
+import sys as _sys
+import datetime as _dt
+import typing as _typing
+
+import sqlalchemy as _sql
+import sqlalchemy.orm as _orm
+from loguru import logger as _logger
+
+import database as _database
+import models as _models
+import blobs as _blobs
+import uploads as _uploads
+import migrations as _migrations
+
+
+"""
+Перенос в хранилище blobs картинок, сохраненных до версии схемы 7 в дереве файлов:
+картинок шагов (курс/урок/шаг.ext в дереве курсов) и абзацев новостей (новость-абзац.ext).
+Файлы читаются частями через blobs.stage, каждая картинка добавляется отдельной транзакцией,
+уже имеющие ссылку владельцы пропускаются, поэтому скрипт можно запускать повторно.
+Исходные файлы не удаляются. База - по адресу DATABASE_URL, она приводится к последней версии схемы.
+Скрипт нужно запустить один раз при обновлении базы старше версии 7: до этого такие картинки
+не попадают в уроки и новости и отдаются с кодом 404. Приложение при запуске пишет в лог,
+если в дереве остались не перенесенные картинки (pending).
+Запуск: python blobimport.py папка_blobs дерево_курсов папка_картинок_новостей
+
+"""
+
+
+def _files(courses: str, news: str) -> _typing.List[_typing.Tuple[str, str]]:
+    files = []
+    for dirpath, _, names in _os.walk(courses):
+        parts = _os.path.relpath(dirpath, courses).split(_os.sep)
+        for name in names:
+            match = _re.fullmatch(r"(\d+)\.(png|jpe?g)", name)
+            if match and len(parts) == 2 and all(p.isdigit() for p in parts):
+                files.append((_blobs.step_owner(int(parts[0]), int(parts[1]), int(match[1])), f"{dirpath}/{name}"))
+    for name in (_os.listdir(news) if _os.path.isdir(news) else ()):
+        match = _re.fullmatch(r"(\d+)-(\d+)\.(png|jpe?g)", name)
+        if match:
+            files.append((_blobs.paragraph_owner(int(match[1]), int(match[2])), f"{news}/{name}"))
+    return files
+
+
+def pending(engine: _sql.Engine, courses: str, news: str) -> _typing.List[str]:
+
+    """
+    Возвращает пути картинок в дереве курсов courses и папке news, у владельцев которых нет ссылки на blob
+    """
+
+    with _orm.Session(engine) as se:
+        owned = set(se.scalars(_sql.select(_models.BlobRef.owner)))
+    return [path for owner, path in _files(courses, news) if owner not in owned]
+
+
+def _stage(path: str, directory: str) -> _blobs.Staged:
+    with open(path, "rb") as file:
+        staged = _blobs.stage(iter(lambda: file.read(_uploads.UPLOAD_CHUNK_SIZE), b""), None, directory)
+    try:
+        _blobs.probe_image(staged.temp)
+    except _blobs.UnsupportedBlobError:
+        staged.discard()
+        raise
+    return staged
+
+
+def import_files(engine: _sql.Engine, directory: str, courses: str, news: str) -> int:
+
+    """
+    Переносит картинки из дерева курсов courses и папки news в хранилище в папке directory.
+    Возвращает число добавленных ссылок
+    """
+
+    imported = 0
+    with _orm.Session(engine) as se:
+        owned = set(se.scalars(_sql.select(_models.BlobRef.owner)))
+        for owner, path in _files(courses, news):
+            if owner in owned:
+                continue
+            try:
+                staged = _stage(path, directory)
+            except _blobs.UnsupportedBlobError as e:
+                _logger.warning(f"{path} is not imported into blobs: {e}")
+                continue
+            try:
+                if se.get(_models.Blob, staged.hash) is None:
+                    mime, width, height = _blobs.probe_image(staged.temp)
+                    now = _dt.datetime.utcnow()
+                    se.add(_models.Blob(
+                        hash=staged.hash, mime=mime, size=staged.size, width=width, height=height,
+                        refs=0, date_created=now, date_released=now
+                    ))
+                    se.flush()
+                se.add(_models.BlobRef(owner=owner, blob_hash=staged.hash))
+                se.execute(
+                    _sql.update(_models.Blob)
+                    .where(_models.Blob.hash == staged.hash)
+                    .values(refs=_models.Blob.refs + 1, date_released=None)
+                )
+                # файл без строки после сбоя удалит blobs.collect
+                staged.settle()
+                se.commit()
+            finally:
+                staged.discard()
+            owned.add(owner)
+            imported += 1
+    return imported
+
+
+if __name__ == "__main__":
+    if len(_sys.argv) != 4:
+        print("usage: python blobimport.py BLOBS_DIR COURSES_TREE NEWS_IMAGES_DIR")
+        _sys.exit(2)
+    _migrations.migrate(_database.engine)
+    count = import_files(_database.engine, *(_os.path.abspath(arg) for arg in _sys.argv[1:]))
+    print(f"{count} images imported into blobs")
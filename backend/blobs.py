@@ -0,0 +1,479 @@
+import os as _os
+import glob as _glob
+import io as _io
+import asyncio as _aio
+import hashlib as _hashlib
+import secrets as _secrets
+import datetime as _dt
+import collections as _collections
+import typing as _typing
+
+import aiofiles as _aiofiles
+import sqlalchemy as _sql
+import sqlalchemy.orm as _orm
+from sqlalchemy.dialects import sqlite as _sqlite
+from sqlalchemy.dialects import postgresql as _postgresql
+from sqlalchemy.ext import asyncio as _asyncio
+from PIL import Image as _Image
+from loguru import logger as _logger
+
+import models as _models
+
+
+"""
+Хранилище файлов, адресуемых sha256 содержимого: data/blobs/ab/cd/abcd...
+Одинаковые картинки шагов уроков и абзацев новостей хранятся один раз.
+Метаданные (тип, размер, ширина и высота) хранятся в таблице blob,
+ссылки владельцев - в blob_ref, их число - в blob.refs.
+Файлы без ссылок удаляет модуль ttl спустя BLOBS_GRACE_PERIOD.
+Загрузки пишутся потоком: частями во временный файл data/blobs/tmp, который затем переименовывается.
+Функции не фиксируют транзакцию, это делает вызывающий код
+
+"""
+
+
+# сколько секунд хранится файл, на который не осталось ссылок
+BLOBS_GRACE_PERIOD = int(_os.environ.get("BLOBS_GRACE_PERIOD", 86400))
+
+# формат Pillow -> тип содержимого
+IMAGE_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+}
+
+# начало файла -> тип содержимого
+MAGIC_BYTES = {
+    b"\x89PNG\r\n\x1a\n": "image/png",
+    b"\xff\xd8\xff": "image/jpeg",
+}
+
+SNIFF_SIZE = max(len(magic) for magic in MAGIC_BYTES)
+
+
+# INSERT ... ON CONFLICT DO NOTHING поддерживаемых бэкендов
+_INSERTS = {
+    "sqlite": _sqlite.insert,
+    "postgresql": _postgresql.insert,
+}
+
+
+class BlobError(Exception):
+    pass
+
+
+class UnsupportedBlobError(BlobError):
+    pass
+
+
+class BlobTooLargeError(BlobError):
+    pass
+
+
+def root() -> str:
+    return f"{_os.getcwd()}/data/blobs"
+
+
+def path(hash: str, directory: _typing.Optional[str] = None) -> str:
+    return f"{directory or root()}/{hash[:2]}/{hash[2:4]}/{hash}"
+
+
+def step_owner(course_id: int, lesson_number: int, step_number: int) -> str:
+    return f"step:{course_id}/{lesson_number}/{step_number}"
+
+
+def steps_prefix(course_id: int, lesson_number: _typing.Optional[int] = None) -> str:
+    # общее начало ключей шагов курса или урока, для detach_all
+    return f"step:{course_id}/" if lesson_number is None else f"step:{course_id}/{lesson_number}/"
+
+
+def paragraph_owner(news_id: int, paragraph_id: int) -> str:
+    return f"news:{news_id}/{paragraph_id}"
+
+
+def paragraphs_prefix(news_id: int) -> str:
+    return f"news:{news_id}/"
+
+
+def etag(blob: _models.Blob) -> str:
+    return f'"{blob.hash[:32]}"'
+
+
+def mtime(blob: _models.Blob) -> int:
+
+    """
+    Время создания blob в наносекундах, для Last-Modified
+    """
+
+    return int(blob.date_created.replace(tzinfo=_dt.timezone.utc).timestamp()) * 1_000_000_000
+
+
+def sniff(head: bytes) -> str:
+
+    """
+    Определяет тип картинки по первым байтам файла
+    """
+
+    for magic, mime in MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return mime
+    raise UnsupportedBlobError("unknown file signature")
+
+
+def probe_image(content: _typing.Union[bytes, str]) -> _typing.Tuple[str, int, int]:
+
+    """
+    Определяет тип и размеры картинки по содержимому или пути к файлу. Читается только заголовок
+    """
+
+    try:
+        with _Image.open(_io.BytesIO(content) if isinstance(content, bytes) else content) as image:
+            format, (width, height) = image.format, image.size
+    except (OSError, ValueError, _Image.DecompressionBombError) as e:
+        raise UnsupportedBlobError(f"not an image: {e}")
+    if format not in IMAGE_TYPES:
+        raise UnsupportedBlobError(f"unsupported image format {format}")
+    return IMAGE_TYPES[format], width, height
+
+
+def _settle(temp: str, hash: str, directory: _typing.Optional[str] = None):
+    target = path(hash, directory)
+    _os.makedirs(_os.path.dirname(target), exist_ok=True)
+    # содержимое то же, поэтому существующий файл можно заменить
+    _os.replace(temp, target)
+
+
+class Staged():
+
+    """
+    Файл во временной папке хранилища, еще не добавленный в него.
+    Части подаются в feed: sha256 и размер считаются по ходу, запись прерывается,
+    как только размер превысил limit (BlobTooLargeError) или первые байты не похожи на картинку
+    (UnsupportedBlobError). directory - папка хранилища, по умолчанию root()
+    """
+
+    temp: str
+    size: int
+    hash: _typing.Optional[str]
+
+    def __init__(self, limit: _typing.Optional[int] = None, directory: _typing.Optional[str] = None):
+        self.directory = directory or root()
+        _os.makedirs(f"{self.directory}/tmp", exist_ok=True)
+        self.temp = f"{self.directory}/tmp/{_secrets.token_hex(8)}.part"
+        self.size = 0
+        self.hash = None
+        self._limit = limit
+        self._head = b""
+        self._hasher = _hashlib.sha256()
+
+    def feed(self, chunk: bytes):
+        self.size += len(chunk)
+        if self._limit is not None and self.size > self._limit:
+            raise BlobTooLargeError(f"blob is larger than {self._limit} bytes")
+        if len(self._head) < SNIFF_SIZE:
+            self._head += chunk[:SNIFF_SIZE - len(self._head)]
+            if len(self._head) == SNIFF_SIZE:
+                sniff(self._head)
+        self._hasher.update(chunk)
+
+    def finish(self):
+        sniff(self._head)
+        self.hash = self._hasher.hexdigest()
+
+    def settle(self):
+
+        """
+        Переносит файл в хранилище переименованием
+        """
+
+        _settle(self.temp, self.hash, self.directory)
+
+    def discard(self):
+        if _os.path.exists(self.temp):
+            _os.remove(self.temp)
+
+
+def stage(
+        chunks: _typing.Iterable[bytes],
+        limit: _typing.Optional[int] = None,
+        directory: _typing.Optional[str] = None
+) -> Staged:
+
+    """
+    Записывает части во временный файл. Для вызова вне цикла событий (например, из потока или скрипта)
+    """
+
+    staged = Staged(limit, directory)
+    try:
+        with open(staged.temp, "wb") as file:
+            for chunk in chunks:
+                staged.feed(chunk)
+                file.write(chunk)
+        staged.finish()
+    except BaseException:
+        staged.discard()
+        raise
+    return staged
+
+
+async def stage_stream(chunks: _typing.AsyncIterable[bytes], limit: _typing.Optional[int] = None) -> Staged:
+    staged = Staged(limit)
+    try:
+        async with _aiofiles.open(staged.temp, "wb") as file:
+            async for chunk in chunks:
+                staged.feed(chunk)
+                await file.write(chunk)
+        staged.finish()
+    except BaseException:
+        staged.discard()
+        raise
+    return staged
+
+
+async def store(staged: Staged, se: _asyncio.AsyncSession) -> _models.Blob:
+
+    """
+    Переносит записанный файл в хранилище переименованием.
+    Строка вставляется без ошибки, если такое содержимое уже сохранено (в том числе параллельным запросом),
+    тогда она изменяется в транзакции вызывающего кода, чтобы collect не удалил ее до коммита.
+    Если такое содержимое уже есть, временный файл остается на месте, его удаляет discard
+    """
+
+    loop = _aio.get_running_loop()
+    mime, width, height = await loop.run_in_executor(None, probe_image, staged.temp)
+    now = _dt.datetime.utcnow()
+    inserted = await se.execute(
+        _INSERTS[se.get_bind().dialect.name](_models.Blob)
+        .values(
+            hash=staged.hash,
+            mime=mime,
+            size=staged.size,
+            width=width,
+            height=height,
+            refs=0,
+            date_created=now,
+            date_released=now
+        )
+        .on_conflict_do_nothing(index_elements=[_models.Blob.hash])
+    )
+    if not inserted.rowcount:
+        await se.execute(
+            _sql.update(_models.Blob)
+            .where(_models.Blob.hash == staged.hash)
+            .values(date_released=_sql.case((_models.Blob.refs <= 0, now), else_=_models.Blob.date_released))
+        )
+    if inserted.rowcount or not _os.path.isfile(path(staged.hash)):
+        # файл появляется до коммита: после отката его как файл без строки удалит collect
+        await loop.run_in_executor(None, staged.settle)
+    # в сессии мог остаться объект строки, удаленной collect
+    return await se.get(_models.Blob, staged.hash, populate_existing=True)
+
+
+async def put_stream(
+        chunks: _typing.AsyncIterable[bytes],
+        limit: _typing.Optional[int],
+        se: _asyncio.AsyncSession
+) -> _models.Blob:
+
+    """
+    Сохраняет картинку, приходящую частями, в хранилище
+    """
+
+    staged = await stage_stream(chunks, limit)
+    try:
+        return await store(staged, se)
+    finally:
+        staged.discard()
+
+
+def _release(hash: str, count: int = 1) -> _sql.Update:
+    return (
+        _sql.update(_models.Blob)
+        .where(_models.Blob.hash == hash)
+        .values(
+            refs=_models.Blob.refs - count,
+            date_released=_sql.case(
+                (_models.Blob.refs <= count, _dt.datetime.utcnow()),
+                else_=_models.Blob.date_released
+            )
+        )
+    )
+
+
+async def _acquire(hash: str, count: int, se: _asyncio.AsyncSession):
+    updated = await se.execute(
+        _sql.update(_models.Blob)
+        .where(_models.Blob.hash == hash)
+        .values(refs=_models.Blob.refs + count, date_released=None)
+    )
+    # строку мог удалить collect: ссылка на нее осталась бы висячей
+    if not updated.rowcount:
+        raise BlobError(f"blob {hash} does not exist")
+
+
+async def attach(owner: str, hash: str, se: _asyncio.AsyncSession):
+
+    """
+    Ссылается владельцем owner на blob hash. Прежняя ссылка владельца снимается
+    """
+
+    ref = await se.get(_models.BlobRef, owner)
+    if ref is not None and ref.blob_hash == hash:
+        return
+    if ref is not None:
+        await se.execute(_release(ref.blob_hash))
+        ref.blob_hash = hash
+    else:
+        se.add(_models.BlobRef(owner=owner, blob_hash=hash))
+    await _acquire(hash, 1, se)
+
+
+async def attach_many(refs: _typing.Dict[str, str], se: _asyncio.AsyncSession):
+
+    """
+    То же, что attach для пар владелец -> hash, но одним запросом на чтение
+    и одним на вставку ссылок и по запросу на каждый blob
+    """
+
+    old = (await se.execute(
+        _sql.select(_models.BlobRef.owner, _models.BlobRef.blob_hash)
+        .where(_models.BlobRef.owner.in_(refs))
+    )).all()
+    changed = [(owner, hash) for owner, hash in old if refs[owner] != hash]
+    for hash, count in _collections.Counter(hash for _, hash in changed).items():
+        await se.execute(_release(hash, count))
+    if changed:
+        await se.execute(_sql.delete(_models.BlobRef).where(_models.BlobRef.owner.in_([o for o, _ in changed])))
+    kept = {owner for owner, hash in old if refs[owner] == hash}
+    new = {owner: hash for owner, hash in refs.items() if owner not in kept}
+    if not new:
+        return
+    await se.execute(_sql.insert(_models.BlobRef), [{"owner": o, "blob_hash": h} for o, h in new.items()])
+    for hash, count in _collections.Counter(new.values()).items():
+        await _acquire(hash, count, se)
+
+
+async def detach(owner: str, se: _asyncio.AsyncSession) -> bool:
+
+    """
+    Снимает ссылку владельца owner. Возвращает False, если ссылки не было
+    """
+
+    ref = await se.get(_models.BlobRef, owner)
+    if ref is None:
+        return False
+    await se.execute(_release(ref.blob_hash))
+    await se.delete(ref)
+    return True
+
+
+def _owned_by(prefix: str):
+    # диапазон вместо LIKE, чтобы использовался первичный ключ
+    return _sql.and_(_models.BlobRef.owner >= prefix, _models.BlobRef.owner < prefix + "\x7f")
+
+
+async def detach_all(prefix: str, se: _asyncio.AsyncSession) -> int:
+
+    """
+    Снимает ссылки всех владельцев, ключ которых начинается с prefix (например, всех шагов урока).
+    Возвращает число снятых ссылок
+    """
+
+    counts = (await se.execute(
+        _sql.select(_models.BlobRef.blob_hash, _sql.func.count())
+        .where(_owned_by(prefix))
+        .group_by(_models.BlobRef.blob_hash)
+    )).all()
+    for hash, count in counts:
+        await se.execute(_release(hash, count))
+    await se.execute(_sql.delete(_models.BlobRef).where(_owned_by(prefix)))
+    return sum(count for _, count in counts)
+
+
+async def get(owner: str, se: _asyncio.AsyncSession) -> _typing.Optional[_models.Blob]:
+    return await se.scalar(
+        _sql.select(_models.Blob)
+        .join(_models.BlobRef, _models.BlobRef.blob_hash == _models.Blob.hash)
+        .where(_models.BlobRef.owner == owner)
+    )
+
+
+def collect(se: _orm.Session, grace: int = BLOBS_GRACE_PERIOD) -> int:
+
+    """
+    Удаляет blobs, на которые дольше grace секунд нет ссылок, и файлы хранилища без строк в blob
+    (сохраненные в откатившейся транзакции), созданные раньше grace секунд назад.
+    Возвращает число удаленных blobs
+    """
+
+    released = _dt.datetime.utcnow() - _dt.timedelta(seconds=grace)
+    condition = _sql.and_(_models.Blob.date_released < released, _models.Blob.refs <= 0)
+    hashes = se.scalars(_sql.select(_models.Blob.hash).where(condition)).all()
+    removed = []
+    if hashes:
+        # условие проверяется заново: на часть blobs могли успеть сослаться
+        removed = se.scalars(
+            _sql.delete(_models.Blob)
+            .where(_models.Blob.hash.in_(hashes), condition)
+            .returning(_models.Blob.hash)
+        ).all()
+        # файлы удаляются до коммита: пока удаление строк не зафиксировано, store ждет его и затем вставляет их заново
+        for hash in removed:
+            _remove(hash)
+    se.commit()
+    swept = _sweep(se, grace)
+    if swept:
+        _logger.debug(f"{swept} blob files deleted: no rows")
+    _drop_stale_parts(grace)
+    return len(removed)
+
+
+def _remove(hash: str):
+    # вместе с уменьшенными копиями (модуль images)
+    for name in [path(hash), *_glob.glob(f"{path(hash)}.*")]:
+        try:
+            _os.remove(name)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            _logger.error(f"unable to delete blob file {name}: {e=}")
+
+
+def _sweep(se: _orm.Session, grace: int, batch: int = 500) -> int:
+    deadline = _dt.datetime.now().timestamp() - grace
+    files: _typing.Dict[str, _typing.List[str]] = {}
+    for name in _glob.glob(f"{root()}/??/??/*"):
+        hash = _os.path.basename(name).partition(".")[0]
+        try:
+            if len(hash) == 64 and _os.path.getmtime(name) < deadline:
+                files.setdefault(hash, []).append(name)
+        except OSError:
+            pass
+    hashes = list(files)
+    known = set()
+    for i in range(0, len(hashes), batch):
+        known.update(se.scalars(_sql.select(_models.Blob.hash).where(_models.Blob.hash.in_(hashes[i:i + batch]))))
+    se.rollback()
+    swept = 0
+    for hash in hashes:
+        if hash in known:
+            continue
+        for name in files[hash]:
+            try:
+                # store мог только что заново перенести файл на место
+                if _os.path.getmtime(name) < deadline:
+                    _os.remove(name)
+                    swept += 1
+            except OSError:
+                pass
+    return swept
+
+
+def _drop_stale_parts(grace: int):
+    # временные файлы загрузок, прерванных падением процесса
+    deadline = _dt.datetime.now().timestamp() - grace
+    for name in _glob.glob(f"{root()}/tmp/*.part"):
+        try:
+            if _os.path.getmtime(name) < deadline:
+                _os.remove(name)
+        except OSError:
+            pass
@@ -0,0 +1,110 @@
+import typing as _typing
+
+import sqlalchemy as _sql
+from sqlalchemy.ext import asyncio as _asyncio
+
+import database as _database
+
+
+"""
+Каскадное удаление строк.
+Зависимости между таблицами берутся из внешних ключей models.py:
+строки, ссылающиеся на удаляемые через ключ с ondelete="CASCADE", удаляются вместе с ними,
+ссылки через остальные ключи запрещают удаление
+
+"""
+
+
+class CascadeError(Exception):
+    pass
+
+
+class CascadeRestrictedError(CascadeError):
+
+    def __init__(self, table: str):
+        super().__init__(f"rows of table {table} reference deleted rows")
+        self.table = table
+
+
+def _referencing_keys(table: _sql.Table) -> _typing.List[_sql.ForeignKey]:
+
+    """
+    Возвращает внешние ключи всех таблиц, ссылающиеся на таблицу table
+    """
+
+    return [
+        fk
+        for t in _database.Base.metadata.sorted_tables
+        for fk in t.foreign_keys
+        if fk.column.table is table
+    ]
+
+
+def _plan(
+        table: _sql.Table,
+        condition: _sql.ColumnElement,
+        path: _typing.Tuple[_sql.Table, ...]
+):
+
+    """
+    Строит план удаления строк table, удовлетворяющих condition.
+    Возвращает список удалений (дочерние таблицы раньше родительских)
+    и список проверок ключей, запрещающих удаление
+    """
+
+    deletes = []
+    restricts = []
+    for fk in _referencing_keys(table):
+        child = fk.parent.table
+        child_condition = fk.parent.in_(_sql.select(fk.column).where(condition))
+        if (fk.ondelete or "").upper() == "CASCADE":
+            if child in path:
+                raise CascadeError(f"cascade cycle through table {child.name}")
+            child_deletes, child_restricts = _plan(child, child_condition, path + (child,))
+            deletes += child_deletes
+            restricts += child_restricts
+        else:
+            restricts.append((child, child_condition))
+    deletes.append((table, condition))
+    return deletes, restricts
+
+
+async def delete_rows(
+        model: _typing.Type[_database.Base],
+        ids: _typing.Iterable[int],
+        se: _asyncio.AsyncSession
+) -> _typing.Dict[str, int]:
+
+    """
+    То же, что delete, но в транзакции вызывающего кода: без коммита
+    """
+
+    table = model.__table__
+    pk, = table.primary_key.columns
+    deletes, restricts = _plan(table, pk.in_(list(ids)), (table,))
+
+    removed = {}
+    for child, condition in restricts:
+        if await se.scalar(_sql.select(_sql.exists().where(condition))):
+            raise CascadeRestrictedError(child.name)
+    for t, condition in deletes:
+        result = await se.execute(_sql.delete(t).where(condition))
+        removed[t.name] = removed.get(t.name, 0) + result.rowcount
+    return removed
+
+
+async def delete(
+        model: _typing.Type[_database.Base],
+        ids: _typing.Iterable[int],
+        se: _asyncio.AsyncSession
+) -> _typing.Dict[str, int]:
+
+    """
+    Удаляет строки модели model с первичными ключами ids и все зависящие от них строки.
+    Каждая таблица очищается одним запросом DELETE ... WHERE fk IN (...), все запросы
+    выполняются в одной транзакции.
+    Возвращает количество удаленных строк по таблицам
+    """
+
+    async with _database.transaction(se):
+        return await delete_rows(model, ids, se)
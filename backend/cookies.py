@@ -1,14 +1,21 @@
+import os as _os
+import time as _time
 import typing as _typing
 import datetime as _dt
 import hashlib as _hash
-import random as _rand
+import secrets as _secrets
+import collections as _collections
 
+import jwt as _jwt
 import fastapi as _fastapi
-from sqlalchemy import orm as _orm
+import sqlalchemy as _sql
+import sqlalchemy.orm as _orm
+from sqlalchemy.ext import asyncio as _asyncio
 from pydantic import BaseModel as _BM
 
 import models as _models
 import database as _database
+import schemas as _schemas
 
 
 """
@@ -17,6 +24,39 @@ import database as _database
 """
 
 
+# Размер кэша владельцев cookie и время жизни записи в секундах.
+# Кэш живет в памяти процесса: при нескольких процессах смена подписи в одном из них
+# становится видна остальным не позже, чем через COOKIE_CACHE_TTL
+COOKIE_CACHE_SIZE = int(_os.environ.get("COOKIE_CACHE_SIZE", 10000))
+
+COOKIE_CACHE_TTL = float(_os.environ.get("COOKIE_CACHE_TTL", 60))
+
+# Вид выдаваемых cookie:
+#   sign - "id.секрет", по строке auth_session на каждое устройство, в базе хранится sha256 секрета.
+#          Cookie прежнего вида с подписью в user.sign и admin.sign принимаются до их отзыва;
+#   token - токен JWT (HS256) с id, ролью, версией токенов владельца и сроком действия,
+#           проверяется без обращения к базе.
+# Cookie обоих видов принимаются в любом режиме, что позволяет переходить между ними
+# без выхода пользователей из аккаунтов
+COOKIE_MODE = _os.environ.get("COOKIE_MODE", "sign")
+
+COOKIE_TOKEN_SECRET = _os.environ.get("COOKIE_TOKEN_SECRET")
+
+COOKIE_TOKEN_TTL = int(_os.environ.get("COOKIE_TOKEN_TTL", 7 * 24 * 3600))
+
+COOKIE_TOKEN_ALGORITHM = "HS256"
+
+# Время жизни входа с устройства без активности, секунды.
+# Срок продлевается при записи отметок присутствия (модуль presence)
+AUTH_SESSION_TTL = int(_os.environ.get("AUTH_SESSION_TTL", 30 * 24 * 3600))
+
+if COOKIE_MODE not in ("sign", "token"):
+    raise ValueError(f"Unsupported cookie mode: {COOKIE_MODE}")
+
+if COOKIE_MODE == "token" and not COOKIE_TOKEN_SECRET:
+    raise ValueError("COOKIE_TOKEN_SECRET is required in token cookie mode")
+
+
 class CookieError(Exception):
     pass
 
@@ -29,75 +69,416 @@ class InvalidCookieEror(CookieError):
     pass
 
 
+class Principal(_typing.NamedTuple):
+
+    """
+    Владелец cookie: id модели, роль (admin, student, teacher),
+    id учителя, если владелец - учитель, версия токенов для cookie-токена
+    и id входа с устройства (auth_session) для cookie устройства
+    """
+
+    id: int
+    role: str
+    teacher_id: _typing.Optional[int] = None
+    version: _typing.Optional[int] = None
+    session: _typing.Optional[int] = None
+
+    @property
+    def owner(self) -> _typing.Tuple[str, int]:
+        return ("admin" if self.role == "admin" else "user", self.id)
+
+    @classmethod
+    def of(cls, model: _models.signable) -> "Principal":
+        if isinstance(model, _models.Admin):
+            return cls(model.id, "admin")
+        if model.role == "teacher":
+            return cls(model.id, "teacher", model.id)
+        return cls(model.id, model.role)
+
+
+class PrincipalCache():
+
+    """
+    Кэш LRU с ограниченным временем жизни записей: значение cookie -> владелец.
+    У владельца может быть по cookie на каждое устройство, все они сбрасываются invalidate_owner
+    """
+
+    maxsize: int
+    ttl: float
+    hits: int
+    misses: int
+    invalidations: int
+
+    def __init__(self, maxsize: int = COOKIE_CACHE_SIZE, ttl: float = COOKIE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: _collections.OrderedDict[str, _typing.Tuple[Principal, float]] = _collections.OrderedDict()
+        self._owners: _typing.Dict[_typing.Tuple[str, int], _typing.Set[str]] = {}
+
+    def get(self, cookie: str) -> _typing.Optional[Principal]:
+        entry = self._entries.get(cookie)
+        if entry is None or entry[1] < _time.monotonic():
+            if entry is not None:
+                self._remove(cookie)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(cookie)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, cookie: str, principal: Principal):
+        if cookie in self._entries:
+            self._remove(cookie)
+        self._entries[cookie] = (principal, _time.monotonic() + self.ttl)
+        self._owners.setdefault(principal.owner, set()).add(cookie)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, cookie: _typing.Optional[str]):
+        if cookie in self._entries:
+            self._remove(cookie)
+            self.invalidations += 1
+
+    def invalidate_owner(self, kind: str, id: int):
+        for cookie in list(self._owners.get((kind, id), ())):
+            self.invalidate(cookie)
+
+    def clear(self):
+        self._entries.clear()
+        self._owners.clear()
+
+    def stats(self) -> _schemas.PrincipalCacheStats:
+        return _schemas.PrincipalCacheStats(
+            size=len(self._entries),
+            maxsize=self.maxsize,
+            ttl=self.ttl,
+            hits=self.hits,
+            misses=self.misses,
+            invalidations=self.invalidations
+        )
+
+    def _remove(self, cookie: str):
+        principal, _ = self._entries.pop(cookie)
+        cookies = self._owners.get(principal.owner)
+        if cookies is not None:
+            cookies.discard(cookie)
+            if not cookies:
+                del self._owners[principal.owner]
+
+
+principals = PrincipalCache()
+
+
+def is_token(cookie: str) -> bool:
+    return cookie.count(".") == 2
+
+
+def encode_token(model: _models.signable) -> str:
+    principal = Principal.of(model)
+    now = int(_time.time())
+    return _jwt.encode(
+        {
+            "sub": str(principal.id),
+            "role": principal.role,
+            "ver": model.token_version or 0,
+            "iat": now,
+            "exp": now + COOKIE_TOKEN_TTL,
+        },
+        COOKIE_TOKEN_SECRET,
+        algorithm=COOKIE_TOKEN_ALGORITHM
+    )
+
+
+def decode_token(cookie: str) -> Principal:
+
+    """
+    Проверяет подпись и срок действия cookie-токена и возвращает его владельца.
+    Версия токенов владельца сверяется позже, при загрузке его модели
+    """
+
+    if not COOKIE_TOKEN_SECRET:
+        raise InvalidSignError
+    try:
+        claims = _jwt.decode(
+            cookie,
+            COOKIE_TOKEN_SECRET,
+            algorithms=[COOKIE_TOKEN_ALGORITHM],
+            options={"require": ["sub", "role", "ver", "exp"]}
+        )
+        id = int(claims["sub"])
+        role = str(claims["role"])
+        version = int(claims["ver"])
+    except (_jwt.PyJWTError, TypeError, ValueError):
+        raise InvalidSignError
+    return Principal(id, role, id if role == "teacher" else None, version)
+
+
+def revoke_tokens(model: _models.signable):
+
+    """
+    Отзывает все выданные владельцу cookie-токены, увеличивая версию его токенов.
+    Изменение фиксирует вызывающий
+    """
+
+    model.token_version = (model.token_version or 0) + 1
+    principals.invalidate_owner(*Principal.of(model).owner)
+
+
+def hash_secret(secret: str) -> str:
+    return _hash.sha256(secret.encode()).hexdigest()
+
+
+def _session_owner(model: _typing.Union[_models.signable, _typing.Type[_database.Base]]) -> _sql.Column:
+    admin = model is _models.Admin or isinstance(model, _models.Admin)
+    return _models.AuthSession.admin_id if admin else _models.AuthSession.user_id
+
+
+async def revoke_session(
+        cookie: str,
+        db: _asyncio.AsyncSession
+):
+
+    """
+    Завершает вход с устройства, выдавшего cookie.
+    Изменение фиксирует вызывающий
+    """
+
+    principals.invalidate(cookie)
+    if is_token(cookie):
+        return
+    _, secret = parse_sign_cookie(cookie)
+    await db.execute(
+        _sql.delete(_models.AuthSession)
+        .where(_models.AuthSession.token_hash == hash_secret(secret))
+    )
+
+
+async def revoke_sessions(
+        model: _models.signable,
+        db: _asyncio.AsyncSession
+):
+
+    """
+    Отзывает все входы владельца: входы с устройств, cookie-токены и подпись прежнего вида.
+    Изменение фиксирует вызывающий
+    """
+
+    revoke_tokens(model)
+    model.sign = None
+    await db.execute(
+        _sql.delete(_models.AuthSession)
+        .where(_session_owner(model) == model.id)
+    )
+
+
 async def genetate_cookie(
         model: _models.signable,
-        db: _orm.Session
+        db: _asyncio.AsyncSession,
+        cookie: _typing.Optional[str] = None
 ):
 
     """
-    Создает случайную подпись для куки и сохраняет ее в базе данных.
-    Вовзращает новое значение куки.
+    Создает вход с устройства (строку auth_session) со случайным секретом.
+    Вовзращает новое значение куки и добавляет его в кэш.
+    cookie - уже проверенная вызывающим cookie устройства того же владельца:
+    она возвращается без изменений, новый вход не создается.
+    В режиме token выдает cookie-токен, не записывая ничего в базу
     """
 
-    timestamp = str(_dt.datetime.now().timestamp()+_rand.randint(0, 99999999))
-    sign = _hash.sha256(timestamp.encode()).hexdigest()
-    model.sign = sign
-    db.commit()
-    return f"{model.id}.{sign}"
+    if COOKIE_MODE == "token":
+        return encode_token(model)
+
+    if cookie and not is_token(cookie):
+        uid, secret = parse_sign_cookie(cookie)
+        if uid == model.id and secret != model.sign:
+            return cookie
+
+    secret = _secrets.token_urlsafe(32)
+    now = _dt.datetime.utcnow()
+    session = _models.AuthSession(
+        token_hash=hash_secret(secret),
+        date_created=now,
+        date_seen=now,
+        date_expired=now + _dt.timedelta(seconds=AUTH_SESSION_TTL)
+    )
+    if isinstance(model, _models.Admin):
+        session.admin_id = model.id
+    else:
+        session.user_id = model.id
+    db.add(session)
+    await db.commit()
+    cookie = f"{model.id}.{secret}"
+    principals.put(cookie, Principal.of(model)._replace(session=session.id))
+    return cookie
 
 
 async def check_cookie(
         cookie: str,
         model: _typing.Type[_database.Base],
-        db: _orm.Session
+        db: _asyncio.AsyncSession
 ):
 
     """
     Проверяет цифровую подпись куки и, если все в порядке, возвращает модель пользователя
     """
 
-    try:
-        values = cookie.split(".")
-        uid = int(values[0])
-        sign = values[1]
-    except (TypeError, ValueError, KeyError):
-        raise InvalidCookieEror
+    if is_token(cookie):
+        principal = decode_token(cookie)
+        if (principal.role == "admin") != (model is _models.Admin):
+            raise InvalidSignError
+        user = await db.get(model, principal.id)
+        if not user or user.token_version != principal.version:
+            raise InvalidSignError
+        return user
 
-    user = db.get(model, uid)
+    uid, sign = parse_sign_cookie(cookie)
+
+    user = await db.get(model, uid)
+
+    if not user or user.id != uid:
+        raise InvalidSignError
 
-    if user.sign != sign or user.id != uid:
+    if user.sign != sign and not await db.scalar(
+        _sql.select(_models.AuthSession.id)
+        .where(_models.AuthSession.token_hash == hash_secret(sign))
+        .where(_session_owner(model) == uid)
+        .where(_models.AuthSession.date_expired > _dt.datetime.utcnow())
+    ):
         raise InvalidSignError
 
     return user
 
 
+def parse_sign_cookie(cookie: str) -> _typing.Tuple[int, str]:
+
+    """
+    Разбирает cookie вида "id.подпись" (или "id.секрет" для входа с устройства).
+    Пустая подпись недействительна: она совпала бы с подписью нового пользователя
+    """
+
+    try:
+        values = cookie.split(".")
+        uid = int(values[0])
+        sign = values[1]
+    except (TypeError, ValueError, IndexError):
+        raise InvalidCookieEror
+    if not sign:
+        raise InvalidCookieEror
+    return uid, sign
+
+
 async def check_user_cookie(
         cookie: str,
-        db: _orm.Session
+        db: _asyncio.AsyncSession
 ) -> _models.User:
     return await check_cookie(cookie, _models.User, db)
 
 
 async def check_admin_cookie(
         cookie: str,
-        db: _orm.Session
+        db: _asyncio.AsyncSession
 ) -> _models.Admin:
     return await check_cookie(cookie, _models.Admin, db)
 
 
+class Account(_typing.NamedTuple):
+
+    """
+    Владелец cookie вместе с загруженными моделями и самой cookie.
+    user и teacher заполнены для студентов и учителей, admin - для админов
+    """
+
+    principal: Principal
+    user: _typing.Optional[_models.User] = None
+    teacher: _typing.Optional[_models.Teacher] = None
+    admin: _typing.Optional[_models.Admin] = None
+    cookie: _typing.Optional[str] = None
+
+    @property
+    def role(self) -> str:
+        return self.principal.role
+
+    @property
+    def model(self) -> _typing.Union[_models.Admin, _models.Teacher, _models.User]:
+        if self.principal.role == "admin":
+            return self.admin
+        if self.principal.role == "teacher":
+            return self.teacher
+        return self.user
+
+
+async def resolve(
+        cookie: str,
+        db: _asyncio.AsyncSession
+) -> Account:
+
+    """
+    Определяет владельца cookie одним запросом: вход с устройства по хешу секрета,
+    админ, пользователь и его строка учителя присоединяются к одной строке
+    по id и входу с устройства (подписи прежнего вида или версии токена).
+    Роль выбирается в прежнем порядке: админ, подтвердивший почту учитель, студент
+    """
+
+    auth = _models.AuthSession
+    if is_token(cookie):
+        principal = decode_token(cookie)
+        uid = principal.id
+        auth_condition = _sql.false()
+        admin_condition = _models.Admin.token_version == principal.version
+        user_condition = _models.User.token_version == principal.version
+        if principal.role == "admin":
+            user_condition = _sql.false()
+        else:
+            admin_condition = _sql.false()
+    else:
+        uid, sign = parse_sign_cookie(cookie)
+        auth_condition = _sql.and_(
+            auth.token_hash == hash_secret(sign),
+            auth.date_expired > _dt.datetime.utcnow()
+        )
+        admin_condition = _sql.or_(auth.admin_id == _models.Admin.id, _models.Admin.sign == sign)
+        user_condition = _sql.or_(auth.user_id == _models.User.id, _models.User.sign == sign)
+
+    one = _sql.select(_sql.literal(1).label("one")).subquery()
+    session_id, admin, user, teacher = (await db.execute(
+        _sql.select(auth.id, _models.Admin, _models.User, _models.Teacher)
+        .select_from(one)
+        .outerjoin(auth, auth_condition)
+        .outerjoin(_models.Admin, _sql.and_(_models.Admin.id == uid, admin_condition))
+        .outerjoin(_models.User, _sql.and_(_models.User.id == uid, user_condition))
+        .outerjoin(_models.Teacher, _models.Teacher.user_id == _models.User.id)
+    )).one()
+
+    if admin:
+        return Account(Principal(admin.id, "admin", session=session_id), admin=admin, cookie=cookie)
+    if not user:
+        raise InvalidSignError
+    if teacher:
+        # связь загружена тем же запросом, обращение к ней не должно идти в базу
+        _orm.attributes.set_committed_value(teacher, "user", user)
+        _orm.attributes.set_committed_value(user, "teacher", teacher)
+    if teacher and user.confirmed:
+        return Account(Principal(user.id, "teacher", user.id, session=session_id), user, teacher, cookie=cookie)
+    return Account(Principal(user.id, "student", session=session_id), user, cookie=cookie)
+
+
 async def get_signed_response(
         data: _typing.Optional[_BM],
         model: _models.signable,
-        se: _orm.Session,
+        se: _asyncio.AsyncSession,
         status: int = 200,
+        cookie: _typing.Optional[str] = None
 ):
 
     """
-    Создает новую подпись куки и формирует http-запрос
+    Выдает куки (или подтверждает уже проверенную cookie устройства) и формирует http-запрос
     """
 
     resp = _fastapi.Response(data.json() if data else None, media_type="application/json")
-    cookie = await genetate_cookie(model, se)
+    cookie = await genetate_cookie(model, se, cookie)
     resp.set_cookie("user", cookie, httponly=True)
     resp.status_code = status
     return resp
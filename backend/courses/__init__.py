@@ -1 +1,3 @@
+from . import catalog
 from . import courses
+from . import archives
@@ -0,0 +1,378 @@
+import os as _os
+import shutil as _shutil
+import codecs as _codecs
+import hashlib as _hashlib
+import posixpath as _posixpath
+import secrets as _secrets
+import tarfile as _tarfile
+import zipfile as _zipfile
+import asyncio as _aio
+import typing as _typing
+
+import aiofiles as _aiofiles
+import fastapi as _fastapi
+import pydantic as _pydantic
+from sqlalchemy.ext import asyncio as _asyncio
+from loguru import logger as _logger
+
+import schemas as _schemas
+import blobs as _blobs
+import images as _images
+import uploads as _uploads
+import database as _database
+from . import catalog as _catalog
+
+
+"""
+Импорт урока из архива zip или tar (в том числе tar.gz, tar.bz2, tar.xz).
+В архиве лежат manifest.json, тексты шагов (.txt, UTF-8) и картинки (.png, .jpg, .jpeg),
+пути в манифесте - относительно его папки:
+
+    {"steps": [{"text": "intro.txt", "image": "intro.png"}, {"text": "task.txt"}]}
+
+Архив копируется на диск частями и читается в отдельном потоке: сначала манифест,
+затем только упомянутые в нем файлы (zip - по оглавлению, tar читается по порядку файлов дважды).
+Прочие файлы, в том числе служебные файлы macOS (__MACOSX/, ._имя), не распаковываются.
+Число записей и суммарный размер всех файлов (в том числе не упомянутых в манифесте)
+проверяются по оглавлению zip и заголовкам tar в первом проходе, до распаковки файлов.
+Каждый файл частями пишется во временный файл (тексты - в папку импорта внутри папки урока,
+картинки - во временную папку blobs), в памяти не бывает больше одной части.
+Шаги добавляются после существующих только после проверки манифеста и всех файлов:
+тексты переименовываются на место, картинки переносятся в blobs и привязываются к шагам
+одной транзакцией. При ошибке не остается ни одного нового шага
+
+"""
+
+
+# наибольший размер архива
+LESSON_ARCHIVE_MAX_SIZE = int(_os.environ.get("LESSON_ARCHIVE_MAX_SIZE", 64 * 1048576))
+
+# наибольший суммарный размер распакованных файлов
+LESSON_ARCHIVE_MAX_UNPACKED = int(_os.environ.get("LESSON_ARCHIVE_MAX_UNPACKED", 256 * 1048576))
+
+LESSON_ARCHIVE_MAX_FILES = int(_os.environ.get("LESSON_ARCHIVE_MAX_FILES", 1000))
+
+LESSON_ARCHIVE_MAX_STEPS = int(_os.environ.get("LESSON_ARCHIVE_MAX_STEPS", 200))
+
+STEP_TEXT_MAX_SIZE = int(_os.environ.get("STEP_TEXT_MAX_SIZE", 1048576))
+
+MANIFEST_NAME = "manifest.json"
+
+MANIFEST_MAX_SIZE = 65536
+
+TEXT_EXTENSIONS = ("txt",)
+
+IMAGE_EXTENSIONS = ("png", "jpg", "jpeg")
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class UnsupportedArchiveError(ArchiveError):
+    pass
+
+
+class _Text(_typing.NamedTuple):
+
+    path: str
+    hash: str
+
+
+def _normalize(name: str) -> str:
+    return _posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+
+
+def _skipped(name: str) -> bool:
+    # служебные файлы macOS: папка __MACOSX/ и файлы ._имя рядом с исходными
+    return name.split("/")[0] == "__MACOSX" or _posixpath.basename(name).startswith("._")
+
+
+def _is_manifest(name: str) -> bool:
+    return _posixpath.basename(name) == MANIFEST_NAME and not _skipped(name)
+
+
+def _plan(
+        manifest: _schemas.LessonImportManifest,
+        folder: str
+) -> _typing.List[_typing.Tuple[str, _typing.Optional[str]]]:
+
+    """
+    Проверяет манифест и возвращает для каждого шага пути текста и картинки в архиве
+    """
+
+    if len(manifest.steps) > LESSON_ARCHIVE_MAX_STEPS:
+        raise ArchiveError(f"manifest has more than {LESSON_ARCHIVE_MAX_STEPS} steps")
+    steps, used = [], set()
+    for number, step in enumerate(manifest.steps, 1):
+        text = _posixpath.normpath(_posixpath.join(folder, step.text))
+        if text.rpartition(".")[2].lower() not in TEXT_EXTENSIONS:
+            raise ArchiveError(f"step {number}: {step.text} is not a .txt file")
+        if text in used:
+            raise ArchiveError(f"step {number}: text file {step.text} is used twice")
+        used.add(text)
+        image = None
+        if step.image is not None:
+            image = _posixpath.normpath(_posixpath.join(folder, step.image))
+            if image.rpartition(".")[2].lower() not in IMAGE_EXTENSIONS:
+                raise ArchiveError(f"step {number}: {step.image} is not a PNG or JPEG file")
+        steps.append((text, image))
+    return steps
+
+
+class _Unpacked():
+
+    """
+    Манифест и упомянутые в нем файлы архива, записанные во временные файлы, по нормализованным путям
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.manifest_name: _typing.Optional[str] = None
+        self.steps: _typing.List[_typing.Tuple[str, _typing.Optional[str]]] = []
+        self._wanted_texts: _typing.Set[str] = set()
+        self._wanted_images: _typing.Set[str] = set()
+        self.texts: _typing.Dict[str, _Text] = {}
+        self.images: _typing.Dict[str, _blobs.Staged] = {}
+        self.files = 0
+        self.declared = 0
+        self.unpacked = 0
+
+    def _chunks(self, name: str, stream: _typing.BinaryIO, limit: int) -> _typing.Iterator[bytes]:
+        size = 0
+        while chunk := stream.read(_uploads.UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            self.unpacked += len(chunk)
+            if size > limit:
+                raise ArchiveError(f"{name}: file is larger than {limit} bytes")
+            if self.unpacked > LESSON_ARCHIVE_MAX_UNPACKED:
+                raise ArchiveError(f"archive unpacks to more than {LESSON_ARCHIVE_MAX_UNPACKED} bytes")
+            yield chunk
+
+    def count(self, size: int):
+        # размер из заголовка учитывается для всех файлов, в том числе не упомянутых в манифесте:
+        # архив отклоняется до распаковки
+        self.files += 1
+        self.declared += size
+        if self.files > LESSON_ARCHIVE_MAX_FILES:
+            raise ArchiveError(f"archive has more than {LESSON_ARCHIVE_MAX_FILES} files")
+        if self.declared > LESSON_ARCHIVE_MAX_UNPACKED:
+            raise ArchiveError(f"archive unpacks to more than {LESSON_ARCHIVE_MAX_UNPACKED} bytes")
+
+    def read_manifest(self, name: str, stream: _typing.BinaryIO):
+        if self.manifest_name is not None:
+            raise ArchiveError(f"{name}: archive has more than one manifest")
+        content = b"".join(self._chunks(name, stream, MANIFEST_MAX_SIZE))
+        try:
+            manifest = _schemas.LessonImportManifest.parse_raw(content)
+        except _pydantic.ValidationError as e:
+            raise ArchiveError(f"invalid manifest: {e}")
+        self.steps = _plan(manifest, _posixpath.dirname(name))
+        self._wanted_texts = {text for text, _ in self.steps}
+        self._wanted_images = {image for _, image in self.steps if image is not None}
+        self.manifest_name = name
+
+    def wanted(self, name: str) -> bool:
+        return name in self._wanted_texts or name in self._wanted_images
+
+    def add(self, name: str, stream: _typing.BinaryIO):
+        if name in self.texts or name in self.images:
+            raise ArchiveError(f"{name}: duplicate file")
+        if name in self._wanted_texts:
+            self.texts[name] = self._add_text(name, stream)
+        else:
+            try:
+                self.images[name] = _blobs.stage(self._chunks(name, stream, _uploads.MAX_IMAGE_SIZE))
+            except _blobs.UnsupportedBlobError:
+                raise ArchiveError(f"{name}: not a PNG or JPEG image")
+
+    def _add_text(self, name: str, stream: _typing.BinaryIO) -> _Text:
+        path = f"{self.folder}/{len(self.texts)}.txt"
+        decoder = _codecs.getincrementaldecoder("utf-8")()
+        hasher = _hashlib.sha256()
+        try:
+            with open(path, "wb") as file:
+                for chunk in self._chunks(name, stream, STEP_TEXT_MAX_SIZE):
+                    decoder.decode(chunk)
+                    hasher.update(chunk)
+                    file.write(chunk)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            raise ArchiveError(f"{name}: text is not UTF-8")
+        # хеш как у catalog.hash_text
+        return _Text(path, hasher.hexdigest())
+
+    def discard(self):
+        for staged in self.images.values():
+            staged.discard()
+
+
+def _unpack_zip(archive: str, unpacked: _Unpacked):
+    with _zipfile.ZipFile(archive) as zip:
+        members = [(_normalize(info.filename), info) for info in zip.infolist() if not info.is_dir()]
+        for _, info in members:
+            unpacked.count(info.file_size)
+        for name, info in members:
+            if _is_manifest(name):
+                with zip.open(info) as stream:
+                    unpacked.read_manifest(name, stream)
+        if unpacked.manifest_name is None:
+            raise ArchiveError(f"archive has no {MANIFEST_NAME}")
+        for name, info in members:
+            if unpacked.wanted(name):
+                with zip.open(info) as stream:
+                    unpacked.add(name, stream)
+
+
+def _tar_members(
+        archive: str
+) -> _typing.Iterator[_typing.Tuple[str, _tarfile.TarInfo, _typing.Optional[_typing.BinaryIO]]]:
+    # потоковое чтение: записи по порядку, без поиска по архиву.
+    # у ссылок, папок и специальных файлов нет потока
+    with _tarfile.open(archive, "r|*") as tar:
+        for member in tar:
+            yield _normalize(member.name), member, tar.extractfile(member) if member.isfile() else None
+
+
+def _unpack_tar(archive: str, unpacked: _Unpacked):
+    # первый проход - число и размер записей и манифест, второй - упомянутые в манифесте файлы.
+    # запись учитывается по заголовку, до чтения ее содержимого
+    try:
+        for name, member, stream in _tar_members(archive):
+            unpacked.count(member.size if stream is not None else 0)
+            if stream is not None and _is_manifest(name):
+                unpacked.read_manifest(name, stream)
+    except _tarfile.ReadError as e:
+        if not unpacked.files:
+            raise UnsupportedArchiveError("not a zip or tar archive")
+        raise ArchiveError(f"broken archive: {e}")
+    if unpacked.manifest_name is None:
+        raise ArchiveError(f"archive has no {MANIFEST_NAME}")
+    for name, _, stream in _tar_members(archive):
+        if stream is not None and unpacked.wanted(name):
+            unpacked.add(name, stream)
+
+
+def _unpack_archive(archive: str, unpacked: _Unpacked):
+    # выполняется в потоке
+    try:
+        if _zipfile.is_zipfile(archive):
+            _unpack_zip(archive, unpacked)
+        else:
+            _unpack_tar(archive, unpacked)
+    except (_zipfile.BadZipFile, _tarfile.TarError, EOFError, OSError, ValueError) as e:
+        raise ArchiveError(f"broken archive: {e}")
+
+
+def _resolve(unpacked: _Unpacked) -> _typing.List[_typing.Tuple[_Text, _typing.Optional[str]]]:
+
+    """
+    Возвращает для каждого шага текст и путь картинки, проверяя, что все упомянутые файлы есть в архиве
+    """
+
+    steps = []
+    for number, (text, image) in enumerate(unpacked.steps, 1):
+        if text not in unpacked.texts:
+            raise ArchiveError(f"step {number}: no text file {text}")
+        if image is not None and image not in unpacked.images:
+            raise ArchiveError(f"step {number}: no image file {image}")
+        steps.append((unpacked.texts[text], image))
+    return steps
+
+
+async def _receive(
+        request: _fastapi.Request,
+        upload: _typing.Optional[_fastapi.UploadFile],
+        path: str
+):
+    size = 0
+    async with _aiofiles.open(path, "wb") as file:
+        async for chunk in _uploads.chunks(request, upload, LESSON_ARCHIVE_MAX_SIZE, "Archive too large"):
+            size += len(chunk)
+            if size > LESSON_ARCHIVE_MAX_SIZE:
+                raise _fastapi.HTTPException(413, "Archive too large")
+            await file.write(chunk)
+
+
+def _place_texts(
+        course_id: int,
+        lesson_number: int,
+        steps: _typing.List[_typing.Tuple[_Text, _typing.Optional[str]]]
+) -> _typing.List[int]:
+    # без await между выбором номеров и записью в каталог: номера не займет другой запрос
+    existing = _catalog.steps(course_id, lesson_number)
+    first = max(existing) + 1 if existing else 1
+    lesson = f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}"
+    numbers = []
+    try:
+        for number, (text, _) in enumerate(steps, first):
+            target = f"{lesson}/{number}.txt"
+            _os.replace(text.path, target)
+            numbers.append(number)
+            _catalog.add_step(course_id, lesson_number, number, text.hash, _os.stat(target))
+    except OSError:
+        _drop_texts(course_id, lesson_number, numbers)
+        raise
+    return numbers
+
+
+def _drop_texts(course_id: int, lesson_number: int, numbers: _typing.List[int]):
+    for number in numbers:
+        _catalog.drop_step(course_id, lesson_number, number)
+        try:
+            _os.remove(f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}/{number}.txt")
+        except OSError as e:
+            _logger.error(f"unable to delete imported step text: {e=}")
+
+
+async def import_lesson(
+        course_id: int,
+        lesson_number: int,
+        request: _fastapi.Request,
+        upload: _typing.Optional[_fastapi.UploadFile],
+        se: _asyncio.AsyncSession
+) -> _schemas.LessonImportReport:
+
+    """
+    Добавляет к уроку шаги из архива. Возвращает номера созданных шагов
+    """
+
+    if not _catalog.has_lesson(course_id, lesson_number):
+        raise _fastapi.HTTPException(404, "no such lesson")
+    folder = f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}/.import-{_secrets.token_hex(8)}"
+    _os.mkdir(folder)
+    unpacked = _Unpacked(folder)
+    try:
+        archive = f"{folder}/archive"
+        await _receive(request, upload, archive)
+        try:
+            await _aio.get_running_loop().run_in_executor(None, _unpack_archive, archive, unpacked)
+            steps = _resolve(unpacked)
+        except UnsupportedArchiveError as e:
+            raise _fastapi.HTTPException(415, str(e))
+        except ArchiveError as e:
+            raise _fastapi.HTTPException(400, str(e))
+        numbers = _place_texts(course_id, lesson_number, steps)
+        try:
+            blobs = {}
+            async with _database.transaction(se):
+                for _, image in steps:
+                    if image is not None and image not in blobs:
+                        blobs[image] = await _blobs.store(unpacked.images[image], se)
+                await _blobs.attach_many({
+                    _blobs.step_owner(course_id, lesson_number, number): blobs[image].hash
+                    for number, (_, image) in zip(numbers, steps)
+                    if image is not None
+                }, se)
+        except BaseException:
+            _drop_texts(course_id, lesson_number, numbers)
+            raise
+        for number, (_, image) in zip(numbers, steps):
+            if image is not None:
+                _catalog.set_image(course_id, lesson_number, number, _catalog.image_of(blobs[image]))
+    finally:
+        unpacked.discard()
+        _shutil.rmtree(folder, ignore_errors=True)
+    for blob in blobs.values():
+        await _images.generate(blob.hash, blob.mime)
+    return _schemas.LessonImportReport(steps=numbers)
@@ -0,0 +1,307 @@
+import os as _os
+import json as _json
+import hashlib as _hashlib
+import typing as _typing
+
+try:
+    import fcntl as _fcntl
+except ImportError:
+    # Windows: блокировка дерева не поддерживается
+    _fcntl = None
+
+import sqlalchemy as _sql
+from loguru import logger as _logger
+
+import database as _database
+import models as _models
+import blobs as _blobs
+
+
+"""
+Каталог содержимого курсов: курс -> урок -> шаг -> (размер и время изменения текста,
+хеш текста, sha256, тип, размер и время создания картинки в хранилище blobs).
+Строится при запуске обходом дерева courses/courses и чтением ссылок шагов на blobs
+и дальше поддерживается функциями модуля courses,
+поэтому проверки существования уроков, шагов и картинок не обращаются к диску и базе.
+Снимок каталога хранится в courses/catalog.json: при запуске хеш текста берется из снимка,
+если размер и время изменения файла не изменились, иначе файл читается заново.
+Каталог живет в памяти процесса: дерево меняет только этот процесс,
+поэтому приложение запускается одним процессом (uvicorn без --workers).
+При запуске процесс берет блокировку courses/catalog.lock (lock), второй процесс приложения
+с тем же деревом не запустится: в его каталоге не было бы шагов, созданных первым
+
+"""
+
+
+class CatalogLockedError(Exception):
+    pass
+
+
+class Step(_typing.NamedTuple):
+
+    """
+    Шаг урока. Время изменения - в наносекундах (st_mtime_ns),
+    image - sha256 картинки в хранилище blobs
+    """
+
+    size: int
+    mtime: int
+    hash: str
+    image: _typing.Optional[str] = None
+    image_mime: _typing.Optional[str] = None
+    image_size: _typing.Optional[int] = None
+    image_mtime: _typing.Optional[int] = None
+
+
+class Image(_typing.NamedTuple):
+
+    hash: str
+    mime: str
+    size: int
+    mtime: int
+
+
+def image_of(blob: _models.Blob) -> Image:
+    return Image(blob.hash, blob.mime, blob.size, _blobs.mtime(blob))
+
+
+# id курса -> номер урока -> номер шага -> шаг
+_courses: _typing.Dict[int, _typing.Dict[int, _typing.Dict[int, Step]]] = {}
+
+_loaded = False
+
+_lock: _typing.Optional[_typing.TextIO] = None
+
+
+def _root() -> str:
+    return f"{_os.getcwd()}/courses/courses"
+
+
+def _snapshot_path() -> str:
+    return f"{_os.getcwd()}/courses/catalog.json"
+
+
+def _lock_path() -> str:
+    return f"{_os.getcwd()}/courses/catalog.lock"
+
+
+def hash_text(content: bytes) -> str:
+    return _hashlib.sha256(content).hexdigest()
+
+
+def _read_snapshot() -> _typing.Dict[str, list]:
+    try:
+        with open(_snapshot_path(), "r", encoding="utf-8") as file:
+            return _json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (ValueError, OSError) as e:
+        _logger.warning(f"content catalog snapshot is unreadable, rebuilding: {e=}")
+        return {}
+
+
+def _load_images() -> _typing.Dict[str, Image]:
+    with _database.SessionLocal() as se:
+        rows = se.execute(
+            _sql.select(_models.BlobRef.owner, _models.Blob)
+            .join(_models.Blob, _models.Blob.hash == _models.BlobRef.blob_hash)
+            .where(_models.BlobRef.owner >= "step:", _models.BlobRef.owner < "step;")
+        ).all()
+        # ключ как в снимке: "курс/урок/шаг"
+        return {owner.removeprefix("step:"): image_of(blob) for owner, blob in rows}
+
+
+def _scan_lesson(
+        path: str,
+        key: str,
+        snapshot: _typing.Dict[str, list],
+        images: _typing.Dict[str, Image]
+) -> _typing.Dict[int, Step]:
+    texts: _typing.Dict[int, _os.stat_result] = {}
+    with _os.scandir(path) as entries:
+        for entry in entries:
+            number, _, ext = entry.name.partition(".")
+            if number.isdigit() and ext == "txt" and entry.is_file():
+                texts[int(number)] = entry.stat()
+    steps = {}
+    for number, stat in texts.items():
+        cached = snapshot.get(f"{key}/{number}")
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            digest = cached[2]
+        else:
+            with open(f"{path}/{number}.txt", "rb") as file:
+                digest = hash_text(file.read())
+        steps[number] = Step(stat.st_size, stat.st_mtime_ns, digest)._replace(
+            **_image_fields(images.get(f"{key}/{number}"))
+        )
+    return steps
+
+
+def build():
+
+    """
+    Обходит дерево курсов и заполняет каталог. Вызывается при запуске приложения
+    """
+
+    global _courses, _loaded
+    snapshot = _read_snapshot()
+    images = _load_images()
+    courses = {}
+    root = _root()
+    _os.makedirs(root, exist_ok=True)
+    for course in _os.listdir(root):
+        if not course.isdigit() or not _os.path.isdir(f"{root}/{course}"):
+            continue
+        lessons = courses[int(course)] = {}
+        for lesson in _os.listdir(f"{root}/{course}"):
+            if lesson.isdigit() and _os.path.isdir(f"{root}/{course}/{lesson}"):
+                lessons[int(lesson)] = _scan_lesson(f"{root}/{course}/{lesson}", f"{course}/{lesson}", snapshot, images)
+    _courses = courses
+    _loaded = True
+    save()
+
+
+def lock():
+
+    """
+    Закрепляет дерево курсов за процессом до его завершения.
+    Если дерево уже закреплено другим процессом, вызывает CatalogLockedError
+    """
+
+    global _lock
+    if _fcntl is None or _lock is not None:
+        return
+    _os.makedirs(_root(), exist_ok=True)
+    file = open(_lock_path(), "w")
+    try:
+        _fcntl.flock(file, _fcntl.LOCK_EX | _fcntl.LOCK_NB)
+    except BlockingIOError:
+        file.close()
+        raise CatalogLockedError(
+            "course tree is used by another application process: "
+            "the content catalog is per-process, run the application as a single worker"
+        )
+    _lock = file
+
+
+def save():
+
+    """
+    Записывает снимок каталога: во временный файл, затем переименованием
+    """
+
+    path = _snapshot_path()
+    snapshot = {
+        f"{course}/{lesson}/{number}": [step.size, step.mtime, step.hash]
+        for course, lessons in _courses.items()
+        for lesson, steps in lessons.items()
+        for number, step in steps.items()
+    }
+    try:
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            _json.dump(snapshot, file)
+        _os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        _logger.error(f"unable to save content catalog snapshot: {e=}")
+
+
+def _ensure_loaded():
+    # модуль может использоваться без запуска приложения (скрипты, бот)
+    if not _loaded:
+        build()
+
+
+def has_course(course_id: int) -> bool:
+    _ensure_loaded()
+    return course_id in _courses
+
+
+def lessons(course_id: int) -> _typing.List[int]:
+    _ensure_loaded()
+    return sorted(_courses.get(course_id, {}))
+
+
+def has_lesson(course_id: int, lesson_number: int) -> bool:
+    _ensure_loaded()
+    return lesson_number in _courses.get(course_id, {})
+
+
+def steps(course_id: int, lesson_number: int) -> _typing.Dict[int, Step]:
+    _ensure_loaded()
+    return _courses.get(course_id, {}).get(lesson_number, {})
+
+
+def get_step(course_id: int, lesson_number: int, step_number: int) -> _typing.Optional[Step]:
+    return steps(course_id, lesson_number).get(step_number)
+
+
+def add_course(course_id: int):
+    _ensure_loaded()
+    _courses.setdefault(course_id, {})
+
+
+def add_lesson(course_id: int, lesson_number: int):
+    _ensure_loaded()
+    _courses.setdefault(course_id, {}).setdefault(lesson_number, {})
+
+
+def set_text(course_id: int, lesson_number: int, step_number: int, content: bytes, stat: _os.stat_result):
+    _ensure_loaded()
+    lesson = _courses.setdefault(course_id, {}).setdefault(lesson_number, {})
+    step = lesson.get(step_number)
+    lesson[step_number] = Step(
+        stat.st_size,
+        stat.st_mtime_ns,
+        hash_text(content),
+        *(step[3:] if step else ())
+    )
+
+
+def add_step(course_id: int, lesson_number: int, step_number: int, text_hash: str, stat: _os.stat_result):
+
+    """
+    Добавляет шаг, хеш текста которого уже посчитан (импорт урока)
+    """
+
+    _ensure_loaded()
+    _courses.setdefault(course_id, {}).setdefault(lesson_number, {})[step_number] = Step(
+        stat.st_size,
+        stat.st_mtime_ns,
+        text_hash
+    )
+
+
+def _image_fields(image: _typing.Optional[Image]) -> dict:
+    return {
+        "image": image.hash if image else None,
+        "image_mime": image.mime if image else None,
+        "image_size": image.size if image else None,
+        "image_mtime": image.mtime if image else None
+    }
+
+
+def set_image(
+        course_id: int,
+        lesson_number: int,
+        step_number: int,
+        image: _typing.Optional[Image]
+):
+    lesson = steps(course_id, lesson_number)
+    step = lesson.get(step_number)
+    if step is None:
+        return
+    lesson[step_number] = step._replace(**_image_fields(image))
+
+
+def drop_step(course_id: int, lesson_number: int, step_number: int):
+    steps(course_id, lesson_number).pop(step_number, None)
+
+
+def drop_lesson(course_id: int, lesson_number: int):
+    _ensure_loaded()
+    _courses.get(course_id, {}).pop(lesson_number, None)
+
+
+def drop_course(course_id: int):
+    _ensure_loaded()
+    _courses.pop(course_id, None)
@@ -1,97 +1,210 @@
 import os as _os
 import shutil as _shutil
+import asyncio as _aio
+import typing as _typing
 
 import aiofiles as _aiofiles
 import fastapi as _fastapi
+from sqlalchemy.ext import asyncio as _asyncio
 from loguru import logger as _logger
 
 import tg as _tg
+import httpcache as _httpcache
+import schemas as _schemas
+import blobs as _blobs
+import images as _images
+import uploads as _uploads
+import database as _database
+from . import catalog as _catalog
 
 
 """
-Оперирует медиа-данными, относящимися к курсам
+Оперирует медиа-данными, относящимися к курсам.
+Наличие курсов, уроков, шагов и картинок проверяется по каталогу содержимого (catalog),
+функции, меняющие дерево курсов, обновляют каталог.
+Картинки шагов хранятся в хранилище blobs
 
 """
 
 
+# число текстов шагов, читаемых одновременно при сборке урока
+BUNDLE_READ_CONCURRENCY = int(_os.environ.get("BUNDLE_READ_CONCURRENCY", 16))
+
+
 def is_course_initialized(id: int):
-    return _os.path.isdir(f"{_os.getcwd()}/courses/courses/{id}")
+    return _catalog.has_course(id)
 
 
 def initialize_course(id: int):
     if is_course_initialized(id):
         raise _fastapi.HTTPException(409, "Course already initialized")
     _os.mkdir(f"{_os.getcwd()}/courses/courses/{id}")
+    _catalog.add_course(id)
 
 
 def is_lesson_initialized(course_id: int, lesson_number: int):
-    return _os.path.isdir(f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}")
+    return _catalog.has_lesson(course_id, lesson_number)
 
 
 def get_course_initialized_lessons(course_id: int):
-    return list(map(int, _os.listdir(f"{_os.getcwd()}/courses/courses/{course_id}")))
+    return _catalog.lessons(course_id)
 
 
 def initialize_lesson(course_id: int, lesson_number: int):
     if is_lesson_initialized(course_id, lesson_number):
         raise _fastapi.HTTPException(409, "Course already initialized")
     _os.mkdir(f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}")
+    _catalog.add_lesson(course_id, lesson_number)
 
 
 def is_step_initialized(course_id: int, lesson_number: int, step_number: int):
-    return _os.path.isfile(f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}/{step_number}.txt")
+    return _catalog.get_step(course_id, lesson_number, step_number) is not None
 
 
 def get_lesson_steps_numbers(course_id: int, lesson_number: int):
-    return list(set(map(
-        lambda step: int(step.split(".")[0]),
-        _os.listdir(f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}")
-    )))
+    return sorted(_catalog.steps(course_id, lesson_number))
 
 
 async def initialize_step(course_id: int, lesson_number: int):
     existing_steps = get_lesson_steps_numbers(course_id, lesson_number)
     step_number = 1 if not existing_steps else max(existing_steps)+1
-    async with _aiofiles.open(
-        f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}/{step_number}.txt",
-        "w",
-        encoding="utf-8"
-    ) as file:
-        await file.write("")
+    path = f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}/{step_number}.txt"
+    async with _aiofiles.open(path, "wb") as file:
+        await file.write(b"")
+    _catalog.set_text(course_id, lesson_number, step_number, b"", _os.stat(path))
     return step_number
 
 
-async def get_step_text(course_id: int, lesson_number: int, step_number: int):
-    if not is_step_initialized(course_id, lesson_number, step_number):
+async def get_step_text(
+        course_id: int,
+        lesson_number: int,
+        step_number: int,
+        request: _fastapi.Request
+):
+    step = _catalog.get_step(course_id, lesson_number, step_number)
+    if step is None:
         raise _fastapi.HTTPException(404, "No such step in lesson")
+    headers = _httpcache.headers(step_etag(step), step.mtime)
+    if _httpcache.is_not_modified(request, step_etag(step), step.mtime):
+        return _httpcache.not_modified(headers)
     async with _aiofiles.open(
             f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}/{step_number}.txt",
             "r",
             encoding="utf-8"
     ) as file:
-        return await file.read()
-
-
-def _find_step_image_name(course_id: int, lesson_number: int, step_number: int):
-    steps = tuple(
-        set(_os.listdir(f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}"))
-        .intersection({f"{step_number}.png", f"{step_number}.jpg", f"{step_number}.jpeg"})
-    )
-    assert len(steps) < 2
-    return steps[0] if steps else None
+        return _fastapi.responses.JSONResponse(await file.read(), headers=headers)
 
 
 def is_step_has_image(course_id: int, lesson_number: int, step_number: int):
-    if not is_step_initialized(course_id, lesson_number, step_number):
-        raise _fastapi.HTTPExceptio(404, "No such step in lesson")
-    return bool(_find_step_image_name(course_id, lesson_number, step_number))
+    step = _catalog.get_step(course_id, lesson_number, step_number)
+    if step is None:
+        raise _fastapi.HTTPException(404, "No such step in lesson")
+    return step.image is not None
 
 
-async def get_step_image(course_id: int, lesson_number: int, step_number: int):
+async def get_step_image(
+        course_id: int,
+        lesson_number: int,
+        step_number: int,
+        request: _fastapi.Request,
+        size: _typing.Optional[_schemas.image_sizes] = None
+):
     if not is_step_has_image(course_id, lesson_number, step_number):
         raise _fastapi.HTTPException(404, "No step image")
-    image_name = _find_step_image_name(course_id, lesson_number, step_number)
-    return _fastapi.responses.FileResponse(f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}/{image_name}")
+    step = _catalog.get_step(course_id, lesson_number, step_number)
+    # адрес с актуальной версией (step_image_url) можно кэшировать навсегда
+    versioned = request.query_params.get("v") == step.image[:16]
+    return await _images.serve(
+        request,
+        step.image,
+        step.image_mime,
+        step.image_mtime,
+        size,
+        _httpcache.IMMUTABLE if versioned else _httpcache.REVALIDATE
+    )
+
+
+def step_etag(step: _catalog.Step) -> str:
+    return f'"{step.hash[:32]}"'
+
+
+def step_image_etag(step: _catalog.Step) -> _typing.Optional[str]:
+    # как blobs.etag
+    return f'"{step.image[:32]}"' if step.image else None
+
+
+def step_image_url(course_id: int, lesson_number: int, step_number: int, step: _catalog.Step) -> _typing.Optional[str]:
+    if not step.image:
+        return None
+    # версия в адресе меняется вместе с картинкой
+    return f"/api/courses/{course_id}/lessons/{lesson_number}/steps/{step_number}/image?v={step.image[:16]}"
+
+
+async def _read_bundle_step(
+        course_id: int,
+        lesson_number: int,
+        step_number: int,
+        step: _catalog.Step,
+        semaphore: _aio.Semaphore
+) -> _typing.Optional[_schemas.LessonBundleStep]:
+    async with semaphore:
+        try:
+            async with _aiofiles.open(
+                    f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}/{step_number}.txt",
+                    "r",
+                    encoding="utf-8"
+            ) as file:
+                text = await file.read()
+        except FileNotFoundError:
+            # шаг удален после чтения каталога
+            return None
+    return _schemas.LessonBundleStep(
+        number=step_number,
+        text=text,
+        etag=step_etag(step),
+        image=step_image_url(course_id, lesson_number, step_number, step),
+        image_etag=step_image_etag(step)
+    )
+
+
+def _bundle_reads(course_id: int, lesson_number: int) -> _typing.List[_typing.Awaitable]:
+    semaphore = _aio.Semaphore(BUNDLE_READ_CONCURRENCY)
+    steps = _catalog.steps(course_id, lesson_number)
+    return [
+        _read_bundle_step(course_id, lesson_number, number, steps[number], semaphore)
+        for number in sorted(steps)
+    ]
+
+
+async def get_lesson_bundle_steps(course_id: int, lesson_number: int) -> _typing.List[_schemas.LessonBundleStep]:
+
+    """
+    Тексты всех шагов урока, прочитанные параллельно, со ссылками на картинки
+    """
+
+    return [s for s in await _aio.gather(*_bundle_reads(course_id, lesson_number)) if s is not None]
+
+
+async def stream_lesson_bundle(
+        lesson: _schemas.SqlLesson,
+        course_id: int
+) -> _typing.AsyncIterator[bytes]:
+
+    """
+    Урок построчно в NDJSON: первая строка - урок, дальше шаги по порядку.
+    Чтение идет параллельно, строка шага отправляется, как только прочитаны все предыдущие
+    """
+
+    yield lesson.json().encode() + b"\n"
+    tasks = [_aio.ensure_future(read) for read in _bundle_reads(course_id, lesson.number)]
+    try:
+        for task in tasks:
+            step = await task
+            if step is not None:
+                yield step.json().encode() + b"\n"
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 async def write_into_step(
@@ -102,66 +215,59 @@ async def write_into_step(
 ):
     if not is_step_initialized(course_id, lesson_number, step_number):
         raise _fastapi.HTTPException(404, "No such lesson step")
-    async with _aiofiles.open(
-            f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}/{step_number}.txt",
-            "w",
-            encoding="utf-8"
-    ) as file:
-        await file.write(text)
+    path = f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}/{step_number}.txt"
+    content = text.encode("utf-8")
+    async with _aiofiles.open(path, "wb") as file:
+        await file.write(content)
+    _catalog.set_text(course_id, lesson_number, step_number, content, _os.stat(path))
 
 
 async def upload_step_image(
         course_id: int,
         lesson_number: int,
         step_number: int,
-        upload: _fastapi.UploadFile
+        request: _fastapi.Request,
+        upload: _typing.Optional[_fastapi.UploadFile],
+        se: _asyncio.AsyncSession
 ):
     if not is_step_initialized(course_id, lesson_number, step_number):
         raise _fastapi.HTTPException(404, "No such lesson step")
     if is_step_has_image(course_id, lesson_number, step_number):
         raise _fastapi.HTTPException(409, "step already have an image")
-    ext = upload.filename.split(".")[-1].lower()
-    if ext not in ("png", "jpg", "jpeg"):
-        raise _fastapi.HTTPException(415, "Unsupportable image type")
-    if upload.size > 1048576:
-        raise _fastapi.HTTPException(413, "Image too large")
-    async with _aiofiles.open(
-        f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}/{step_number}.{ext}",
-        "wb"
-    ) as file:
-        content = await upload.read()
-        await file.write(content)
+    async with _database.transaction(se):
+        blob = await _uploads.receive_image(request, upload, se)
+        await _blobs.attach(_blobs.step_owner(course_id, lesson_number, step_number), blob.hash, se)
+    _catalog.set_image(course_id, lesson_number, step_number, _catalog.image_of(blob))
+    await _images.generate(blob.hash, blob.mime)
 
 
 async def drop_step_image(
         course_id: int,
         lesson_number: int,
         step_number: int,
+        se: _asyncio.AsyncSession
 ):
     if not is_step_initialized(course_id, lesson_number, step_number):
         raise _fastapi.HTTPException(404, "No such lesson step")
     if not is_step_has_image(course_id, lesson_number, step_number):
         raise _fastapi.HTTPException(404, "No image attached to step")
-    image_name = _find_step_image_name(course_id, lesson_number, step_number)
-    _os.remove(f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}/{image_name}")
+    async with _database.transaction(se):
+        await _blobs.detach(_blobs.step_owner(course_id, lesson_number, step_number), se)
+    _catalog.set_image(course_id, lesson_number, step_number, None)
 
 
 async def drop_step(
         course_id: int,
         lesson_number: int,
         step_number: int,
+        se: _asyncio.AsyncSession
 ):
     if not is_step_initialized(course_id, lesson_number, step_number):
         raise _fastapi.HTTPException(404, "No such lesson step")
-    image_name = _find_step_image_name(course_id, lesson_number, step_number)
-    if image_name:
-        try:
-            _os.remove(f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}/{image_name}")
-        except Exception as e:
-            _logger.error(f"unable to delete step image: {e=}")
-            await _tg.error(
-                f"Не удалось удалить картинку шага {step_number} урока {lesson_number} курса {course_id}: {e=}")
-            raise _fastapi.HTTPException(409, "Unable to delete step image")
+    if is_step_has_image(course_id, lesson_number, step_number):
+        async with _database.transaction(se):
+            await _blobs.detach(_blobs.step_owner(course_id, lesson_number, step_number), se)
+        _catalog.set_image(course_id, lesson_number, step_number, None)
     try:
         _os.remove(f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}/{step_number}.txt")
     except Exception as e:
@@ -169,12 +275,11 @@ async def drop_step(
         await _tg.error(
             f"Не удалось удалить текст шага {step_number} урока {lesson_number} курса {course_id}:\n\n{e=}")
         raise _fastapi.HTTPException(409, "Unable to delete step text")
+    _catalog.drop_step(course_id, lesson_number, step_number)
 
 
-async def drop_lesson(
-        course_id: int,
-        lesson_number: int
-):
+async def drop_lesson(course_id: int, lesson_number: int):
+    # вызывается после коммита services.drop_lesson
     try:
         _shutil.rmtree(f"{_os.getcwd()}/courses/courses/{course_id}/{lesson_number}")
     except Exception as e:
@@ -182,9 +287,11 @@ async def drop_lesson(
         await _tg.error(
             f"Не удалось удалить дерево урока {lesson_number} курса {course_id}\n\n{e=}")
         raise _fastapi.HTTPException(409, "Unable to delete lesson")
+    _catalog.drop_lesson(course_id, lesson_number)
 
 
 async def drop_course(course_id: int):
+    # вызывается после коммита services.drop_course
     try:
         _shutil.rmtree(f"{_os.getcwd()}/courses/courses/{course_id}")
     except Exception as e:
@@ -192,3 +299,4 @@ async def drop_course(course_id: int):
         await _tg.error(
             f"Не удалось удалить дерево курса {course_id}\n\n{e=}")
         raise _fastapi.HTTPException(409, "Unable to delete course")
+    _catalog.drop_course(course_id)
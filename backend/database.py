@@ -1,5 +1,9 @@
+import os as _os
+import contextlib as _contextlib
+
 import sqlalchemy as _sql
 import sqlalchemy.ext.declarative as _declarative
+import sqlalchemy.ext.asyncio as _asyncio
 import sqlalchemy.orm as _orm
 
 
@@ -9,12 +13,132 @@ import sqlalchemy.orm as _orm
 """
 
 
-DATABASE_URL = "sqlite:///./data/database.db"
+# Адрес базы данных задается переменной окружения DATABASE_URL.
+# Поддерживаются SQLite (по умолчанию) и PostgreSQL
+DATABASE_URL = _os.environ.get("DATABASE_URL", "sqlite:///./data/database.db")
+
+# Драйверы, используемые синхронным и асинхронным движками для каждого бэкенда
+SYNC_DRIVERS = {
+    "sqlite": "pysqlite",
+    "postgresql": "psycopg2",
+}
+
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+_url = _sql.engine.make_url(DATABASE_URL)
+
+BACKEND = _url.get_backend_name()
+
+if BACKEND not in ASYNC_DRIVERS:
+    raise ValueError(f"Unsupported database backend: {BACKEND}")
+
+SYNC_DATABASE_URL = _url.set(drivername=f"{BACKEND}+{SYNC_DRIVERS[BACKEND]}")
+
+ASYNC_DATABASE_URL = _url.set(drivername=f"{BACKEND}+{ASYNC_DRIVERS[BACKEND]}")
+
+# Соединения только для чтения: у SQLite файл открывается в режиме ro,
+# PostgreSQL может читать с реплики, адрес которой задается READONLY_DATABASE_URL
+if BACKEND == "sqlite":
+    READONLY_DATABASE_URL = ASYNC_DATABASE_URL.set(
+        database=f"file:{_url.database}",
+        query={"mode": "ro", "uri": "true"}
+    )
+else:
+    READONLY_DATABASE_URL = _sql.engine.make_url(
+        _os.environ.get("READONLY_DATABASE_URL", DATABASE_URL)
+    ).set(drivername=f"{BACKEND}+{ASYNC_DRIVERS[BACKEND]}")
+
+
+# Параметры пула соединений
+POOL_SETTINGS = {
+    "pool_size": int(_os.environ.get("DATABASE_POOL_SIZE", 5)),
+    "max_overflow": int(_os.environ.get("DATABASE_MAX_OVERFLOW", 10)),
+    "pool_recycle": int(_os.environ.get("DATABASE_POOL_RECYCLE", 1800)),
+    "pool_pre_ping": _os.environ.get("DATABASE_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+}
+
+
+# Профили соединения с SQLite: значения PRAGMA, выставляемые на каждое новое соединение.
+# Профиль выбирается переменной окружения SQLITE_PROFILE
+SQLITE_PROFILES = {
+    "default": {},
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 268435456,
+        "cache_size": -65536,
+        "busy_timeout": 5000,
+        "temp_store": "MEMORY",
+    },
+}
+
+SQLITE_PROFILE = SQLITE_PROFILES[_os.environ.get("SQLITE_PROFILE", "production")]
+
+
+def _set_sqlite_pragmas(pragmas: dict):
+
+    """
+    Создает обработчик события connect, выставляющий PRAGMA на новом соединении
+    """
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return on_connect
 
-engine = _sql.create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
+
+if BACKEND == "sqlite":
+
+    engine = _sql.create_engine(
+        SYNC_DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        **POOL_SETTINGS
+    )
+
+    # aiosqlite по умолчанию открывает новое соединение на каждый запрос,
+    # пул задается явно, чтобы соединения и выставленные на них PRAGMA переиспользовались
+    async_engine = _asyncio.create_async_engine(
+        ASYNC_DATABASE_URL,
+        poolclass=_sql.pool.AsyncAdaptedQueuePool,
+        **POOL_SETTINGS
+    )
+
+    readonly_async_engine = _asyncio.create_async_engine(
+        READONLY_DATABASE_URL,
+        poolclass=_sql.pool.AsyncAdaptedQueuePool,
+        **POOL_SETTINGS
+    )
+
+    _sql.event.listen(engine, "connect", _set_sqlite_pragmas(SQLITE_PROFILE))
+    _sql.event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas(SQLITE_PROFILE))
+    # режим журнала хранится в самом файле базы, поэтому на соединениях только для чтения он не выставляется
+    _sql.event.listen(
+        readonly_async_engine.sync_engine,
+        "connect",
+        _set_sqlite_pragmas({
+            **{k: v for k, v in SQLITE_PROFILE.items() if k != "journal_mode"},
+            "query_only": "ON"
+        })
+    )
+
+else:
+
+    engine = _sql.create_engine(SYNC_DATABASE_URL, **POOL_SETTINGS)
+
+    async_engine = _asyncio.create_async_engine(ASYNC_DATABASE_URL, **POOL_SETTINGS)
+
+    # транзакции на соединениях только для чтения открываются сервером в режиме READ ONLY
+    readonly_async_engine = _asyncio.create_async_engine(
+        READONLY_DATABASE_URL,
+        connect_args={"server_settings": {"default_transaction_read_only": "on"}},
+        **POOL_SETTINGS
+    )
 
 
 SessionLocal = _orm.sessionmaker(
@@ -23,4 +147,33 @@ SessionLocal = _orm.sessionmaker(
     bind=engine
 )
 
-Base = _declarative.declarative_base()
+AsyncSessionLocal = _asyncio.async_sessionmaker(
+    autoflush=False,
+    expire_on_commit=False,
+    bind=async_engine
+)
+
+ReadOnlySessionLocal = _asyncio.async_sessionmaker(
+    autoflush=False,
+    expire_on_commit=False,
+    bind=readonly_async_engine
+)
+
+Base = _declarative.declarative_base(cls=_asyncio.AsyncAttrs)
+
+
+@_contextlib.asynccontextmanager
+async def transaction(se: _asyncio.AsyncSession):
+
+    """
+    Единица работы: изменения, сделанные внутри блока, фиксируются одним коммитом.
+    При исключении все изменения блока откатываются
+    """
+
+    try:
+        yield se
+    except BaseException:
+        await se.rollback()
+        raise
+    else:
+        await se.commit()
@@ -0,0 +1,127 @@
+import sys as _sys
+import time as _time
+import datetime as _dt
+import asyncio as _aio
+import tempfile as _tempfile
+import statistics as _statistics
+import typing as _typing
+
+import sqlalchemy as _sql
+import sqlalchemy.orm as _orm
+from sqlalchemy.ext import asyncio as _asyncio
+
+import database as _database
+import models as _models
+import services as _services
+import loaders as _loaders
+import migrations as _migrations
+
+
+"""
+Замер пропускной способности при одновременных запросах.
+Скрипт создает временную базу SQLite с компанией из TEACHERS учителей
+и одновременно выполняет заданное число чтений страницы компании. Рядом работает задача,
+которая каждую миллисекунду засыпает и замеряет опоздание пробуждения:
+оно показывает, на сколько запросы к базе блокируют цикл событий.
+Режим sync читает синхронной сессией прямо в цикле событий, как обработчики
+до перехода на асинхронный движок, режим async - через services.get_company и AsyncSession.
+Запуск: python dbbench.py [sync|async] [число запросов]
+
+"""
+
+
+TEACHERS = 30
+
+TICK = 0.001
+
+
+def _seed(engine: _sql.Engine):
+    with _orm.Session(engine) as se:
+        company = _models.Company(name="Company")
+        specializations = [_models.Specialization(name=f"s{i}") for i in range(TEACHERS)]
+        se.add_all([company, *specializations])
+        se.flush()
+        for i, specialization in enumerate(specializations):
+            user = _models.User(
+                role="teacher", email=f"t{i}@x", password="", fname="T", lname="T", sign="", confirmed=True,
+                date_online=_dt.datetime.now()
+            )
+            se.add(user)
+            se.flush()
+            se.add(_models.Teacher(user_id=user.id, company_id=company.id))
+            se.add(_models.TeacherSpecializations(user_id=user.id, specialization_id=specialization.id))
+        se.commit()
+        return company.id
+
+
+async def _ticks(lags: _typing.List[float], done: _aio.Event):
+    while not done.is_set():
+        started = _time.perf_counter()
+        await _aio.sleep(TICK)
+        lags.append(_time.perf_counter() - started - TICK)
+
+
+async def _bench(path: str, mode: str, requests: int, company_id: int) -> _typing.Tuple[float, float, float]:
+    engine = _sql.create_engine(f"sqlite:///{path}")
+    async_engine = _asyncio.create_async_engine(
+        f"sqlite+aiosqlite:///{path}",
+        poolclass=_sql.pool.AsyncAdaptedQueuePool
+    )
+    for e in (engine, async_engine.sync_engine):
+        _sql.event.listen(e, "connect", _database._set_sqlite_pragmas(_database.SQLITE_PROFILE))
+
+    async def sync_page():
+        # блокирующий вызов: цикл событий стоит, пока идет запрос
+        with _orm.Session(engine) as se:
+            company = se.get(_models.Company, company_id, options=_loaders.COMPANY)
+            [teacher.user.email for teacher in company.teachers]
+        await _aio.sleep(0)
+
+    async def async_page():
+        async with _asyncio.AsyncSession(async_engine, expire_on_commit=False) as se:
+            await _services.get_company(company_id, se)
+
+    page = sync_page if mode == "sync" else async_page
+    await page()
+    lags = []
+    done = _aio.Event()
+    ticks = _aio.ensure_future(_ticks(lags, done))
+    try:
+        started = _time.perf_counter()
+        await _aio.gather(*(page() for _ in range(requests)))
+        elapsed = _time.perf_counter() - started
+    finally:
+        done.set()
+        await ticks
+        engine.dispose()
+        await async_engine.dispose()
+    lags.sort()
+    return (
+        requests / elapsed,
+        _statistics.median(lags) * 1000,
+        lags[int(len(lags) * 0.99)] * 1000
+    )
+
+
+def bench(path: str, mode: str = "async", requests: int = 200) -> _typing.Tuple[float, float, float]:
+
+    """
+    Выполняет замер на базе по пути path.
+    Возвращает (страниц в секунду, медиана и 99-й перцентиль опоздания цикла событий в мс)
+    """
+
+    engine = _sql.create_engine(f"sqlite:///{path}")
+    _migrations.migrate(engine)
+    company_id = _seed(engine)
+    engine.dispose()
+    return _aio.run(_bench(path, mode, requests, company_id))
+
+
+if __name__ == "__main__":
+    modes = [_sys.argv[1]] if len(_sys.argv) > 1 else ["sync", "async"]
+    requests = int(_sys.argv[2]) if len(_sys.argv) > 2 else 200
+    print(f"{'mode':8}{'pages/s':>10}{'lag p50':>10}{'lag p99':>10}")
+    for mode in modes:
+        with _tempfile.TemporaryDirectory() as directory:
+            pages, p50, p99 = bench(f"{directory}/dbbench.db", mode, requests)
+        print(f"{mode:8}{pages:10.1f}{p50:10.2f}{p99:10.2f}")
@@ -0,0 +1,104 @@
+import os as _os
+import sys as _sys
+import asyncio as _aio
+import secrets as _secrets
+import tempfile as _tempfile
+import typing as _typing
+
+import sqlalchemy as _sql
+from sqlalchemy.ext import asyncio as _asyncio
+
+import database as _database
+import migrations as _migrations
+import queryplans as _queryplans
+
+
+"""
+Проверка поддерживаемых бэкендов базы данных.
+Для каждого адреса из матрицы скрипт приводит пустую базу к последней версии схемы
+и выполняет на ней сценарий queryplans.py. Ошибки сервисов (исключения, кроме ожидаемых
+HTTPException и ошибок ссылок и cookie) и ошибки миграций считаются провалом бэкенда.
+Матрица по умолчанию - временная база SQLite и PostgreSQL по адресу из переменной
+окружения TEST_POSTGRES_URL (без нее PostgreSQL пропускается). На PostgreSQL сценарий
+выполняется в новой схеме, которая удаляется после проверки.
+Запуск: python dbmatrix.py [DATABASE_URL ...], код возврата 1 при ошибках
+
+"""
+
+
+TEST_POSTGRES_URL = _os.environ.get("TEST_POSTGRES_URL")
+
+
+def _engines(url: _sql.URL, schema: _typing.Optional[str]) -> _typing.Tuple[_sql.Engine, _asyncio.AsyncEngine]:
+    backend = url.get_backend_name()
+    if backend not in _database.ASYNC_DRIVERS:
+        raise ValueError(f"Unsupported database backend: {backend}")
+    sync_url = url.set(drivername=f"{backend}+{_database.SYNC_DRIVERS[backend]}")
+    async_url = url.set(drivername=f"{backend}+{_database.ASYNC_DRIVERS[backend]}")
+    if schema is None:
+        return _sql.create_engine(sync_url), _asyncio.create_async_engine(async_url)
+    return (
+        _sql.create_engine(sync_url, connect_args={"options": f"-csearch_path={schema}"}),
+        _asyncio.create_async_engine(async_url, connect_args={"server_settings": {"search_path": schema}})
+    )
+
+
+def _schema(url: _sql.URL, name: str, create: bool):
+    engine = _sql.create_engine(url.set(drivername=f"postgresql+{_database.SYNC_DRIVERS['postgresql']}"))
+    try:
+        with engine.begin() as conn:
+            conn.execute(_sql.text(f"CREATE SCHEMA {name}" if create else f"DROP SCHEMA {name} CASCADE"))
+    finally:
+        engine.dispose()
+
+
+def check(database_url: str) -> _typing.List[str]:
+
+    """
+    Выполняет сценарий queryplans.py на базе по адресу database_url.
+    Возвращает список ошибок
+    """
+
+    url = _sql.engine.make_url(database_url)
+    schema = None
+    if url.get_backend_name() == "postgresql":
+        schema = f"matrix_{_secrets.token_hex(4)}"
+        _schema(url, schema, True)
+    engine, async_engine = _engines(url, schema)
+    _queryplans._failures.clear()
+    try:
+        _migrations.migrate(engine)
+
+        async def run():
+            async with _asyncio.AsyncSession(async_engine, expire_on_commit=False) as se:
+                await _queryplans._scenario(se)
+            await async_engine.dispose()
+
+        _aio.run(run())
+        return list(_queryplans._failures)
+    except Exception as e:
+        return [f"{e!r}"]
+    finally:
+        engine.dispose()
+        if schema is not None:
+            _schema(url, schema, False)
+
+
+if __name__ == "__main__":
+    failed = False
+    with _tempfile.TemporaryDirectory() as directory:
+        urls = _sys.argv[1:] or [f"sqlite:///{directory}/dbmatrix.db", TEST_POSTGRES_URL]
+        for database_url in urls:
+            if database_url is None:
+                print("postgresql: SKIPPED, TEST_POSTGRES_URL is not set")
+                continue
+            backend = _sql.engine.make_url(database_url).get_backend_name()
+            try:
+                errors = check(database_url)
+            except _sql.exc.OperationalError as e:
+                errors = [f"database is unavailable: {e.orig!r}"]
+            for error in errors:
+                print(f"FAILED {backend}: {error}")
+            print(f"{backend}: {'FAILED' if errors else 'OK'}, {len(errors)} errors")
+            failed = failed or bool(errors)
+    _sys.exit(1 if failed else 0)
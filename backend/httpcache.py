@@ -0,0 +1,60 @@
+import typing as _typing
+import datetime as _dt
+from email import utils as _email_utils
+
+import fastapi as _fastapi
+
+
+"""
+Условные запросы и заголовки кэширования для файлов курсов и новостей.
+Валидаторы (ETag, Last-Modified) строятся по каталогу содержимого или stat файла,
+ответ 304 отдается без чтения файла
+
+"""
+
+
+# для адресов с версией: содержимое по такому адресу никогда не меняется
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# для адресов без версии: кэшировать можно, но перед использованием нужно проверить
+REVALIDATE = "no-cache"
+
+
+def last_modified(mtime_ns: int) -> str:
+    return _email_utils.formatdate(mtime_ns // 1_000_000_000, usegmt=True)
+
+
+def headers(etag: str, mtime_ns: int, cache_control: str = REVALIDATE) -> _typing.Dict[str, str]:
+    return {"ETag": etag, "Last-Modified": last_modified(mtime_ns), "Cache-Control": cache_control}
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # сравнение слабое: W/"x" совпадает с "x"
+    return etag.removeprefix("W/") in (t.strip().removeprefix("W/") for t in header.split(","))
+
+
+def is_not_modified(request: _fastapi.Request, etag: str, mtime_ns: int) -> bool:
+
+    """
+    Проверяет If-None-Match, а если его нет - If-Modified-Since
+    """
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None:
+        return False
+    try:
+        since = _email_utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=_dt.timezone.utc)
+    return mtime_ns // 1_000_000_000 <= int(since.timestamp())
+
+
+def not_modified(response_headers: _typing.Dict[str, str]) -> _fastapi.Response:
+    return _fastapi.Response(status_code=304, headers=response_headers)
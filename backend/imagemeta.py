@@ -0,0 +1,98 @@
+import io as _io
+import os as _os
+import sys as _sys
+import asyncio as _aio
+import hashlib as _hashlib
+import tempfile as _tempfile
+import typing as _typing
+
+import fastapi as _fastapi
+from PIL import Image as _Image
+from PIL import ImageCms as _ImageCms
+from PIL import PngImagePlugin as _PngImagePlugin
+
+import blobs as _blobs
+import images as _images
+
+
+"""
+Проверка того, что картинки отдаются без метаданных.
+Скрипт создает во временной папке JPEG с EXIF (поворот и GPS), ICC и комментарием
+и PNG с ICC и текстовыми полями, кладет их в хранилище и запрашивает images.serve
+без размера и с каждым размером. В ответе не должно быть EXIF, ICC и комментариев,
+поворот из EXIF должен быть применен.
+Запуск: python imagemeta.py, код возврата 1 при найденных ошибках
+
+"""
+
+
+WIDTH, HEIGHT = 64, 32
+
+
+def _jpeg() -> bytes:
+    exif = _Image.Exif()
+    exif[0x0112] = 6  # повернуть на 90 градусов по часовой стрелке
+    exif[0x8825] = {1: "N", 2: (55.0, 45.0, 0.0), 3: "E", 4: (37.0, 37.0, 0.0)}
+    icc = _ImageCms.ImageCmsProfile(_ImageCms.createProfile("sRGB")).tobytes()
+    data = _io.BytesIO()
+    _Image.new("RGB", (WIDTH, HEIGHT), "red").save(data, "JPEG", exif=exif, icc_profile=icc, comment=b"secret")
+    return data.getvalue()
+
+
+def _png() -> bytes:
+    text = _PngImagePlugin.PngInfo()
+    text.add_text("Author", "secret")
+    icc = _ImageCms.ImageCmsProfile(_ImageCms.createProfile("sRGB")).tobytes()
+    data = _io.BytesIO()
+    _Image.new("RGBA", (WIDTH, HEIGHT), "blue").save(data, "PNG", pnginfo=text, icc_profile=icc)
+    return data.getvalue()
+
+
+def _request(accept: str) -> _fastapi.Request:
+    return _fastapi.Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "query_string": b"",
+        "headers": [(b"accept", accept.encode())],
+    })
+
+
+def _inspect(path: str, rotated: bool) -> _typing.List[str]:
+    found = []
+    with _Image.open(path) as image:
+        if image.getexif():
+            found.append("EXIF")
+        found.extend(key for key in ("exif", "icc_profile", "comment", "Author") if key in image.info)
+        if rotated and image.width > image.height:
+            found.append("EXIF orientation not applied")
+    return found
+
+
+async def _check(files: _typing.Dict[str, _typing.Tuple[bytes, bool]]) -> _typing.List[str]:
+    errors = []
+    for mime, (content, rotated) in files.items():
+        hash = _hashlib.sha256(content).hexdigest()
+        _os.makedirs(_os.path.dirname(_blobs.path(hash)), exist_ok=True)
+        with open(_blobs.path(hash), "wb") as file:
+            file.write(content)
+        requests = [(None, "image/jpeg")]
+        requests += [(size, accept) for size in _images.VARIANTS for accept in ("image/webp", "")]
+        for size, accept in requests:
+            response = await _images.serve(_request(accept), hash, mime, 0, size)
+            if size is None and response.media_type != mime:
+                errors.append(f"{mime} {size}: served as {response.media_type}")
+            for found in _inspect(response.path, rotated):
+                errors.append(f"{mime} {size} {accept or '*/*'}: {found}")
+    _images.pool.shutdown()
+    return errors
+
+
+if __name__ == "__main__":
+    with _tempfile.TemporaryDirectory() as directory:
+        _os.chdir(directory)
+        errors = _aio.run(_check({"image/jpeg": (_jpeg(), True), "image/png": (_png(), False)}))
+    for error in errors:
+        print(f"FAILED {error}")
+    print("OK" if not errors else f"{len(errors)} errors")
+    _sys.exit(1 if errors else 0)
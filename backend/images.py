@@ -0,0 +1,207 @@
+import os as _os
+import asyncio as _aio
+import secrets as _secrets
+import threading as _threading
+import typing as _typing
+from concurrent import futures as _futures
+from concurrent.futures import process as _process
+
+import fastapi as _fastapi
+from PIL import Image as _Image
+from PIL import ImageOps as _ImageOps
+from loguru import logger as _logger
+
+import blobs as _blobs
+import httpcache as _httpcache
+import schemas as _schemas
+
+
+"""
+Уменьшенные копии картинок из хранилища blobs.
+Для каждого размера (thumb, medium, full) создаются WebP и JPEG без метаданных,
+повернутые по EXIF. Вместо исходного файла, в котором могут быть EXIF (в том числе GPS), ICC
+и комментарии, отдается его копия original того же формата и размера, тоже без метаданных.
+Декодирование и кодирование идут в пуле процессов:
+при загрузке картинки создаются все копии, отсутствующие копии создаются при первом запросе.
+Копии лежат рядом с исходным файлом: data/blobs/ab/cd/<sha256>.<размер>.<webp|jpg|png>
+
+"""
+
+
+# число процессов пула
+IMAGE_WORKERS = int(_os.environ.get("IMAGE_WORKERS", min(_os.cpu_count() or 1, 4)))
+
+# размер -> наибольшая сторона в пикселях
+VARIANTS: _typing.Dict[str, int] = {
+    "thumb": 240,
+    "medium": 960,
+    "full": 1920,
+}
+
+# формат -> (формат Pillow, расширение, тип содержимого)
+FORMATS: _typing.Dict[str, _typing.Tuple[str, str, str]] = {
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+}
+
+QUALITY = int(_os.environ.get("IMAGE_QUALITY", 82))
+
+# тип исходной картинки -> (формат Pillow, расширение) копии original
+ORIGINAL_FORMATS: _typing.Dict[str, _typing.Tuple[str, str]] = {
+    "image/png": ("PNG", "png"),
+    "image/jpeg": ("JPEG", "jpg"),
+}
+
+ORIGINAL_QUALITY = int(_os.environ.get("IMAGE_ORIGINAL_QUALITY", 95))
+
+
+def variant_path(hash: str, size: str, format: str) -> str:
+    return f"{_blobs.path(hash)}.{size}.{FORMATS[format][1]}"
+
+
+def original_path(hash: str, mime: str) -> str:
+    return f"{_blobs.path(hash)}.original.{ORIGINAL_FORMATS[mime][1]}"
+
+
+def _render(source: str, targets: _typing.List[_typing.Tuple[_typing.Optional[int], str, str, int]]):
+    # выполняется в процессе пула
+    with _Image.open(source) as original:
+        image = _ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+        # PNG берет ICC и текстовые поля из info, а не только из аргументов save
+        image.info = {}
+        for side, format, target, quality in targets:
+            variant = image.copy()
+            if side is not None:
+                variant.thumbnail((side, side), _Image.LANCZOS)
+            if format == "JPEG" and variant.mode == "RGBA":
+                # у JPEG нет прозрачности: фон белый
+                background = _Image.new("RGB", variant.size, "white")
+                background.paste(variant, mask=variant.getchannel("A"))
+                variant = background
+            temp = f"{target}.{_secrets.token_hex(4)}.tmp"
+            # сохраняются только пиксели: EXIF, ICC и комментарии не переносятся
+            variant.save(temp, format, quality=quality)
+            _os.replace(temp, target)
+
+
+class ImagePool():
+
+    """
+    Пул процессов для Pillow. Одинаковые одновременные запросы одной копии
+    ждут одного вызова
+    """
+
+    workers: int
+
+    def __init__(self, workers: int = IMAGE_WORKERS):
+        self.workers = workers
+        self._lock = _threading.Lock()
+        self._pool: _typing.Optional[_futures.ProcessPoolExecutor] = None
+        self._pending: _typing.Dict[str, _aio.Future] = {}
+
+    def _executor(self) -> _futures.ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = _futures.ProcessPoolExecutor(self.workers)
+            return self._pool
+
+    async def render(self, hash: str, variants: _typing.Sequence[_typing.Tuple[str, str]]):
+
+        """
+        Создает отсутствующие копии variants ((размер, формат), ...) картинки hash
+        """
+
+        await self._run(hash, [
+            (VARIANTS[size], FORMATS[format][0], variant_path(hash, size, format), QUALITY)
+            for size, format in variants
+        ])
+
+    async def render_original(self, hash: str, mime: str):
+
+        """
+        Создает копию original картинки hash типа mime, если ее нет
+        """
+
+        await self._run(hash, [(None, ORIGINAL_FORMATS[mime][0], original_path(hash, mime), ORIGINAL_QUALITY)])
+
+    async def _run(self, hash: str, targets: _typing.List[_typing.Tuple[_typing.Optional[int], str, str, int]]):
+        targets = [t for t in targets if not _os.path.isfile(t[2])]
+        if not targets:
+            return
+        key = f"{hash}:{','.join(t[2] for t in targets)}"
+        if key in self._pending:
+            return await _aio.shield(self._pending[key])
+        pool = self._executor()
+        future = _aio.get_running_loop().run_in_executor(pool, _render, _blobs.path(hash), targets)
+        self._pending[key] = future
+        try:
+            await future
+        except _process.BrokenProcessPool:
+            # упавший процесс ломает весь пул, следующий вызов создаст новый
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            pool.shutdown(wait=False)
+            _logger.error("image pool is broken, restarting")
+            raise
+        finally:
+            self._pending.pop(key, None)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+pool = ImagePool()
+
+
+async def generate(hash: str, mime: str):
+
+    """
+    Создает все копии картинки. Ошибка только записывается в лог:
+    копия будет создана заново при запросе
+    """
+
+    try:
+        await pool.render_original(hash, mime)
+        await pool.render(hash, [(size, format) for size in VARIANTS for format in FORMATS])
+    except Exception as e:
+        _logger.error(f"unable to render variants of {hash}: {e=}")
+
+
+def choose_format(request: _fastapi.Request) -> str:
+    return "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+
+
+async def serve(
+        request: _fastapi.Request,
+        hash: str,
+        mime: str,
+        mtime: int,
+        size: _typing.Optional[_schemas.image_sizes] = None,
+        cache_control: str = _httpcache.REVALIDATE
+) -> _fastapi.Response:
+
+    """
+    Отдает картинку без метаданных (копию original) или ее копию размера size в формате,
+    который принимает клиент. Поддерживает If-None-Match, If-Modified-Since и HEAD
+    """
+
+    if size is None:
+        path, etag, headers = original_path(hash, mime), f'"{hash[:32]}"', {}
+    else:
+        format = choose_format(request)
+        path, mime = variant_path(hash, size, format), FORMATS[format][2]
+        etag, headers = f'"{hash[:32]}-{size}-{format}"', {"Vary": "Accept"}
+    headers.update(_httpcache.headers(etag, mtime, cache_control))
+    if _httpcache.is_not_modified(request, etag, mtime):
+        return _httpcache.not_modified(headers)
+    if size is None:
+        await pool.render_original(hash, mime)
+    else:
+        await pool.render(hash, [(size, format)])
+    return _fastapi.responses.FileResponse(path, headers=headers, media_type=mime, method=request.method)
@@ -0,0 +1,289 @@
+import os as _os
+import csv as _csv
+import json as _json
+import codecs as _codecs
+import secrets as _secrets
+import datetime as _dt
+import typing as _typing
+
+import pydantic as _pydantic
+import sqlalchemy as _sql
+from sqlalchemy.ext import asyncio as _asyncio
+from loguru import logger as _logger
+
+import models as _models
+import schemas as _schemas
+import database as _database
+import passwords as _passwords
+from emails import emails as _emails
+from config import PASSWORD_SALT
+
+
+"""
+Массовый импорт студентов и учителей из CSV или NDJSON.
+Строки читаются из потока тела запроса и обрабатываются частями по IMPORT_CHUNK_SIZE:
+проверка строк, один запрос на поиск занятых почт, компаний и специализаций,
+хеширование паролей в пуле процессов и вставка пользователей, учителей,
+их специализаций и ссылок подтверждения почты одной транзакцией на часть.
+Письма подтверждения отправляются после ответа
+
+"""
+
+
+# число строк, обрабатываемых одной транзакцией
+IMPORT_CHUNK_SIZE = int(_os.environ.get("IMPORT_CHUNK_SIZE", 200))
+
+# время жизни ссылки подтверждения почты, как у links.create_verify_email_link
+VERIFY_LINK_TTL = _dt.timedelta(hours=1)
+
+# столбцы CSV, специализации в CSV разделяются ";"
+CSV_COLUMNS = ("role", "email", "fname", "lname", "sname", "password", "company", "specializations", "bio")
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+async def _lines(stream: _typing.AsyncIterable[bytes]) -> _typing.AsyncIterator[str]:
+    decoder = _codecs.getincrementaldecoder("utf-8-sig")()
+    tail = ""
+    async for chunk in stream:
+        tail += decoder.decode(chunk)
+        *lines, tail = tail.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    tail += decoder.decode(b"", final=True)
+    if tail.rstrip("\r"):
+        yield tail.rstrip("\r")
+
+
+async def _csv_records(stream: _typing.AsyncIterable[bytes]) -> _typing.AsyncIterator[dict]:
+
+    """
+    Разбирает CSV с заголовком. Запись, значение в кавычках которой содержит перевод строки,
+    собирается из нескольких строк: запись закончена, когда число кавычек в ней четно
+    """
+
+    header = None
+    record = ""
+    async for line in _lines(stream):
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            continue
+        values, record = next(_csv.reader([record])), ""
+        if header is None:
+            header = [h.strip() for h in values]
+            unknown = set(header) - set(CSV_COLUMNS)
+            if unknown:
+                raise ImportFormatError(f"unknown columns: {sorted(unknown)}")
+            continue
+        if not any(values):
+            continue
+        data = {k: v for k, v in zip(header, values) if v != ""}
+        if "specializations" in data:
+            data["specializations"] = [s.strip() for s in data["specializations"].split(";") if s.strip()]
+        yield data
+    if record:
+        raise ImportFormatError("unterminated quoted value")
+
+
+async def _ndjson_records(stream: _typing.AsyncIterable[bytes]) -> _typing.AsyncIterator[_typing.Any]:
+    async for line in _lines(stream):
+        if not line.strip():
+            continue
+        try:
+            yield _json.loads(line)
+        except ValueError as e:
+            yield e
+
+
+def _error(e: Exception) -> str:
+    if isinstance(e, _pydantic.ValidationError):
+        return "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+    return str(e)
+
+
+class _Chunk():
+
+    """
+    Часть импорта: строки отчета и прошедшие проверку данные пользователей
+    """
+
+    rows: _typing.List[_schemas.UserImportRow]
+    users: _typing.List[_typing.Tuple[_schemas.UserImportRow, _schemas.UserImport]]
+
+    def __init__(self):
+        self.rows = []
+        self.users = []
+
+    def add(self, number: int, record: _typing.Any):
+        row = _schemas.UserImportRow(row=number, email=None, id=None, error=None)
+        self.rows.append(row)
+        try:
+            if isinstance(record, Exception):
+                raise record
+            data = _schemas.UserImport.parse_obj(record)
+        except (_pydantic.ValidationError, ValueError, TypeError) as e:
+            row.email = record.get("email") if isinstance(record, dict) else None
+            row.error = _error(e)
+            return
+        row.email = data.email
+        if data.role == "teacher" and data.company is None:
+            row.error = "Для учителя нужна компания"
+            return
+        self.users.append((row, data))
+
+
+async def _check(
+        chunk: _Chunk,
+        seen: _typing.Set[str],
+        se: _asyncio.AsyncSession
+) -> _typing.Dict[str, int]:
+
+    """
+    Отсеивает строки с занятыми почтами, неизвестными компаниями и специализациями.
+    Возвращает id специализаций по именам
+    """
+
+    emails = [data.email for _, data in chunk.users]
+    taken = set(await se.scalars(_sql.select(_models.User.email).where(_models.User.email.in_(emails))))
+    companies = {data.company for _, data in chunk.users if data.role == "teacher"}
+    known_companies = set(await se.scalars(
+        _sql.select(_models.Company.id).where(_models.Company.id.in_(companies))
+    )) if companies else set()
+    names = {name for _, data in chunk.users if data.role == "teacher" for name in data.specializations}
+    specializations = dict((await se.execute(
+        _sql.select(_models.Specialization.name, _models.Specialization.id)
+        .where(_models.Specialization.name.in_(names))
+    )).all()) if names else {}
+
+    users = []
+    for row, data in chunk.users:
+        if data.email in taken or data.email in seen:
+            row.error = "Почта занята"
+        elif data.role == "teacher" and data.company not in known_companies:
+            row.error = "Компания не найдена"
+        elif data.role == "teacher" and set(data.specializations) - specializations.keys():
+            row.error = f"Не найдена специализация: {sorted(set(data.specializations) - specializations.keys())}"
+        else:
+            seen.add(data.email)
+            users.append((row, data))
+    chunk.users = users
+    return specializations
+
+
+async def _insert(
+        chunk: _Chunk,
+        specializations: _typing.Dict[str, int],
+        se: _asyncio.AsyncSession
+) -> _typing.List[_typing.Tuple[_models.Link, _models.User]]:
+
+    """
+    Вставляет пользователей части одной транзакцией, каждая таблица - одним пакетом.
+    Возвращает ссылки подтверждения почты для отправки писем
+    """
+
+    hashes = await _passwords.hasher.hash_many([data.password + PASSWORD_SALT for _, data in chunk.users])
+    now = _dt.datetime.utcnow()
+    async with _database.transaction(se):
+        # без RETURNING вставка идет одним executemany, id читаются обратно по уникальным почтам
+        await se.execute(_sql.insert(_models.User), [
+            {
+                "fname": data.fname,
+                "lname": data.lname,
+                "sname": data.sname,
+                "email": data.email,
+                "password": password,
+                "role": data.role,
+                "date_created": now,
+                "date_online": now,
+                "sign": ""
+            }
+            for (_, data), password in zip(chunk.users, hashes)
+        ])
+        created = {
+            user.email: user for user in
+            await se.scalars(_sql.select(_models.User).where(_models.User.email.in_([d.email for _, d in chunk.users])))
+        }
+        users = [created[data.email] for _, data in chunk.users]
+        teachers = [(user, data) for user, (_, data) in zip(users, chunk.users) if data.role == "teacher"]
+        se.add_all([
+            _models.Teacher(user_id=user.id, company_id=data.company, bio=data.bio)
+            for user, data in teachers
+        ])
+        se.add_all([
+            _models.TeacherSpecializations(user_id=user.id, specialization_id=specializations[name])
+            for user, data in teachers
+            for name in dict.fromkeys(data.specializations)
+        ])
+        links = [
+            _models.Link(
+                url=_secrets.token_hex(20),
+                limit=1,
+                target=user.id,
+                action="verify email",
+                date_expired=_dt.datetime.now() + VERIFY_LINK_TTL
+            )
+            for user in users
+        ]
+        se.add_all(links)
+    for user, (row, _) in zip(users, chunk.users):
+        row.id = user.id
+    return list(zip(links, users))
+
+
+async def _flush(
+        chunk: _Chunk,
+        seen: _typing.Set[str],
+        se: _asyncio.AsyncSession
+) -> _typing.List[_typing.Tuple[_models.Link, _models.User]]:
+    if not chunk.users:
+        return []
+    specializations = await _check(chunk, seen, se)
+    if not chunk.users:
+        return []
+    try:
+        return await _insert(chunk, specializations, se)
+    except _sql.exc.IntegrityError as e:
+        # почта могла быть занята параллельной регистрацией: часть целиком не импортирована
+        _logger.warning(f"import chunk rolled back: {e}")
+        for row, _ in chunk.users:
+            row.error = "Не удалось сохранить: данные изменились во время импорта"
+        return []
+
+
+async def import_users(
+        stream: _typing.AsyncIterable[bytes],
+        format: _schemas.user_import_formats,
+        se: _asyncio.AsyncSession
+) -> _typing.Tuple[_schemas.UserImportReport, _typing.List[_typing.Tuple[_models.Link, _models.User]]]:
+
+    """
+    Импортирует пользователей из потока stream.
+    Возвращает отчет по строкам и ссылки подтверждения почты созданных пользователей.
+    Части, обработанные до ошибки формата, остаются сохраненными
+    """
+
+    records = _csv_records(stream) if format == "csv" else _ndjson_records(stream)
+    rows: _typing.List[_schemas.UserImportRow] = []
+    links = []
+    seen: _typing.Set[str] = set()
+    chunk = _Chunk()
+    number = 0
+    async for record in records:
+        number += 1
+        chunk.add(number, record)
+        if len(chunk.rows) >= IMPORT_CHUNK_SIZE:
+            links += await _flush(chunk, seen, se)
+            rows += chunk.rows
+            chunk = _Chunk()
+    links += await _flush(chunk, seen, se)
+    rows += chunk.rows
+
+    created = sum(1 for r in rows if r.error is None)
+    return _schemas.UserImportReport(created=created, failed=len(rows) - created, rows=rows), links
+
+
+async def send_verification_emails(links: _typing.List[_typing.Tuple[_models.Link, _models.User]]):
+    for link, user in links:
+        await _emails.send_verification_email(link, user)
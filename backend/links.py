@@ -1,7 +1,8 @@
 import datetime as _datetime
 import hashlib as _hashlib
 
-from sqlalchemy import orm as _orm
+import sqlalchemy as _sql
+from sqlalchemy.ext import asyncio as _asyncio
 
 import models as _models
 import schemas as _schemas
@@ -39,7 +40,7 @@ class AccountNotActivatedError(LinkError):
 
 async def create_verify_email_link(
         user: _models.User,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
     url = _hashlib.sha1(str(_datetime.datetime.now().timestamp()).encode()).hexdigest()
     link = _models.Link(
@@ -50,50 +51,54 @@ async def create_verify_email_link(
         date_expired=_datetime.datetime.now() + _datetime.timedelta(hours=1)
     )
     se.add(link)
-    se.commit()
+    await se.commit()
     return link
 
 
-def get_link_by_url(
+async def get_link_by_url(
         url: str,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    link = se.query(_models.Link).filter_by(url=url).first()
+    link = await se.scalar(_sql.select(_models.Link).filter_by(url=url))
     if not link:
         raise LinkInvalidError
     schema = _schemas.Link.from_orm(link)
     if link.limit:
         if link.limit <= link.count_used:
-            se.delete(link)
-            se.commit()
+            await se.delete(link)
+            await se.commit()
             raise LinkOverusedError
     if schema.date_expired:
         if schema.date_expired < _datetime.datetime.now():
-            se.delete(link)
-            se.commit()
+            await se.delete(link)
+            await se.commit()
             raise LinkExpiredError
     return link
 
 
 async def verify_email(
         url: str,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    link = get_link_by_url(url, se)
-    user = se.get(_models.User, link.target)
+    link = await get_link_by_url(url, se)
+    user = await se.get(_models.User, link.target)
     if not user:
         raise LinkInvalidError
     user.confirmed = True
     link.count_used += 1
-    se.commit()
-    se.refresh(user)
+    await se.commit()
+    await se.refresh(user)
 
 
 async def create_join_group_link(
         group: _models.Group,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    old = se.query(_models.Link).filter_by(target=group.id).filter_by(action="join group").first()
+    old = await se.scalar(
+        _sql.select(_models.Link)
+        .filter_by(target=group.id)
+        .filter_by(action="join group")
+    )
     if old:
         return f"{_DOMAIN}/api/groups/join/{old.url}"
     url = _hashlib.sha1(str(_datetime.datetime.now().timestamp()).encode()).hexdigest()
@@ -103,28 +108,28 @@ async def create_join_group_link(
         action="join group",
     )
     se.add(link)
-    se.commit()
+    await se.commit()
     return f"{_DOMAIN}/api/groups/join/{url}"
 
 
 async def join_group(
         url: str,
         student: _models.User,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    link = get_link_by_url(url, se)
-    group = se.get(_models.Group, link.target)
+    link = await get_link_by_url(url, se)
+    group = await se.get(_models.Group, link.target)
     if not group:
         raise LinkInvalidError
-    if student.id in (s.student_id for s in group.students):
+    if student.id in (s.student_id for s in await group.awaitable_attrs.students):
         raise LinkJoinUseless
     gs = _models.GroupStudents(
         student_id=student.id,
         group_id=group.id
     )
     se.add(gs)
-    se.commit()
-    se.refresh(gs)
+    await se.commit()
+    await se.refresh(gs)
     link.count_used += 1
-    se.commit()
-    se.refresh(group)
+    await se.commit()
+    await se.refresh(group)
@@ -0,0 +1,125 @@
+import sys as _sys
+import time as _time
+import datetime as _dt
+import tempfile as _tempfile
+import threading as _threading
+import typing as _typing
+
+import sqlalchemy as _sql
+import sqlalchemy.orm as _orm
+
+import database as _database
+import models as _models
+import migrations as _migrations
+
+
+"""
+Смешанная нагрузка чтения и записи на SQLite для профилей соединения database.SQLITE_PROFILES.
+Для каждого профиля скрипт создает временную базу с USERS студентами,
+запускает WRITERS потоков, фиксирующих изменение одной строки, и READERS потоков,
+читающих страницу студентов через соединения только для чтения (как ReadOnlySessionLocal),
+и считает коммиты и чтения в секунду и 99-й перцентиль их задержки.
+Запуск: python loadbench.py [профиль] [операций на поток]
+
+"""
+
+
+USERS = 200
+
+WRITERS = 4
+
+READERS = 8
+
+
+def _engines(path: str, pragmas: dict) -> _typing.Tuple[_sql.Engine, _sql.Engine]:
+    engine = _sql.create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    readonly = _sql.create_engine(
+        f"sqlite:///file:{path}?mode=ro&uri=true",
+        connect_args={"check_same_thread": False}
+    )
+    _sql.event.listen(engine, "connect", _database._set_sqlite_pragmas(pragmas))
+    _sql.event.listen(readonly, "connect", _database._set_sqlite_pragmas({
+        **{k: v for k, v in pragmas.items() if k != "journal_mode"},
+        "query_only": "ON"
+    }))
+    return engine, readonly
+
+
+def _seed(engine: _sql.Engine):
+    with _orm.Session(engine) as se:
+        se.add_all([
+            _models.User(role="student", email=f"s{i}@x", password="", fname="S", lname="S", sign="", confirmed=True)
+            for i in range(USERS)
+        ])
+        se.commit()
+
+
+def _percentile(values: _typing.List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] * 1000
+
+
+def bench(path: str, profile: str, operations: int = 300) -> _typing.Tuple[float, float, float, float, int]:
+
+    """
+    Выполняет замер профиля profile на базе по пути path.
+    Возвращает (коммитов в секунду, чтений в секунду, p99 коммита и чтения в мс, число ошибок)
+    """
+
+    engine = _sql.create_engine(f"sqlite:///{path}")
+    _migrations.migrate(engine)
+    _seed(engine)
+    engine.dispose()
+    engine, readonly = _engines(path, _database.SQLITE_PROFILES[profile])
+    commits, reads, errors = [], [], []
+
+    def writer(k: int):
+        with _orm.Session(engine) as se:
+            for i in range(operations):
+                started = _time.perf_counter()
+                try:
+                    user = se.get(_models.User, (k * operations + i) % USERS + 1)
+                    user.date_online = _dt.datetime.now()
+                    se.commit()
+                except _sql.exc.OperationalError as e:
+                    errors.append(e)
+                    se.rollback()
+                commits.append(_time.perf_counter() - started)
+
+    def reader(k: int):
+        for _ in range(operations):
+            started = _time.perf_counter()
+            try:
+                with _orm.Session(readonly) as se:
+                    se.scalars(_sql.select(_models.User).filter_by(role="student").limit(50)).all()
+            except _sql.exc.OperationalError as e:
+                errors.append(e)
+            reads.append(_time.perf_counter() - started)
+
+    threads = [_threading.Thread(target=writer, args=(k,)) for k in range(WRITERS)]
+    threads += [_threading.Thread(target=reader, args=(k,)) for k in range(READERS)]
+    started = _time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = _time.perf_counter() - started
+    engine.dispose()
+    readonly.dispose()
+    return (
+        len(commits) / elapsed,
+        len(reads) / elapsed,
+        _percentile(commits, 0.99),
+        _percentile(reads, 0.99),
+        len(errors)
+    )
+
+
+if __name__ == "__main__":
+    profiles = [_sys.argv[1]] if len(_sys.argv) > 1 else list(_database.SQLITE_PROFILES)
+    operations = int(_sys.argv[2]) if len(_sys.argv) > 2 else 300
+    print(f"{'profile':12}{'commits/s':>11}{'reads/s':>9}{'commit p99':>12}{'read p99':>10}{'errors':>8}")
+    for profile in profiles:
+        with _tempfile.TemporaryDirectory() as directory:
+            result = bench(f"{directory}/loadbench.db", profile, operations)
+        print(f"{profile:12}{result[0]:11.0f}{result[1]:9.0f}{result[2]:12.1f}{result[3]:10.1f}{result[4]:8}")
@@ -0,0 +1,50 @@
+import sqlalchemy.orm as _orm
+
+import models as _models
+
+
+"""
+Профили загрузки связей для схем ответов из schemas.py.
+Профиль - набор опций selectinload/joinedload, загружающий за фиксированное число запросов
+все связи, которые читаются при сборке схемы
+
+"""
+
+
+# schemas.Teacher
+TEACHER = (
+    _orm.joinedload(_models.Teacher.user),
+    _orm.joinedload(_models.Teacher.company),
+    _orm.selectinload(_models.Teacher.specializations)
+    .joinedload(_models.TeacherSpecializations.specialization),
+)
+
+# schemas.Company
+COMPANY = (
+    _orm.selectinload(_models.Company.teachers).options(*TEACHER),
+    _orm.selectinload(_models.Company.specializations)
+    .joinedload(_models.CompanySpecializations.specialization),
+    _orm.selectinload(_models.Company.contacts),
+)
+
+# schemas.Group
+GROUP = (
+    _orm.joinedload(_models.Group.teacher).options(*TEACHER),
+    _orm.selectinload(_models.Group.students)
+    .joinedload(_models.GroupStudents.student),
+)
+
+# schemas.CourseShort
+COURSE_SHORT = (
+    _orm.selectinload(_models.Course.tags)
+    .joinedload(_models.CourseTags.specialization),
+)
+
+# schemas.Course
+COURSE = (
+    *COURSE_SHORT,
+    _orm.joinedload(_models.Course.author)
+    .joinedload(_models.User.teacher)
+    .joinedload(_models.Teacher.company),
+    _orm.selectinload(_models.Course.lessons),
+)
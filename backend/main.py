@@ -2,17 +2,28 @@ import os as _os
 import typing as _typing
 
 import fastapi as _fastapi
-from sqlalchemy import orm as _orm
+from sqlalchemy.ext import asyncio as _asyncio
 from loguru import logger
 
 import cookies as _cookies
+import auth as _auth
 import services as _services
+import database as _database
 import schemas as _schemas
 from emails import emails as _emails
 import links as _links
+import sqlstats as _sqlstats
+import pagination as _pagination
+import presence as _presence
+import passwords as _passwords
+import images as _images
+import imports as _imports
+import blobimport as _blobimport
 from applications import applications as _applications
 from staticpages import staticpages as _staticpages
 from courses import courses as _courses
+from courses import catalog as _catalog
+from courses import archives as _archives
 from news import news as _news
 
 """
@@ -23,11 +34,97 @@ from news import news as _news
 
 fastapi = _fastapi.FastAPI()
 
-cookietype = _typing.Annotated[_typing.Union[str, None], _fastapi.Cookie()]
-
 logger.add("./logs/debug.log", rotation="1MB")
 
 
+@fastapi.on_event("startup")
+async def start_presence():
+    """ Запуск периодической записи отметок присутствия """
+    _presence.start()
+
+
+@fastapi.on_event("startup")
+async def build_content_catalog():
+    """ Построение каталога содержимого курсов. Каталог - в памяти процесса, второй процесс не запустится """
+    _catalog.lock()
+    _catalog.build()
+
+
+@fastapi.on_event("startup")
+async def check_legacy_images():
+    """ Проверка картинок, сохраненных в дереве файлов до хранилища blobs и не перенесенных в него """
+    pending = _blobimport.pending(
+        _database.engine,
+        f"{_os.getcwd()}/courses/courses",
+        f"{_os.getcwd()}/news/images"
+    )
+    if pending:
+        logger.error(
+            f"{len(pending)} step and news images are not in the blob store and return 404 "
+            f"(first: {pending[0]}). Import them once: "
+            "python blobimport.py data/blobs courses/courses news/images"
+        )
+
+
+@fastapi.on_event("shutdown")
+async def save_content_catalog():
+    """ Запись снимка каталога содержимого курсов """
+    _catalog.save()
+
+
+@fastapi.on_event("shutdown")
+async def stop_presence():
+    """ Запись оставшихся отметок присутствия """
+    await _presence.stop()
+
+
+@fastapi.on_event("shutdown")
+async def stop_password_hasher():
+    """ Остановка пула хеширования паролей """
+    _passwords.hasher.shutdown()
+
+
+@fastapi.on_event("shutdown")
+async def stop_image_pool():
+    """ Остановка пула обработки картинок """
+    _images.pool.shutdown()
+
+
+@fastapi.on_event("shutdown")
+async def close_database_engines():
+    """ Закрытие соединений с базой: без этого потоки aiosqlite не дают процессу завершиться """
+    await _database.async_engine.dispose()
+    await _database.readonly_async_engine.dispose()
+
+
+@fastapi.exception_handler(_auth.UnauthorizedError)
+async def unauthorized(request: _fastapi.Request, exc: _auth.UnauthorizedError):
+    """ Владелец cookie не определен или не имеет доступа """
+    return _cookies.get_unsign_response()
+
+
+@fastapi.exception_handler(_passwords.HasherBusyError)
+async def password_hasher_busy(request: _fastapi.Request, exc: _passwords.HasherBusyError):
+    """ Очередь хеширования паролей переполнена """
+    logger.warning(f"{exc}")
+    return _fastapi.responses.JSONResponse(
+        {"detail": "Сервер перегружен, повторите попытку позже"},
+        status_code=503,
+        headers={"Retry-After": "1"}
+    )
+
+
+@fastapi.middleware("http")
+async def collect_sql_stats(request: _fastapi.Request, call_next):
+    """ Учет SQL-запросов, выполненных при обработке запроса """
+    stats, token = _sqlstats.start()
+    try:
+        return await call_next(request)
+    finally:
+        route = request.scope.get("route")
+        _sqlstats.finish(f"{request.method} {route.path}" if route else "unmatched", stats, token)
+
+
 @fastapi.head("/api/", status_code=204)
 async def handshake():
     """ Проверка соединения """
@@ -37,7 +134,7 @@ async def handshake():
 @fastapi.post("/api/students", status_code=204)
 async def student_sign_up(
     data: _schemas.StudentCreate,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Регистрация нового студента """
     logger.debug("")
@@ -48,40 +145,33 @@ async def student_sign_up(
 
 @fastapi.get("/api/users/me", response_model=_typing.Union[_schemas.Student, _schemas.Teacher])
 async def user_sign_in(
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.user),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Вход в аккаунт любого пользователя по cookie """
     logger.debug("")
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role not in ("student", "teacher") or not model:
-        return _cookies.get_unsign_response()
-    if role == "student":
-        data = _schemas.Student.from_orm(model)
-        return await _cookies.get_signed_response(data, model, session)
-    elif role == "teacher":
-        data = _services.teacher_model_to_schema(model.user, model)
-        return await _cookies.get_signed_response(data, model.user, session)
+    if account.role == "student":
+        data = _schemas.Student.from_orm(account.user)
+    else:
+        data = await _services.teacher_model_to_schema(account.user, account.teacher)
+    return await _cookies.get_signed_response(data, account.user, session, cookie=account.cookie)
 
 
 @fastapi.get("/api/students/me", response_model=_schemas.Student)
 async def student_sign_in(
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.student),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Вход в аккаунт студента по cookie """
     logger.debug("")
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role != "student" or not model:
-        return _cookies.get_unsign_response()
-    data = _schemas.Student.from_orm(model)
-    return await _cookies.get_signed_response(data, model, session)
+    data = _schemas.Student.from_orm(account.user)
+    return await _cookies.get_signed_response(data, account.user, session, cookie=account.cookie)
 
 
 @fastapi.post("/api/students/me", response_model=_schemas.Student)
 async def student_auth(
     data: _schemas.AuthSchema,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Вход в аккаунт студента по логину и паролю """
     logger.debug("")
@@ -91,9 +181,14 @@ async def student_auth(
 
 
 @fastapi.delete("/api/users/me/cookie", status_code=401)
-async def user_logout():
+async def user_logout(
+    account: _typing.Optional[_cookies.Account] = _fastapi.Depends(_auth.get_account),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
+):
     """ Выход из аккаунта пользователя """
     logger.debug("")
+    if account:
+        await _services.sign_out(account, session)
     resp = _fastapi.Response(status_code=401)
     resp.delete_cookie("user")
     return resp
@@ -101,58 +196,114 @@ async def user_logout():
 
 @fastapi.delete("/api/students/me", status_code=204)
 async def delete_student_account(
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.student),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Удаление аккаунта студента """
     logger.debug("")
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role != "student":
-        return _cookies.get_unsign_response()
-    await _services.drop_student(model, session)
+    await _services.drop_student(account.user, session)
     return _cookies.get_unsign_response(204)
 
 
 @fastapi.put("/api/students/me", status_code=204)
 async def update_student_data(
     data: _schemas.StudentUpdate,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.student),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Изменение данных аккаунта студента.
     Доступно только для владельца аккаунта
     """
     logger.debug("")
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role != "student":
-        return _cookies.get_unsign_response()
-    await _services.update_student(data, model, session)
-    return await _cookies.get_signed_response(None, model, session, 204)
+    await _services.update_student(data, account.user, session)
+    # смена пароля завершает все входы, устройство получает новую cookie
+    return await _cookies.get_signed_response(
+        None,
+        account.user,
+        session,
+        204,
+        None if data.password else account.cookie
+    )
 
 
 @fastapi.get("/api/admin", response_model=_schemas.Admin)
 async def admin_sign_in(
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.admin),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Вход по cookie для админа """
     logger.debug("")
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role != "admin":
-        return _cookies.get_unsign_response()
-    schema = _schemas.Admin.from_orm(model)
+    schema = _schemas.Admin.from_orm(account.admin)
     return await _cookies.get_signed_response(
         schema,
-        model,
+        account.admin,
         session,
+        cookie=account.cookie
     )
 
 
+@fastapi.get(
+    "/api/admin/sql",
+    response_model=_typing.List[_schemas.SqlRouteStats],
+    dependencies=[_fastapi.Depends(_auth.admin)]
+)
+async def get_sql_stats(
+):
+    """ Статистика SQL-запросов по маршрутам. Доступно только админам """
+    logger.debug("")
+    return _sqlstats.get_routes_stats()
+
+
+@fastapi.get(
+    "/api/admin/cookies",
+    response_model=_schemas.PrincipalCacheStats,
+    dependencies=[_fastapi.Depends(_auth.admin)]
+)
+async def get_cookies_cache_stats(
+):
+    """ Счетчики кэша владельцев cookie. Доступно только админам """
+    logger.debug("")
+    return _cookies.principals.stats()
+
+
+@fastapi.get(
+    "/api/admin/passwords",
+    response_model=_schemas.PasswordHasherStats,
+    dependencies=[_fastapi.Depends(_auth.admin)]
+)
+async def get_password_hasher_stats(
+):
+    """ Очередь и задержки пула хеширования паролей. Доступно только админам """
+    logger.debug("")
+    return _passwords.hasher.stats()
+
+
+@fastapi.post(
+    "/api/admin/users/import",
+    response_model=_schemas.UserImportReport,
+    dependencies=[_fastapi.Depends(_auth.admin)]
+)
+async def import_users(
+        request: _fastapi.Request,
+        background: _fastapi.BackgroundTasks,
+        format: _schemas.user_import_formats = "csv",
+        session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
+):
+    """ Массовое создание студентов и учителей из CSV или NDJSON в теле запроса. Доступно только админам """
+    logger.debug("")
+    try:
+        report, links = await _imports.import_users(request.stream(), format, session)
+    except _imports.ImportFormatError as e:
+        raise _fastapi.HTTPException(400, str(e))
+    background.add_task(_imports.send_verification_emails, links)
+    return report
+
+
 @fastapi.post("/api/admin", response_model=_schemas.Admin)
 async def admin_auth(
         data: _schemas.AuthSchema,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+        session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Вход в аккаунт админа по логину и паролю """
     logger.debug("")
@@ -165,76 +316,75 @@ async def admin_auth(
 
 
 @fastapi.delete("/api/admin", status_code=401)
-async def admin_log_out():
+async def admin_log_out(
+    account: _typing.Optional[_cookies.Account] = _fastapi.Depends(_auth.get_account),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
+):
     """ Выход из аккаунта админа """
     logger.debug("")
+    if account:
+        await _services.sign_out(account, session)
     return _cookies.get_unsign_response()
 
 
-@fastapi.post("/api/tags",  status_code=204)
+@fastapi.post("/api/tags",  status_code=204, dependencies=[_fastapi.Depends(_auth.admin)])
 async def load_tags(
     tags: _typing.List[str],
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Добавление тегов профессий на сайт.
     Доступно только для админов
     """
     logger.debug("")
-    _, role = await _services.get_account_by_cookie(user, session)
-    if role != "admin":
-        return _cookies.get_unsign_response()
     await _services.create_specializations(tags, session)
 
 
 @fastapi.get("/api/tags", response_model=_typing.List[_schemas.Specialization])
 async def find_tags(
     pattern: str,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    read_session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_read_session)
 ):
     """ Поиск тегов по шаблону """
     logger.debug("")
     return list(
         _schemas.Specialization.from_orm(s)
         for s in
-        await _services.find_specializations(pattern, session)
+        await _services.find_specializations(pattern, read_session)
     )
 
 
-@fastapi.post("/api/companies", status_code=204)
+@fastapi.post("/api/companies", status_code=204, dependencies=[_fastapi.Depends(_auth.admin)])
 async def regist_company(
     data: _schemas.CompanyCreate,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Регистрация учебной огранизации.
     Доступно только для админов
     """
     logger.debug("")
-    _, role = await _services.get_account_by_cookie(user, session)
-    if role != "admin":
-        return _cookies.get_unsign_response()
     await _services.create_company(data, session)
 
 
-@fastapi.get("/api/companies/{id}", response_model=_schemas.Company)
+@fastapi.get(
+    "/api/companies/{id}",
+    response_model=_schemas.Company,
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def get_company(
     id: int,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    read_session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_read_session)
 ):
     """ Получение странички учебной организации """
     logger.debug("")
-    await _services.check_cookie_and_update_user_online(user, session)
-    return _services.get_company(id, session)
+    return await _services.get_company(id, read_session)
 
 
 @fastapi.post("/api/teachers", status_code=204)
 async def teacher_sign_up(
     data: _schemas.TeacherCreate,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Регистрация аккаунта учителя """
     logger.debug("")
@@ -245,107 +395,113 @@ async def teacher_sign_up(
 
 @fastapi.get("/api/teachers/me", response_model=_schemas.Teacher)
 async def teacher_sign_in(
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.teacher),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Вход в аккаунт учителя по cookie """
     logger.debug("")
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role != "teacher" or not model:
-        return _cookies.get_unsign_response()
-    data = _services.teacher_model_to_schema(model.user, model)
-    return await _cookies.get_signed_response(data, model.user, session)
+    data = await _services.teacher_model_to_schema(account.user, account.teacher)
+    return await _cookies.get_signed_response(data, account.user, session, cookie=account.cookie)
 
 
 @fastapi.put("/api/teachers/me", status_code=204)
 async def update_teacher(
     update: _schemas.TeacherUpdate,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.teacher),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Редактирование аккаунта учителя """
     logger.debug("")
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role != "teacher":
-        return _cookies.get_unsign_response()
-    await _services.update_teacher(update, model.user, model, session)
+    await _services.update_teacher(update, account.user, account.teacher, session)
+    if update.password:
+        # смена пароля завершает все входы, устройство получает новую cookie
+        return await _cookies.get_signed_response(None, account.user, session, 204)
 
 
 @fastapi.delete("/api/teachers/me", status_code=204)
 async def delete_teacher_account(
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.teacher),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Удаление аккаунта учителя """
     logger.debug("")
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role != "teacher":
-        return _cookies.get_unsign_response()
-    await _services.drop_teacher(model, session)
+    await _services.drop_teacher(account.teacher, session)
     _cookies.get_unsign_response(204)
 
 
-@fastapi.get("/api/admin/students/all", response_model=_typing.List[_schemas.StudentShort])
+@fastapi.get(
+    "/api/admin/students/all",
+    response_model=_schemas.StudentsPage,
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def get_all_students(
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    cursor: _typing.Optional[str] = None,
+    pagesize: int = _pagination.pagesize_query,
+    read_session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_read_session)
 ):
     """Получить все зарегистрированные аккаунты студентов """
     logger.debug("")
-    await _services.check_cookie_and_update_user_online(user, session)
-    return await _services.get_all_students(session)
+    return await _services.get_all_students(cursor, pagesize, read_session)
 
 
-@fastapi.get("/api/admin/teachers/all", response_model=_typing.List[_schemas.TeacherShort])
+@fastapi.get(
+    "/api/admin/teachers/all",
+    response_model=_schemas.TeachersPage,
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def get_all_teachers(
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    cursor: _typing.Optional[str] = None,
+    pagesize: int = _pagination.pagesize_query,
+    read_session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_read_session)
 ):
     """ Получить всех зарегистрированные аккаунты учителей """
     logger.debug("")
-    await _services.check_cookie_and_update_user_online(user, session)
-    return await _services.get_all_teachers(session)
+    return await _services.get_all_teachers(cursor, pagesize, read_session)
 
 
-@fastapi.get("/api/teachers/{id}", response_model=_schemas.TeacherFull)
+@fastapi.get(
+    "/api/teachers/{id}",
+    response_model=_schemas.TeacherFull,
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def get_teacher_account(
     id: int,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    read_session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_read_session)
 ):
     """ Получение странички учителя  """
     logger.debug("")
-    await _services.check_cookie_and_update_user_online(user, session)
-    return await _services.get_teacher_by_id(id, session)
+    return await _services.get_teacher_by_id(id, read_session)
 
 
 @fastapi.post("/api/teachers/me", response_model=_schemas.Teacher)
 async def teacher_auth(
     data: _schemas.AuthSchema,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Вход в аккаунт учителя по логину и паролю """
     logger.debug("")
     user, teacher = await _services.auth_teacher(data.login, data.password, session)
-    return await _cookies.get_signed_response(_services.teacher_model_to_schema(user, teacher), user, session)
+    return await _cookies.get_signed_response(await _services.teacher_model_to_schema(user, teacher), user, session)
 
 
-@fastapi.get("/api/students/{id}", response_model=_schemas.StudentFull)
+@fastapi.get(
+    "/api/students/{id}",
+    response_model=_schemas.StudentFull,
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def get_student_by_admin(
     id: int,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    read_session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_read_session)
 ):
     """ Получение странички студента """
     logger.debug("")
-    await _services.check_cookie_and_update_user_online(user, session)
-    return await _services.get_student_by_id(id, session)
+    return await _services.get_student_by_id(id, read_session)
 
 
 @fastapi.get("/api/verification/{url}", status_code=200)
 async def email_verification(
     url: str,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Подтверждение адреса электронной почты пользователя по одноразовой ссылке """
     logger.debug(f"new link: {url}")
@@ -382,55 +538,57 @@ async def apply_for_tags_registration(application: _schemas.CreateTagApplication
     await _applications.add_create_tags_application(application)
 
 
-@fastapi.post("/api/applications/companies/{id}/update", status_code=204)
+@fastapi.post(
+    "/api/applications/companies/{id}/update",
+    status_code=204,
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def apply_for_company_update(
         id: int,
         application: _schemas.UpdateCompanyApplicationCreate,
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+        session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Получение заявок на изменение данных учебных заведений """
-    company = _services.get_company(id, session)
-    await _services.check_cookie_and_update_user_online(user, session)
+    company = await _services.get_company(id, session)
     await _applications.add_update_company_application(application, company)
 
 
-@fastapi.post("/api/applications/companies/{id}/delete", status_code=204)
+@fastapi.post(
+    "/api/applications/companies/{id}/delete",
+    status_code=204,
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def apply_for_company_deletion(
         id: int,
         application: _schemas.DeleteCompanyApplicationCreate,
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+        session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Получение заявок на удаление учебных заведений """
-    company = _services.get_company(id, session)
-    await _services.check_cookie_and_update_user_online(user, session)
+    company = await _services.get_company(id, session)
     await _applications.add_delete_company_application(application, company)
 
 
-@fastapi.get("/api/applications/all", response_model=_schemas.AllApplications)
+@fastapi.get(
+    "/api/applications/all",
+    response_model=_schemas.AllApplications,
+    dependencies=[_fastapi.Depends(_auth.admin)]
+)
 async def get_all_applications(
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Получение всех необработанных заявок.
     Только для админов
     """
     logger.debug("")
-    _, role = await _services.get_account_by_cookie(user, session)
-    if role != "admin":
-        return _cookies.get_unsign_response()
     return await _applications.get_all_applications()
 
 
-@fastapi.put("/api/applications/{atype}/{id}", status_code=204)
+@fastapi.put("/api/applications/{atype}/{id}", status_code=204, dependencies=[_fastapi.Depends(_auth.admin)])
 async def respond_to_application(
     atype: _applications.applications_types,
     id: int,
     decision: _schemas.ApplicationDecision,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
 
     """
@@ -448,10 +606,6 @@ async def respond_to_application(
     (только для админов)
     """
 
-    _, role = await _services.get_account_by_cookie(user, session)
-    if role != "admin":
-        return _cookies.get_unsign_response()
-
     if atype == "create_company":
         application: _schemas.CreateCompanyApplication = await _applications.get_application(atype, id)
         if not application:
@@ -494,90 +648,81 @@ async def respond_to_application(
             await _emails.send_update_company_reject_email(application.applicant_email, company, decision.reason)
 
 
-@fastapi.get("/api/tags/all", response_model=_typing.List[_schemas.Specialization])
+@fastapi.get(
+    "/api/tags/all",
+    response_model=_schemas.SpecializationsPage,
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def get_all_tags(
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session),
-    user: cookietype = None,
+    cursor: _typing.Optional[str] = None,
+    pagesize: int = _pagination.pagesize_query,
+    read_session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_read_session),
 ):
     """ Получение всех тегов профессий """
-    await _services.check_cookie_and_update_user_online(user, session)
-    return await _services.get_all_tags(session)
+    return await _services.get_all_tags(cursor, pagesize, read_session)
 
 
-@fastapi.put("/api/companies/{id}", status_code=204)
+@fastapi.put("/api/companies/{id}", status_code=204, dependencies=[_fastapi.Depends(_auth.admin)])
 async def update_company(
     id: int,
     update: _schemas.CompanyUpdate,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Изменение данных образовательной организации.
     Только для админов
     """
-    _, role = await _services.get_account_by_cookie(user, session)
-    if role != "admin":
-        return _cookies.get_unsign_response()
     await _services.update_company(id, update, session)
 
 
-@fastapi.delete("/api/companies/{id}", status_code=204)
+@fastapi.delete("/api/companies/{id}", status_code=204, dependencies=[_fastapi.Depends(_auth.admin)])
 async def delete_company(
     id: int,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Удаление образовательной организации.
     Только для админов
     """
-    _, role = await _services.get_account_by_cookie(user, session)
-    if role != "admin":
-        return _cookies.get_unsign_response()
     await _services.drop_company(id, session)
 
 
-@fastapi.get("/api/companies/all/", response_model=_typing.List[_schemas.Company])
+@fastapi.get(
+    "/api/companies/all/",
+    response_model=_schemas.CompaniesPage,
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def get_all_companies(
-    page: int = 1,
-    pagesize: int = 20,
+    cursor: _typing.Optional[str] = None,
+    pagesize: int = _pagination.pagesize_query,
     desc: bool = False,
     sort: _schemas.companies_sort_types = "name",
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session),
-    user: cookietype = None,
+    read_session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_read_session),
 ):
     """ Получить все компании """
-    await _services.check_cookie_and_update_user_online(user, session)
-    return await _services.get_all_companies(page-1, pagesize, sort, desc, session)
+    return await _services.get_all_companies(cursor, pagesize, sort, desc, read_session)
 
 
-@fastapi.post("/api/courses/", status_code=204)
+@fastapi.post("/api/courses/", status_code=204, dependencies=[_fastapi.Depends(_auth.user)])
 async def create_course(
         course: _schemas.CourseCreate,
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+        session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Создание курса.
     Доступно для студентов и учителей, но не для админов
     """
     logger.debug("")
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role not in ("student", "teacher"):
-        return _cookies.get_unsign_response()
-    _services.update_user_online(model, session)
     course = await _services.create_course(course, session)
     _courses.initialize_course(course.id)
 
 
-@fastapi.get("/api/courses/{id}", response_model=_schemas.Course)
+@fastapi.get("/api/courses/{id}", response_model=_schemas.Course, dependencies=[_fastapi.Depends(_auth.get_principal)])
 async def get_course(
     id: int,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Получить страничку курса """
-    await _services.check_cookie_and_update_user_online(user, session)
     return await _services.get_course(id, session)
 
 
@@ -585,19 +730,16 @@ async def get_course(
 async def update_course(
     id: int,
     update: _schemas.CourseUpdate,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.signed),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Изменить данные на страничке курса.
     Доступно для админов и автора курса
     """
     logger.debug("")
-    model, role = await _services.get_account_by_cookie(user, session)
-    if not role:
-        return _cookies.get_unsign_response()
-    course = _services.get_course_model(id, session)
-    if role != "admin" or course.author_id != model.id:
+    course = await _services.get_course_model(id, session)
+    if account.role != "admin" or course.author_id != account.model.id:
         raise _fastapi.HTTPException(400, "Permission denied")
     await _services.update_course(course, update, session)
 
@@ -605,19 +747,16 @@ async def update_course(
 @fastapi.delete("/api/courses/{id}", status_code=204)
 async def delete_course(
     id: int,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.signed),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Удалить курс.
     Доступно для админов и автора курса
     """
     logger.debug("")
-    model, role = await _services.get_account_by_cookie(user, session)
-    if not role:
-        return _cookies.get_unsign_response()
-    course = _services.get_course_model(id, session)
-    if role != "admin" or course.author_id != model.id:
+    course = await _services.get_course_model(id, session)
+    if account.role != "admin" or course.author_id != account.model.id:
         raise _fastapi.HTTPException(400, "Permission denied")
     await _services.drop_course(course, session)
     await _courses.drop_course(course.id)
@@ -627,20 +766,16 @@ async def delete_course(
 async def create_course_lesson(
     id: int,
     data: _schemas.LessonCreate,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.user),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Добавление урока к курсу.
     Доступно для админов и автора курса
     """
     logger.debug("")
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role not in ("student", "teacher"):
-        return _cookies.get_unsign_response()
-    course = _services.get_course_model(id, session)
-    uid = model.id if role == "student" else model.user.id
-    if course.author_id != uid:
+    course = await _services.get_course_model(id, session)
+    if course.author_id != account.user.id:
         raise _fastapi.HTTPException(400, "Permission denied")
     lesson = await _services.create_lesson(course, data, session)
     _courses.initialize_lesson(course.id, lesson.number)
@@ -650,20 +785,16 @@ async def create_course_lesson(
 async def create_course_step(
     id: int,
     number: int,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.user),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Добавление шага к уроку.
     Доступно для админов и автора курса
     """
     logger.debug("")
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role not in ("student", "teacher"):
-        return _cookies.get_unsign_response()
-    course = _services.get_course_model(id, session)
-    uid = model.id if role == "student" else model.user.id
-    if course.author_id != uid:
+    course = await _services.get_course_model(id, session)
+    if course.author_id != account.user.id:
         raise _fastapi.HTTPException(400, "Permission denied")
     await _services.get_lesson_model(course, number)
     if not _courses.is_lesson_initialized(id, number):
@@ -671,14 +802,36 @@ async def create_course_step(
     return await _courses.initialize_step(id, number)
 
 
+@fastapi.post("/api/courses/{id}/lessons/{number}/import", response_model=_schemas.LessonImportReport)
+async def import_lesson_steps(
+    id: int,
+    number: int,
+    request: _fastapi.Request,
+    upload: _typing.Optional[_fastapi.UploadFile] = _fastapi.File(None),
+    account: _cookies.Account = _fastapi.Depends(_auth.signed),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
+):
+    """
+    Добавление шагов урока из архива zip или tar с manifest.json, текстами и картинками.
+    Принимает поле формы upload или архив в теле запроса. Возвращает номера созданных шагов.
+    Доступно для админов и автора курса
+    """
+    logger.debug("")
+    course = await _services.get_course_model(id, session, count_view=False)
+    if account.role != "admin" and course.author_id != account.user.id:
+        raise _fastapi.HTTPException(400, "Permission denied")
+    await _services.get_lesson_by_number(id, number, session)
+    return await _archives.import_lesson(id, number, request, upload, session)
+
+
 @fastapi.post("/api/courses/{id}/lessons/{lesson_number}/steps/{step_number}/text", status_code=204)
 async def set_step_text(
     id: int,
     lesson_number: int,
     step_number: int,
     text: _schemas.StepText,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.signed),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Загрузка текста для шага урока.
@@ -686,15 +839,11 @@ async def set_step_text(
     """
     logger.debug("")
 
-    model, role = await _services.get_account_by_cookie(user, session)
-    if not role:
-        return _cookies.get_unsign_response()
-    course = _services.get_course_model(id, session)
+    course = await _services.get_course_model(id, session)
     await _services.get_lesson_model(course, lesson_number)
     if not _courses.is_lesson_initialized(id, lesson_number):
         raise _fastapi.HTTPException(404, "no such lesson")
-    uid = model.id if role == "student" else model.user.id
-    if role != "admin" and course.author_id != uid:
+    if account.role != "admin" and course.author_id != account.user.id:
         raise _fastapi.HTTPException(400, "Permission denied")
     await _courses.write_into_step(id, lesson_number, step_number, text.text)
 
@@ -704,96 +853,127 @@ async def load_step_image(
     id: int,
     lesson_number: int,
     step_number: int,
-    upload: _fastapi.UploadFile,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    request: _fastapi.Request,
+    upload: _typing.Optional[_fastapi.UploadFile] = _fastapi.File(None),
+    account: _cookies.Account = _fastapi.Depends(_auth.signed),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Загрузка изображения для урока.
+    Принимает поле формы upload или тело запроса с типом image/png или image/jpeg.
     Доступно для админов и автора курса
     """
     logger.debug("")
-    model, role = await _services.get_account_by_cookie(user, session)
-    if not role:
-        return _cookies.get_unsign_response()
-    course = _services.get_course_model(id, session)
-    uid = model.id if role == "student" else model.user.id
-    if role != "admin" and course.author_id != uid:
+    course = await _services.get_course_model(id, session)
+    if account.role != "admin" and course.author_id != account.user.id:
         raise _fastapi.HTTPException(400, "Permission denied")
     await _services.get_lesson_model(course, lesson_number)
     if not _courses.is_lesson_initialized(id, lesson_number):
         raise _fastapi.HTTPException(404, "no such lesson")
-    await _courses.upload_step_image(id, lesson_number, step_number, upload)
+    await _courses.upload_step_image(id, lesson_number, step_number, request, upload, session)
 
 
-@fastapi.get("/api/courses/{id}/lessons/{lesson_number}/steps/{step_number}/text", response_model=str)
+@fastapi.api_route(
+    "/api/courses/{id}/lessons/{lesson_number}/steps/{step_number}/text",
+    methods=["GET", "HEAD"],
+    response_model=str,
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def get_step_text(
     id: int,
     lesson_number: int,
     step_number: int,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    request: _fastapi.Request,
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
-    """ Получить текст урока """
-    await _services.check_cookie_and_update_user_online(user, session)
-    course = _services.get_course_model(id, session)
-    await _services.get_lesson_model(course, lesson_number)
+    """ Получить текст урока. Поддерживает If-None-Match и If-Modified-Since """
+    await _services.get_lesson_by_number(id, lesson_number, session)
     if not _courses.is_lesson_initialized(id, lesson_number):
         raise _fastapi.HTTPException(404, "no such lesson")
-    return await _courses.get_step_text(id, lesson_number, step_number)
+    return await _courses.get_step_text(id, lesson_number, step_number, request)
 
 
-@fastapi.get("/api/courses/{id}/lessons/{lesson_number}/steps/{step_number}/image")
+@fastapi.api_route(
+    "/api/courses/{id}/lessons/{lesson_number}/steps/{step_number}/image",
+    methods=["GET", "HEAD"],
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def get_step_image(
     id: int,
     lesson_number: int,
     step_number: int,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    request: _fastapi.Request,
+    size: _typing.Optional[_schemas.image_sizes] = None,
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
-    """ Получить картинку урока """
-    await _services.check_cookie_and_update_user_online(user, session)
-    course = _services.get_course_model(id, session)
-    await _services.get_lesson_model(course, lesson_number)
+    """
+    Получить картинку урока. Поддерживает If-None-Match и If-Modified-Since,
+    по адресу с актуальной версией (?v=) картинка кэшируется навсегда.
+    size - уменьшенная копия в WebP или JPEG, по заголовку Accept
+    """
+    await _services.get_lesson_by_number(id, lesson_number, session)
     if not _courses.is_lesson_initialized(id, lesson_number):
         raise _fastapi.HTTPException(404, "no such lesson")
-    return await _courses.get_step_image(id, lesson_number, step_number)
+    return await _courses.get_step_image(id, lesson_number, step_number, request, size)
 
 
-@fastapi.get("/api/courses/{id}/lessons/{number}", response_model=_schemas.LessonFull)
+@fastapi.get(
+    "/api/courses/{id}/lessons/{number}",
+    response_model=_schemas.LessonFull,
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def get_lesson(
     id: int,
     number: int,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """ Получить подробную информацию об уроке курса """
-    await _services.check_cookie_and_update_user_online(user, session)
-    course = _services.get_course_model(id, session)
+    course = await _services.get_course_model(id, session)
     return await _services.get_lesson(course, number)
 
 
+@fastapi.get(
+    "/api/courses/{id}/lessons/{number}/bundle",
+    response_model=_schemas.LessonBundle,
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
+async def get_lesson_bundle(
+    id: int,
+    number: int,
+    stream: bool = False,
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
+):
+    """
+    Получить урок с текстами всех шагов и ссылками на картинки одним ответом.
+    stream=true - ответ в NDJSON: первая строка - урок, дальше шаги по одному
+    """
+    logger.debug("")
+    lesson = _schemas.SqlLesson.from_orm(await _services.get_lesson_by_number(id, number, session))
+    if not _courses.is_lesson_initialized(id, number):
+        raise _fastapi.HTTPException(404, "no such lesson")
+    if stream:
+        return _fastapi.responses.StreamingResponse(
+            _courses.stream_lesson_bundle(lesson, id),
+            media_type="application/x-ndjson"
+        )
+    return _schemas.LessonBundle(**lesson.dict(), steps=await _courses.get_lesson_bundle_steps(id, number))
+
+
 @fastapi.put("/api/courses/{id}/lessons/{number}", status_code=204)
 async def update_lesson(
     id: int,
     number: int,
     update: _schemas.LessonUpdate,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.signed),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Редактирование уроков.
     Доступно для админов и автора курса
     """
     logger.debug("")
-
-    model, role = await _services.get_account_by_cookie(user, session)
-    if not role:
-        return _cookies.get_unsign_response()
-
-    course = _services.get_course_model(id, session)
-    uid = model.id if role == "student" else model.user.id
-    if role != "admin" and course.author_id != uid:
+    course = await _services.get_course_model(id, session)
+    if account.role != "admin" and course.author_id != account.user.id:
         raise _fastapi.HTTPException(400, "Permission denied")
     lesson = await _services.get_lesson_model(course, number)
     await _services.update_lesson(lesson, update, session)
@@ -803,163 +983,142 @@ async def update_lesson(
 async def delete_lesson(
     id: int,
     number: int,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.signed),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
     """
     Удаление уроков.
     Доступно для админов и автора курса
     """
     logger.debug("")
-
-    model, role = await _services.get_account_by_cookie(user, session)
-    if not role:
-        return _cookies.get_unsign_response()
-
-    course = _services.get_course_model(id, session)
-    uid = model.id if role == "student" else model.user.id
-    if role != "admin" and course.author_id != uid:
+    course = await _services.get_course_model(id, session)
+    if account.role != "admin" and course.author_id != account.user.id:
         raise _fastapi.HTTPException(400, "Permission denied")
     lesson = await _services.get_lesson_model(course, number)
     await _services.drop_lesson(lesson, session)
-    await _courses.drop_lesson(lesson.course.id, lesson.number)
+    await _courses.drop_lesson(lesson.course_id, lesson.number)
 
 
-@fastapi.get("/api/feed", response_model=_typing.List[_schemas.ShortNews])
+@fastapi.get(
+    "/api/feed",
+    response_model=_typing.List[_schemas.ShortNews],
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def get_feed(
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
 ):
-    await _services.check_cookie_and_update_user_online(user, session)
     return await _news.get_feed()
 
 
-@fastapi.get("/api/feed/{id}", response_model=_schemas.FullNews)
+@fastapi.get("/api/feed/{id}", response_model=_schemas.FullNews, dependencies=[_fastapi.Depends(_auth.get_principal)])
 async def get_news(
         id: int,
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
 ):
-    await _services.check_cookie_and_update_user_online(user, session)
     return await _news.get_news_full(id)
 
 
-@fastapi.get("/api/feed/{nid}/paragraphs/{pid}/image")
+@fastapi.api_route(
+    "/api/feed/{nid}/paragraphs/{pid}/image",
+    methods=["GET", "HEAD"],
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def get_paragraph_image(
         nid: int,
         pid: int,
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+        request: _fastapi.Request,
+        size: _typing.Optional[_schemas.image_sizes] = None,
+        session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
-    await _services.check_cookie_and_update_user_online(user, session)
-    return await _news.get_paragraph_image(nid, pid)
+    return await _news.get_paragraph_image(nid, pid, request, size, session)
 
 
-@fastapi.post("/api/feed", response_model=int)
+@fastapi.post("/api/feed", response_model=int, dependencies=[_fastapi.Depends(_auth.admin)])
 async def initialize_news(
         data: _schemas.InitNews,
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
 ):
-    _, role = await _services.get_account_by_cookie(user, session)
-    if not role == "admin":
-        return _cookies.get_unsign_response()
     return await _news.init_news(data)
 
 
-@fastapi.post("/api/feed/{id}", response_model=int)
+@fastapi.post("/api/feed/{id}", response_model=int, dependencies=[_fastapi.Depends(_auth.admin)])
 async def load_paragraph(
         id: int,
         paragraph: _schemas.NewsParagraphCreate,
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
 ):
-    _, role = await _services.get_account_by_cookie(user, session)
-    if not role == "admin":
-        return _cookies.get_unsign_response()
     return await _news.load_paragraph(paragraph, id)
 
 
-@fastapi.post("/api/feed/{nid}/paragraphs/{pid}/image", status_code=204)
+@fastapi.post("/api/feed/{nid}/paragraphs/{pid}/image", status_code=204, dependencies=[_fastapi.Depends(_auth.admin)])
 async def load_paragraph_image(
         nid: int,
         pid: int,
-        image: _fastapi.UploadFile,
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+        request: _fastapi.Request,
+        image: _typing.Optional[_fastapi.UploadFile] = _fastapi.File(None),
+        session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
-    _, role = await _services.get_account_by_cookie(user, session)
-    if not role == "admin":
-        return _cookies.get_unsign_response()
-    await _news.upload_image(image, nid, pid)
+    await _news.upload_image(request, image, nid, pid, session)
 
 
-@fastapi.post("/api/courses/search", response_model=_typing.List[_schemas.CourseShort])
+@fastapi.post(
+    "/api/courses/search",
+    response_model=_schemas.CoursesPage,
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def search_courses(
         tags: _typing.List[int],
-        page: int = 1,
-        pagesize: int = 20,
+        cursor: _typing.Optional[str] = None,
+        pagesize: int = _pagination.pagesize_query,
         desc: bool = False,
         sort: _schemas.course_search_sorts = "name",
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+        match: _schemas.course_tags_match = "any",
+        read_session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_read_session)
 ):
-    await _services.check_cookie_and_update_user_online(user, session)
-    return await _services.search_courses(tags, page, pagesize, desc, sort, session)
+    return await _services.search_courses(tags, cursor, pagesize, desc, sort, match, read_session)
 
 
 @fastapi.get("/api/users/me/groups/", response_model=_typing.List[_schemas.Group])
 async def get_user_groups(
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
-):
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role == "student":
-        return await _services.get_student_groups(model)
-    elif role == "teacher":
-        return await _services.get_teacher_groups(model)
-    else:
-        return _cookies.get_unsign_response()
+        account: _cookies.Account = _fastapi.Depends(_auth.user),
+        session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
+):
+    if account.role == "student":
+        return await _services.get_student_groups(account.user, session)
+    return await _services.get_teacher_groups(account.teacher, session)
 
 
 @fastapi.post("/api/groups/", status_code=204)
 async def create_group(
         data: _schemas.GroupCreate,
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+        account: _typing.Optional[_cookies.Account] = _fastapi.Depends(_auth.get_account),
+        session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role != "teacher":
+    if not account or account.role != "teacher":
         raise _fastapi.HTTPException(400, "Only teacher can create class")
-    await _services.create_group(data.name, model, session)
+    await _services.create_group(data.name, account.teacher, session)
 
 
 @fastapi.get("/api/groups/{id}/link", response_model=str)
 async def create_join_group_link(
         id: int,
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+        account: _typing.Optional[_cookies.Account] = _fastapi.Depends(_auth.get_account),
+        session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role != "teacher":
+    if not account or account.role != "teacher":
         raise _fastapi.HTTPException(400, "Only teacher can add students to class")
-    group = _services.get_group_model(id, session)
-    if group.teacher_id != model.user.id:
-        return _cookies.get_unsign_response()
+    group = await _services.get_group_model(id, session)
+    if group.teacher_id != account.user.id:
+        raise _auth.UnauthorizedError
     return await _links.create_join_group_link(group, session)
 
 
 @fastapi.get("/api/groups/join/{url}", status_code=204)
 async def join_group_via_link(
         url: str,
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+        account: _typing.Optional[_cookies.Account] = _fastapi.Depends(_auth.get_account),
+        session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role != "student":
+    if not account or account.role != "student":
         raise _fastapi.HTTPException(400, "Only student can join class via link")
     try:
-        await _links.join_group(url, model, session)
+        await _links.join_group(url, account.user, session)
     except _links.LinkJoinUseless:
         resp = await _staticpages.get_link_join_useless_page()
         resp.status_code = 400
@@ -970,64 +1129,59 @@ async def join_group_via_link(
         return resp
 
 
-@fastapi.delete("/api/groups/{gid}/students/{sid}", status_code=204)
+@fastapi.delete("/api/groups/{gid}/students/{sid}", status_code=204, dependencies=[_fastapi.Depends(_auth.teacher)])
 async def ban_student_from_group(
         gid: int,
         sid: int,
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+        session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
-    _, role = await _services.get_account_by_cookie(user, session)
-    if role != "teacher":
-        return _cookies.get_unsign_response()
-    student = _services.get_student_model(sid, session)
-    group = _services.get_group_model(gid, session)
+    student = await _services.get_student_model(sid, session)
+    group = await _services.get_group_model(gid, session)
     await _services.ban_from_group(student, group, session)
 
 
-@fastapi.get("/api/companies/all/names", response_model=_typing.List[_schemas.CompanyShort])
+@fastapi.get(
+    "/api/companies/all/names",
+    response_model=_schemas.CompaniesNamesPage,
+    dependencies=[_fastapi.Depends(_auth.get_principal)]
+)
 async def get_all_companies_names(
-        user: cookietype = None,
-        session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+        cursor: _typing.Optional[str] = None,
+        pagesize: int = _pagination.pagesize_query,
+        desc: bool = False,
+        sort: _schemas.companies_sort_types = "name",
+        read_session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_read_session)
 ):
-    await _services.check_cookie_and_update_user_online(user, session)
-    return await _services.get_all_companies_names(session)
+    return await _services.get_all_companies_names(cursor, pagesize, sort, desc, read_session)
 
 
-@fastapi.get("/api/groups/{id}/sessions", response_model=_typing.List[_schemas.Session])
+@fastapi.get(
+    "/api/groups/{id}/sessions",
+    response_model=_typing.List[_schemas.Session],
+    dependencies=[_fastapi.Depends(_auth.teacher)]
+)
 async def get_group_sessions(
     id: int,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
-    _, role = await _services.get_account_by_cookie(user, session)
-    if role != "teacher":
-        return _cookies.get_unsign_response()
-    group = _services.get_group_model(id, session)
+    group = await _services.get_group_model(id, session)
     return await _services.get_group_sessions(group, session)
 
 
 @fastapi.get("/api/studets/me/sessions", response_model=_typing.List[_schemas.Session])
 async def get_student_sessions(
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    account: _cookies.Account = _fastapi.Depends(_auth.student),
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
-    model, role = await _services.get_account_by_cookie(user, session)
-    if role != "student":
-        return _cookies.get_unsign_response()
-    return await _services.get_student_sessions(model, session)
+    return await _services.get_student_sessions(account.user, session)
 
 
-@fastapi.post("/api/groups/{id}/sessions/", status_code=204)
+@fastapi.post("/api/groups/{id}/sessions/", status_code=204, dependencies=[_fastapi.Depends(_auth.teacher)])
 async def start_group_session(
     course_id: int,
     id: int,
-    user: cookietype = None,
-    session: _orm.Session = _fastapi.Depends(_services.get_db_session)
+    session: _asyncio.AsyncSession = _fastapi.Depends(_services.get_db_session)
 ):
-    _, role = await _services.get_account_by_cookie(user, session)
-    if role != "teacher":
-        return _cookies.get_unsign_response()
-    group = _services.get_group_model(id, session)
-    course = _services.get_course_model(course_id, session)
+    group = await _services.get_group_model(id, session)
+    course = await _services.get_course_model(course_id, session)
     await _services.start_group_session(group, course, session)
@@ -0,0 +1,203 @@
+import typing as _typing
+import contextlib as _contextlib
+
+import sqlalchemy as _sql
+from loguru import logger as _logger
+
+import database as _database
+import models as _models
+
+
+"""
+Версионные миграции схемы базы данных.
+Миграция - функция от соединения, выполняемая в отдельной транзакции.
+Номер последней примененной миграции хранится в таблице schema_version.
+Миграции должны быть повторяемыми: на новой базе create_all уже создает
+таблицы и индексы в их итоговом виде.
+Запуск: python migrations.py
+
+"""
+
+
+class MigrationError(Exception):
+    pass
+
+
+_metadata = _sql.MetaData()
+
+schema_version = _sql.Table(
+    "schema_version",
+    _metadata,
+    _sql.Column("version", _sql.Integer, nullable=False),
+)
+
+
+def _index(name: str) -> _sql.Index:
+
+    """
+    Возвращает индекс, объявленный в models.py, по имени
+    """
+
+    for table in _database.Base.metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise MigrationError(f"index {name} is not declared in models")
+
+
+def _create_indexes(*names: str):
+    def migration(conn: _sql.Connection):
+        for name in names:
+            _index(name).create(conn, checkfirst=True)
+    return migration
+
+
+def _create_tables(*names: str):
+    def migration(conn: _sql.Connection):
+        for name in names:
+            _database.Base.metadata.tables[name].create(conn, checkfirst=True)
+    return migration
+
+
+def _drop_index(table: str, name: str):
+    def migration(conn: _sql.Connection):
+        if name in (i["name"] for i in _sql.inspect(conn).get_indexes(table)):
+            conn.execute(_sql.text(f"DROP INDEX {name}"))
+    return migration
+
+
+def _add_column(model: _typing.Type[_database.Base], name: str):
+
+    """
+    Добавляет в существующую таблицу столбец, объявленный в models.py.
+    Столбец NOT NULL должен иметь server_default
+    """
+
+    def migration(conn: _sql.Connection):
+        table = model.__table__
+        if name in (c["name"] for c in _sql.inspect(conn).get_columns(table.name)):
+            return
+        column = _sql.schema.CreateColumn(table.c[name]).compile(dialect=conn.dialect)
+        conn.execute(_sql.text(
+            f"ALTER TABLE {conn.dialect.identifier_preparer.format_table(table)} ADD COLUMN {column}"
+        ))
+    return migration
+
+
+def _check_unique(model: _typing.Type[_database.Base], *columns: str):
+
+    """
+    Проверяет, что в таблице нет строк, нарушающих будущее ограничение уникальности
+    """
+
+    def migration(conn: _sql.Connection):
+        cols = [getattr(model, c) for c in columns]
+        duplicates = conn.execute(
+            _sql.select(*cols).group_by(*cols).having(_sql.func.count() > 1).limit(10)
+        ).all()
+        if duplicates:
+            raise MigrationError(
+                f"duplicate {model.__tablename__} {columns}: {[tuple(d) for d in duplicates]}"
+            )
+    return migration
+
+
+def _initial(conn: _sql.Connection):
+    _database.Base.metadata.create_all(conn)
+
+
+# (версия, описание, шаги)
+MIGRATIONS: _typing.List[_typing.Tuple[int, str, _typing.Tuple[_typing.Callable, ...]]] = [
+    (1, "initial schema", (_initial,)),
+    (2, "indexes for course search", (
+        _create_indexes(
+            "ix_course_tags_specialization_id_course_id",
+            "ix_course_views_id",
+            "ix_course_date_created_id",
+        ),
+    )),
+    (3, "indexes for hot lookups", (
+        _create_indexes(
+            "ix_link_target_action",
+            "ix_user_role_id",
+            "ix_individual_sessions_user_id",
+            "ix_notification_date_alarm",
+        ),
+        _drop_index("link", "ix_link_target"),
+        _check_unique(_models.Lesson, "course_id", "number"),
+        _create_indexes("uq_lesson_course_id_number"),
+    )),
+    (4, "indexes on foreign keys", (
+        _create_indexes(
+            "ix_user_activities_user_id",
+            "ix_group_teacher_id",
+            "ix_group_students_group_id",
+            "ix_session_course_id",
+            "ix_group_sessions_group_id",
+            "ix_hometask_session_id",
+            "ix_hometask_student_id",
+            "ix_chat_members_user_id",
+        ),
+    )),
+    (5, "token versions", (
+        _add_column(_models.User, "token_version"),
+        _add_column(_models.Admin, "token_version"),
+    )),
+    (6, "device sessions", (
+        _create_tables("auth_session"),
+    )),
+    # картинки, сохраненные до версии 7 в дереве файлов, переносятся в хранилище скриптом blobimport.py
+    (7, "blob store", (
+        _create_tables("blob", "blob_ref"),
+    )),
+]
+
+
+@_contextlib.contextmanager
+def _transaction(engine: _sql.Engine):
+
+    """
+    Транзакция миграции. pysqlite сам открывает транзакцию только перед DML,
+    поэтому для SQLite она открывается явно, чтобы DDL откатывался вместе с остальными шагами
+    """
+
+    with engine.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            conn.exec_driver_sql("BEGIN")
+        yield conn
+
+
+def get_version(conn: _sql.Connection) -> int:
+    if not _sql.inspect(conn).has_table(schema_version.name):
+        return 0
+    return conn.scalar(_sql.select(_sql.func.max(schema_version.c.version))) or 0
+
+
+def migrate(
+        engine: _sql.Engine = _database.engine,
+        target: _typing.Optional[int] = None
+) -> int:
+
+    """
+    Применяет к базе все миграции новее текущей версии (до target включительно).
+    Возвращает версию схемы после применения
+    """
+
+    with engine.begin() as conn:
+        _metadata.create_all(conn)
+        version = get_version(conn)
+    for number, description, steps in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        with _transaction(engine) as conn:
+            for step in steps:
+                step(conn)
+            conn.execute(schema_version.delete())
+            conn.execute(schema_version.insert().values(version=number))
+        version = number
+        _logger.info(f"database migrated to version {number}: {description}")
+    return version
+
+
+if __name__ == "__main__":
+    print(f"schema version: {migrate()}")
@@ -15,6 +15,10 @@ import database as _db
 class User(_db.Base):
 
     __tablename__ = "user"
+    __table_args__ = (
+        # списки пользователей одной роли с постраничной выдачей по id
+        _sql.Index("ix_user_role_id", "role", "id"),
+    )
 
     id = _sql.Column(_sql.Integer, primary_key=True, index=True)
     role = _sql.Column(_sql.String, nullable=False, default="student")
@@ -26,8 +30,9 @@ class User(_db.Base):
     date_created = _sql.Column(_sql.DateTime)
     date_online = _sql.Column(_sql.DateTime)
     sign = _sql.Column(_sql.String, nullable=True)
-    telegram = _sql.Column(_sql.Integer, nullable=True, index=True)
+    telegram = _sql.Column(_sql.BigInteger, nullable=True, index=True)
     confirmed = _sql.Column(_sql.Boolean, nullable=False, index=True, default=False)
+    token_version = _sql.Column(_sql.Integer, nullable=False, default=0, server_default="0")
 
     groups: _orm.Mapped[_typing.List["GroupStudents"]] = \
         _orm.relationship(back_populates="student")
@@ -62,7 +67,7 @@ class UserActivities(_db.Base):
     __tablename__ = "user_activities"
 
     id = _sql.Column(_sql.Integer,  primary_key=True, index=True)
-    user_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id"))
+    user_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id", ondelete="CASCADE"), index=True)
     date = _sql.Column(_sql.DateTime)
 
     user: _orm.Mapped["User"] = \
@@ -91,7 +96,12 @@ class CompanyContacts(_db.Base):
     __tablename__ = "company_contacts"
 
     id = _sql.Column(_sql.Integer,  primary_key=True, index=True)
-    company_id = _sql.Column(_sql.Integer, _sql.ForeignKey("company.id"), nullable=False, index=True)
+    company_id = _sql.Column(
+        _sql.Integer,
+        _sql.ForeignKey("company.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True
+    )
     kind = _sql.Column(_sql.String, nullable=False, index=True)
     value = _sql.Column(_sql.String, nullable=False, unique=True)
 
@@ -120,8 +130,12 @@ class CompanySpecializations(_db.Base):
 
     __tablename__ = "company_specializations"
 
-    company_id = _sql.Column(_sql.Integer, _sql.ForeignKey("company.id"), primary_key=True)
-    specialization_id = _sql.Column(_sql.Integer, _sql.ForeignKey("specialization.id"), primary_key=True)
+    company_id = _sql.Column(_sql.Integer, _sql.ForeignKey("company.id", ondelete="CASCADE"), primary_key=True)
+    specialization_id = _sql.Column(
+        _sql.Integer,
+        _sql.ForeignKey("specialization.id", ondelete="CASCADE"),
+        primary_key=True
+    )
 
     company: _orm.Mapped["Company"] = \
         _orm.relationship(back_populates="specializations")
@@ -134,7 +148,7 @@ class Teacher(_db.Base):
 
     __tablename__ = "teacher"
 
-    user_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id"), primary_key=True, index=True)
+    user_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id", ondelete="CASCADE"), primary_key=True, index=True)
     company_id = _sql.Column(_sql.Integer, _sql.ForeignKey("company.id"), index=True, nullable=True)
     bio = _sql.Column(_sql.String, nullable=True, index=False)
 
@@ -155,8 +169,12 @@ class TeacherSpecializations(_db.Base):
 
     __tablename__ = "teacher_specializations"
 
-    user_id = _sql.Column(_sql.Integer, _sql.ForeignKey("teacher.user_id"), primary_key=True)
-    specialization_id = _sql.Column(_sql.Integer, _sql.ForeignKey("specialization.id"), primary_key=True)
+    user_id = _sql.Column(_sql.Integer, _sql.ForeignKey("teacher.user_id", ondelete="CASCADE"), primary_key=True)
+    specialization_id = _sql.Column(
+        _sql.Integer,
+        _sql.ForeignKey("specialization.id", ondelete="CASCADE"),
+        primary_key=True
+    )
 
     teacher: _orm.Mapped["Teacher"] = \
         _orm.relationship(back_populates="specializations")
@@ -168,6 +186,11 @@ class TeacherSpecializations(_db.Base):
 class Course(_db.Base):
 
     __tablename__ = "course"
+    __table_args__ = (
+        # сортировки поиска курсов с постраничной выдачей по ключу (sort, id)
+        _sql.Index("ix_course_views_id", "views", "id"),
+        _sql.Index("ix_course_date_created_id", "date_created", "id"),
+    )
 
     id = _sql.Column(_sql.Integer, primary_key=True, index=True)
     name = _sql.Column(_sql.String, unique=True, index=True, nullable=False)
@@ -193,9 +216,17 @@ class Course(_db.Base):
 class CourseTags(_db.Base):
 
     __tablename__ = "course_tags"
-
-    course_id = _sql.Column(_sql.Integer, _sql.ForeignKey("course.id"), primary_key=True)
-    specialization_id = _sql.Column(_sql.Integer, _sql.ForeignKey("specialization.id"), primary_key=True)
+    __table_args__ = (
+        # поиск курсов по тегам идет от тега к курсам, первичный ключ начинается с course_id
+        _sql.Index("ix_course_tags_specialization_id_course_id", "specialization_id", "course_id"),
+    )
+
+    course_id = _sql.Column(_sql.Integer, _sql.ForeignKey("course.id", ondelete="CASCADE"), primary_key=True)
+    specialization_id = _sql.Column(
+        _sql.Integer,
+        _sql.ForeignKey("specialization.id", ondelete="CASCADE"),
+        primary_key=True
+    )
 
     course: _orm.Mapped["Course"] = \
         _orm.relationship(back_populates="tags")
@@ -207,9 +238,12 @@ class CourseTags(_db.Base):
 class Lesson(_db.Base):
 
     __tablename__ = "lesson"
+    __table_args__ = (
+        _sql.Index("uq_lesson_course_id_number", "course_id", "number", unique=True),
+    )
 
     id = _sql.Column(_sql.Integer, primary_key=True, index=True)
-    course_id = _sql.Column(_sql.Integer, _sql.ForeignKey("course.id"), index=True)
+    course_id = _sql.Column(_sql.Integer, _sql.ForeignKey("course.id", ondelete="CASCADE"), index=True)
     number = _sql.Column(_sql.Integer, nullable=False)
     name = _sql.Column(_sql.String, nullable=False)
     description = _sql.Column(_sql.String, nullable=True, index=False)
@@ -228,7 +262,7 @@ class Group(_db.Base):
 
     id = _sql.Column(_sql.Integer, primary_key=True, index=True)
     name = _sql.Column(_sql.String, nullable=False, index=True)
-    teacher_id = _sql.Column(_sql.Integer, _sql.ForeignKey("teacher.user_id"))
+    teacher_id = _sql.Column(_sql.Integer, _sql.ForeignKey("teacher.user_id", ondelete="CASCADE"), index=True)
 
     teacher: _orm.Mapped["Teacher"] = \
         _orm.relationship(back_populates="groups")
@@ -244,8 +278,8 @@ class GroupStudents(_db.Base):
 
     __tablename__ = "group_students"
 
-    student_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id"), primary_key=True)
-    group_id = _sql.Column(_sql.Integer, _sql.ForeignKey("group.id"), primary_key=True)
+    student_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    group_id = _sql.Column(_sql.Integer, _sql.ForeignKey("group.id", ondelete="CASCADE"), primary_key=True, index=True)
 
     student: _orm.Mapped["User"] = \
         _orm.relationship(back_populates="groups")
@@ -259,7 +293,7 @@ class Session(_db.Base):
     __tablename__ = "session"
 
     id = _sql.Column(_sql.Integer, primary_key=True, index=True)
-    course_id = _sql.Column(_sql.Integer, _sql.ForeignKey("course.id"))
+    course_id = _sql.Column(_sql.Integer, _sql.ForeignKey("course.id", ondelete="CASCADE"), index=True)
     date_started = _sql.Column(_sql.Date)
     date_ended = _sql.Column(_sql.Date, nullable=True)
     active = _sql.Column(_sql.Boolean, nullable=False, default=True)
@@ -284,8 +318,8 @@ class GroupSessions(_db.Base):
 
     __tablename__ = "group_sessions"
 
-    session_id = _sql.Column(_sql.Integer, _sql.ForeignKey("session.id"), primary_key=True)
-    group_id = _sql.Column(_sql.Integer,  _sql.ForeignKey("group.id"), primary_key=True)
+    session_id = _sql.Column(_sql.Integer, _sql.ForeignKey("session.id", ondelete="CASCADE"), primary_key=True)
+    group_id = _sql.Column(_sql.Integer,  _sql.ForeignKey("group.id", ondelete="CASCADE"), primary_key=True, index=True)
 
     session: _orm.Mapped["Session"] = \
         _orm.relationship(back_populates="group")
@@ -298,8 +332,8 @@ class IndividualSessions(_db.Base):
 
     __tablename__ = "individual_sessions"
 
-    session_id = _sql.Column(_sql.Integer, _sql.ForeignKey("session.id"), primary_key=True)
-    user_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id"), primary_key=True)
+    session_id = _sql.Column(_sql.Integer, _sql.ForeignKey("session.id", ondelete="CASCADE"), primary_key=True)
+    user_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id", ondelete="CASCADE"), primary_key=True, index=True)
 
     session: _orm.Mapped["Session"] = \
         _orm.relationship(back_populates="user")
@@ -314,8 +348,8 @@ class Hometask(_db.Base):
 
     id = _sql.Column(_sql.Integer, primary_key=True, index=True)
     description = _sql.Column(_sql.String, nullable=False)
-    session_id = _sql.Column(_sql.Integer, _sql.ForeignKey("session.id"))
-    student_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id"))
+    session_id = _sql.Column(_sql.Integer, _sql.ForeignKey("session.id", ondelete="CASCADE"), index=True)
+    student_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id", ondelete="CASCADE"), index=True)
     date_given = _sql.Column(_sql.DateTime)
     date_done = _sql.Column(_sql.DateTime)
     deadline = _sql.Column(_sql.DateTime)
@@ -333,9 +367,9 @@ class Progress(_db.Base):
     __tablename__ = "progress"
 
     id = _sql.Column(_sql.Integer, primary_key=True, index=True)
-    student_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id"), index=True)
-    lesson_id = _sql.Column(_sql.Integer, _sql.ForeignKey("lesson.id"), index=True)
-    session_id = _sql.Column(_sql.Integer, _sql.ForeignKey("session.id"), index=True)
+    student_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id", ondelete="CASCADE"), index=True)
+    lesson_id = _sql.Column(_sql.Integer, _sql.ForeignKey("lesson.id", ondelete="CASCADE"), index=True)
+    session_id = _sql.Column(_sql.Integer, _sql.ForeignKey("session.id", ondelete="CASCADE"), index=True)
     step = _sql.Column(_sql.Integer, nullable=False)
 
     student: _orm.Mapped["User"] = \
@@ -364,8 +398,8 @@ class ChatMembers(_db.Base):
 
     __tablename__ = "chat_members"
 
-    chat_id = _sql.Column(_sql.Integer, _sql.ForeignKey("chat.id"), primary_key=True)
-    user_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id"), primary_key=True)
+    chat_id = _sql.Column(_sql.Integer, _sql.ForeignKey("chat.id", ondelete="CASCADE"), primary_key=True)
+    user_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id", ondelete="CASCADE"), primary_key=True, index=True)
     admin = _sql.Column(_sql.Boolean, nullable=False)
 
     chat: _orm.Mapped["Chat"] = \
@@ -383,16 +417,60 @@ class Admin(_db.Base):
     login = _sql.Column(_sql.String, unique=True, index=True)
     password = _sql.Column(_sql.String, nullable=False)
     sign = _sql.Column(_sql.String)
-    telegram = _sql.Column(_sql.Integer, nullable=True, index=True)
+    telegram = _sql.Column(_sql.BigInteger, nullable=True, index=True)
+    token_version = _sql.Column(_sql.Integer, nullable=False, default=0, server_default="0")
+
+
+# Вход в аккаунт с одного устройства. Cookie устройства - "id владельца.секрет",
+# в базе хранится только sha256 секрета. Заполнено ровно одно из полей user_id, admin_id
+class AuthSession(_db.Base):
+
+    __tablename__ = "auth_session"
+
+    id = _sql.Column(_sql.Integer, primary_key=True)
+    token_hash = _sql.Column(_sql.String(64), nullable=False, unique=True, index=True)
+    user_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id", ondelete="CASCADE"), nullable=True, index=True)
+    admin_id = _sql.Column(_sql.Integer, _sql.ForeignKey("admin.id", ondelete="CASCADE"), nullable=True, index=True)
+    date_created = _sql.Column(_sql.DateTime, nullable=False)
+    date_seen = _sql.Column(_sql.DateTime, nullable=False)
+    date_expired = _sql.Column(_sql.DateTime, nullable=False, index=True)
+
+
+# Файл хранилища blobs, адресуемый sha256 содержимого.
+# refs - число ссылок (blob_ref), файл без ссылок удаляется модулем ttl после date_released
+class Blob(_db.Base):
+
+    __tablename__ = "blob"
+
+    hash = _sql.Column(_sql.String(64), primary_key=True)
+    mime = _sql.Column(_sql.String, nullable=False)
+    size = _sql.Column(_sql.Integer, nullable=False)
+    width = _sql.Column(_sql.Integer, nullable=True)
+    height = _sql.Column(_sql.Integer, nullable=True)
+    refs = _sql.Column(_sql.Integer, nullable=False, default=0)
+    date_created = _sql.Column(_sql.DateTime, nullable=False)
+    date_released = _sql.Column(_sql.DateTime, nullable=True, index=True)
+
+
+# Ссылка владельца на blob: "step:курс/урок/шаг" - картинка шага, "news:новость/абзац" - картинка абзаца
+class BlobRef(_db.Base):
+
+    __tablename__ = "blob_ref"
+
+    owner = _sql.Column(_sql.String, primary_key=True)
+    blob_hash = _sql.Column(_sql.String(64), _sql.ForeignKey("blob.hash"), nullable=False, index=True)
 
 
 class Link(_db.Base):
 
     __tablename__ = "link"
+    __table_args__ = (
+        _sql.Index("ix_link_target_action", "target", "action"),
+    )
 
     url = _sql.Column(_sql.String, primary_key=True)
     action = _sql.Column(_sql.String, nullable=False)
-    target = _sql.Column(_sql.Integer, nullable=False, index=True)
+    target = _sql.Column(_sql.Integer, nullable=False)
     date_expired = _sql.Column(_sql.DateTime, nullable=True)
     limit = _sql.Column(_sql.Integer, nullable=True)
     count_used = _sql.Column(_sql.Integer, default=0)
@@ -403,8 +481,8 @@ class Notification(_db.Base):
     __tablename__ = "notification"
 
     id = _sql.Column(_sql.Integer, primary_key=True, index=True)
-    user_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id"), index=True)
-    date_alarm = _sql.Column(_sql.DateTime, nullable=False)
+    user_id = _sql.Column(_sql.Integer, _sql.ForeignKey("user.id", ondelete="CASCADE"), index=True)
+    date_alarm = _sql.Column(_sql.DateTime, nullable=False, index=True)
     title = _sql.Column(_sql.String, nullable=False)
     descritption = _sql.Column(_sql.String, nullable=True)
     url = _sql.Column(_sql.String, nullable=True)
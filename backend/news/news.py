@@ -4,8 +4,13 @@ import typing as _typing
 
 import aiofiles as _aiofiles
 import fastapi as _fastapi
+from sqlalchemy.ext import asyncio as _asyncio
 
 import schemas as _schemas
+import blobs as _blobs
+import database as _database
+import images as _images
+import uploads as _uploads
 
 
 def _get_news_ids():
@@ -56,34 +61,37 @@ async def get_news_full(id: int):
         return _schemas.FullNews.parse_raw(await file.read())
 
 
-async def upload_image(upload: _fastapi.UploadFile, nid: int, pid: int):
-    ext = upload.filename.split(".")[-1].lower()
-    if ext not in ("png", "jpg", "jpeg"):
-        raise _fastapi.HTTPException(415, "Unsupportable image type")
-    if upload.size > 1048576:
-        raise _fastapi.HTTPException(413, "Image too large")
-    async with _aiofiles.open(
-        f"{_os.getcwd()}/news/images/{nid}-{pid}.{ext}",
-        "wb"
-    ) as file:
-        content = await upload.read()
-        await file.write(content)
-
-
-async def get_paragraph_image(nid: int, pid: int):
-    images = tuple(filter(
-        (lambda name: f"{nid}-{pid}" in name),
-        _os.listdir(f"{_os.getcwd()}/news/images")
-    ))
-    if not images:
+async def upload_image(
+        request: _fastapi.Request,
+        upload: _typing.Optional[_fastapi.UploadFile],
+        nid: int,
+        pid: int,
+        se: _asyncio.AsyncSession
+):
+    async with _database.transaction(se):
+        blob = await _uploads.receive_image(request, upload, se)
+        await _blobs.attach(_blobs.paragraph_owner(nid, pid), blob.hash, se)
+    await _images.generate(blob.hash, blob.mime)
+
+
+async def get_paragraph_image(
+        nid: int,
+        pid: int,
+        request: _fastapi.Request,
+        size: _typing.Optional[_schemas.image_sizes],
+        se: _asyncio.AsyncSession
+):
+    blob = await _blobs.get(_blobs.paragraph_owner(nid, pid), se)
+    if blob is None:
         raise _fastapi.HTTPException(404, "No such image")
-    image_name = images[0]
-    return _fastapi.responses.FileResponse(f"{_os.getcwd()}/news/images/{image_name}")
+    return await _images.serve(request, blob.hash, blob.mime, _blobs.mtime(blob), size)
 
 
-def drop_news(news_id):
+async def drop_news(news_id: int, se: _asyncio.AsyncSession):
     if not _os.path.isfile(f"{_os.getcwd()}/news/news/{news_id}.json"):
         raise _fastapi.HTTPException(404, "no such news") 
+    async with _database.transaction(se):
+        await _blobs.detach_all(_blobs.paragraphs_prefix(news_id), se)
     _os.remove(f"{_os.getcwd()}/news/news/{news_id}.json")
 
 
@@ -98,8 +106,10 @@ async def get_paragraph(nid: int, pid: int):
     raise _fastapi.HTTPException(404, "no such paragraph")
 
 
-async def drop_paragraph(nid: int, pid: int):
+async def drop_paragraph(nid: int, pid: int, se: _asyncio.AsyncSession):
     schema, paragraph = await get_paragraph(nid, pid)
+    async with _database.transaction(se):
+        await _blobs.detach(_blobs.paragraph_owner(nid, pid), se)
     schema.paragraphs.remove(paragraph)
     async with _aiofiles.open(f"{_os.getcwd()}/news/news/{nid}.json", "w", encoding="utf-8") as file:
         await file.write(schema.json(indent=2))
@@ -0,0 +1,100 @@
+import json as _json
+import base64 as _base64
+import typing as _typing
+import datetime as _dt
+
+import fastapi as _fastapi
+import sqlalchemy as _sql
+from sqlalchemy.ext import asyncio as _asyncio
+
+
+"""
+Постраничная выдача по ключу (keyset).
+Следующая страница начинается после последней строки предыдущей:
+WHERE (sort, id) > (last_sort, last_id) ORDER BY sort, id LIMIT n.
+Позиция передается клиенту непрозрачным курсором
+
+"""
+
+
+DEFAULT_PAGESIZE = 20
+
+MAX_PAGESIZE = 100
+
+pagesize_query = _fastapi.Query(DEFAULT_PAGESIZE, ge=1, le=MAX_PAGESIZE)
+
+
+class CursorError(Exception):
+    pass
+
+
+def encode_cursor(sort: str, value: _typing.Any, id: int) -> str:
+    if isinstance(value, (_dt.date, _dt.datetime)):
+        value = value.isoformat()
+    return _base64.urlsafe_b64encode(_json.dumps([sort, value, id]).encode()).decode()
+
+
+def decode_cursor(cursor: str, sort: str, column: _sql.Column) -> _typing.Tuple[_typing.Any, int]:
+
+    """
+    Возвращает значение столбца сортировки и id последней строки страницы.
+    Курсор, выданный для другой сортировки или поврежденный, вызывает CursorError
+    """
+
+    try:
+        cursor_sort, value, id = _json.loads(_base64.urlsafe_b64decode(cursor.encode()))
+        if cursor_sort != sort:
+            raise CursorError("cursor was issued for another sort")
+        python_type = column.type.python_type
+        if python_type in (_dt.date, _dt.datetime):
+            value = python_type.fromisoformat(value)
+        else:
+            value = python_type(value)
+        return value, int(id)
+    except CursorError:
+        raise
+    except Exception:
+        raise CursorError("invalid cursor")
+
+
+async def paginate(
+        query: _sql.Select,
+        sort: str,
+        sort_column: _sql.Column,
+        id_column: _sql.Column,
+        cursor: _typing.Optional[str],
+        pagesize: int,
+        desc: bool,
+        se: _asyncio.AsyncSession
+):
+
+    """
+    Выполняет query, возвращая одну страницу строк и курсор следующей страницы.
+    Курсор равен None на последней странице
+    """
+
+    # курсор привязан к сортировке вместе с направлением
+    sort = f"-{sort}" if desc else sort
+    if sort_column is id_column:
+        key, columns = id_column, (id_column,)
+    else:
+        key, columns = _sql.tuple_(sort_column, id_column), (sort_column, id_column)
+    if cursor:
+        try:
+            value, last_id = decode_cursor(cursor, sort, sort_column)
+        except CursorError as e:
+            raise _fastapi.HTTPException(400, str(e))
+        last = last_id if sort_column is id_column else _sql.tuple_(value, last_id)
+        query = query.filter(key < last if desc else key > last)
+    query = query.order_by(*(c.desc() if desc else c for c in columns))
+    models = (await se.scalars(query.limit(pagesize + 1))).all()
+    next_cursor = None
+    if len(models) > pagesize:
+        models = models[:pagesize]
+        last = models[-1]
+        next_cursor = encode_cursor(
+            sort,
+            getattr(last, sort_column.key),
+            getattr(last, id_column.key)
+        )
+    return models, next_cursor
@@ -0,0 +1,168 @@
+import os as _os
+import time as _time
+import asyncio as _aio
+import threading as _threading
+import typing as _typing
+from concurrent import futures as _futures
+from concurrent.futures import process as _process
+
+from passlib import hash as _hash
+from loguru import logger as _logger
+
+import schemas as _schemas
+
+
+"""
+Хеширование и проверка паролей bcrypt в пуле процессов.
+Один вызов bcrypt занимает сотни миллисекунд процессорного времени,
+поэтому он выполняется вне цикла событий и вне процесса сервера.
+Очередь ограничена: при переполнении вызов сразу завершается ошибкой HasherBusyError
+
+"""
+
+
+# число процессов пула
+PASSWORD_HASH_WORKERS = int(_os.environ.get("PASSWORD_HASH_WORKERS", _os.cpu_count() or 1))
+
+# стоимость bcrypt (log2 числа раундов) для новых хешей
+PASSWORD_HASH_ROUNDS = int(_os.environ.get("PASSWORD_HASH_ROUNDS", 12))
+
+# сколько вызовов может одновременно ждать и выполняться в пуле
+PASSWORD_HASH_QUEUE = int(_os.environ.get("PASSWORD_HASH_QUEUE", 64))
+
+
+class HasherBusyError(Exception):
+    pass
+
+
+def _hash_password(password: str, rounds: int) -> _typing.Tuple[str, float]:
+    started = _time.perf_counter()
+    return _hash.bcrypt.using(rounds=rounds).hash(password), _time.perf_counter() - started
+
+
+def _hash_passwords(passwords: _typing.List[str], rounds: int) -> _typing.Tuple[_typing.List[str], float]:
+    started = _time.perf_counter()
+    hasher = _hash.bcrypt.using(rounds=rounds)
+    return [hasher.hash(p) for p in passwords], _time.perf_counter() - started
+
+
+def _verify_password(password: str, hashed: str) -> _typing.Tuple[bool, float]:
+    started = _time.perf_counter()
+    try:
+        valid = _hash.bcrypt.verify(password, hashed)
+    except ValueError:
+        # в базе не хеш bcrypt
+        valid = False
+    return valid, _time.perf_counter() - started
+
+
+class PasswordHasher():
+
+    """
+    Пул процессов для bcrypt с ограниченной очередью и счетчиками.
+    Может использоваться из нескольких циклов событий (бот админов работает в своем потоке)
+    """
+
+    workers: int
+    rounds: int
+    maxqueue: int
+    completed: int
+    rejected: int
+    failed: int
+    wait_time: float
+    run_time: float
+    max_latency: float
+
+    def __init__(
+            self,
+            workers: int = PASSWORD_HASH_WORKERS,
+            rounds: int = PASSWORD_HASH_ROUNDS,
+            maxqueue: int = PASSWORD_HASH_QUEUE
+    ):
+        self.workers = workers
+        self.rounds = rounds
+        self.maxqueue = maxqueue
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        self.max_latency = 0.0
+        self._pending = 0
+        self._lock = _threading.Lock()
+        self._pool: _typing.Optional[_futures.ProcessPoolExecutor] = None
+
+    async def hash(self, password: str) -> str:
+        return await self._call(_hash_password, password, self.rounds)
+
+    async def hash_many(self, passwords: _typing.List[str]) -> _typing.List[str]:
+
+        """
+        Хеширует список паролей, разделяя его на части по числу процессов пула.
+        Каждая часть занимает одно место в очереди
+        """
+
+        size = -(-len(passwords) // self.workers) or 1
+        parts = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+        hashed = await _aio.gather(*(self._call(_hash_passwords, part, self.rounds) for part in parts))
+        return [h for part in hashed for h in part]
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._call(_verify_password, password, hashed)
+
+    async def _call(self, function: _typing.Callable, *args):
+        with self._lock:
+            if self._pending >= self.maxqueue:
+                self.rejected += 1
+                raise HasherBusyError(f"{self._pending} password operations are pending")
+            self._pending += 1
+            if self._pool is None:
+                self._pool = _futures.ProcessPoolExecutor(self.workers)
+            pool = self._pool
+        started = _time.perf_counter()
+        try:
+            result, elapsed = await _aio.get_running_loop().run_in_executor(pool, function, *args)
+        except _process.BrokenProcessPool:
+            # упавший процесс ломает весь пул, следующий вызов создаст новый
+            with self._lock:
+                self.failed += 1
+                if self._pool is pool:
+                    self._pool = None
+            pool.shutdown(wait=False)
+            _logger.error("password hashing pool is broken, restarting")
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+        latency = _time.perf_counter() - started
+        with self._lock:
+            self.completed += 1
+            self.run_time += elapsed
+            self.wait_time += latency - elapsed
+            self.max_latency = max(self.max_latency, latency)
+        return result
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> _schemas.PasswordHasherStats:
+        with self._lock:
+            completed = self.completed or 1
+            return _schemas.PasswordHasherStats(
+                workers=self.workers,
+                rounds=self.rounds,
+                maxqueue=self.maxqueue,
+                pending=self._pending,
+                completed=self.completed,
+                rejected=self.rejected,
+                failed=self.failed,
+                avg_wait_ms=self.wait_time * 1000 / completed,
+                avg_run_ms=self.run_time * 1000 / completed,
+                max_latency_ms=self.max_latency * 1000
+            )
+
+
+hasher = PasswordHasher()
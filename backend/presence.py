@@ -0,0 +1,177 @@
+import os as _os
+import asyncio as _aio
+import datetime as _dt
+import typing as _typing
+
+import sqlalchemy as _sql
+from sqlalchemy.ext import asyncio as _asyncio
+from loguru import logger as _logger
+
+import database as _database
+import models as _models
+import cookies as _cookies
+
+
+"""
+Учет присутствия пользователей на сайте.
+Отметки активности копятся в памяти процесса и периодически записываются в базу:
+date_online всех отмеченных пользователей обновляется одним пакетным UPDATE,
+первая за день активность пользователя добавляет строку в user_activities,
+время последней активности и срок действия входов с устройств (auth_session) продлеваются
+
+"""
+
+
+# Период записи накопленных отметок в базу, секунды
+PRESENCE_FLUSH_INTERVAL = float(_os.environ.get("PRESENCE_FLUSH_INTERVAL", 10))
+
+
+# id пользователя -> (первая, последняя) отметка с момента прошлой записи
+_buffer: _typing.Dict[int, _typing.Tuple[_dt.datetime, _dt.datetime]] = {}
+
+# id пользователя -> день, за который активность уже записана
+_recorded: _typing.Dict[int, _dt.date] = {}
+
+# id входа с устройства -> последняя отметка
+_sessions: _typing.Dict[int, _dt.datetime] = {}
+
+_task: _typing.Optional[_aio.Task] = None
+
+
+def touch(user_id: int, moment: _typing.Optional[_dt.datetime] = None) -> _dt.datetime:
+
+    """
+    Отмечает пользователя онлайн. Возвращает время отметки
+    """
+
+    moment = moment or _dt.datetime.utcnow()
+    first, _ = _buffer.get(user_id, (moment, moment))
+    _buffer[user_id] = (min(first, moment), moment)
+    return moment
+
+
+def touch_session(session_id: int, moment: _typing.Optional[_dt.datetime] = None):
+
+    """
+    Отмечает использование входа с устройства
+    """
+
+    _sessions[session_id] = moment or _dt.datetime.utcnow()
+
+
+def pending() -> int:
+    return len(_buffer) + len(_sessions)
+
+
+async def _write(
+        marks: _typing.Dict[int, _typing.Tuple[_dt.datetime, _dt.datetime]],
+        seen: _typing.Dict[int, _dt.datetime],
+        se: _asyncio.AsyncSession
+):
+    user = _models.User.__table__
+    # более ранняя отметка другого процесса не затирает более позднюю
+    if marks:
+        await se.execute(
+            _sql.update(user)
+            .where(user.c.id == _sql.bindparam("uid"))
+            .where(_sql.or_(user.c.date_online.is_(None), user.c.date_online < _sql.bindparam("last")))
+            .values(date_online=_sql.bindparam("last")),
+            [{"uid": uid, "last": last} for uid, (_, last) in marks.items()]
+        )
+    auth = _models.AuthSession.__table__
+    if seen:
+        ttl = _dt.timedelta(seconds=_cookies.AUTH_SESSION_TTL)
+        await se.execute(
+            _sql.update(auth)
+            .where(auth.c.id == _sql.bindparam("sid"))
+            .where(auth.c.date_seen < _sql.bindparam("last"))
+            .values(date_seen=_sql.bindparam("last"), date_expired=_sql.bindparam("expired")),
+            [{"sid": sid, "last": last, "expired": last + ttl} for sid, last in seen.items()]
+        )
+
+    days: _typing.Dict[_dt.date, _typing.Dict[int, _dt.datetime]] = {}
+    for uid, (first, _) in marks.items():
+        if _recorded.get(uid) != first.date():
+            days.setdefault(first.date(), {})[uid] = first
+    activities = []
+    for day, firsts in days.items():
+        start = _dt.datetime.combine(day, _dt.time())
+        # строка за день могла быть записана другим процессом, удаленные пользователи пропускаются
+        new = await se.scalars(
+            _sql.select(_models.User.id)
+            .where(_models.User.id.in_(firsts))
+            .where(~_sql.exists().where(
+                _models.UserActivities.user_id == _models.User.id,
+                _models.UserActivities.date >= start,
+                _models.UserActivities.date < start + _dt.timedelta(days=1)
+            ))
+        )
+        activities += [{"user_id": uid, "date": firsts[uid]} for uid in new]
+    if activities:
+        await se.execute(_sql.insert(_models.UserActivities), activities)
+    return days
+
+
+async def flush() -> int:
+
+    """
+    Записывает накопленные отметки в базу.
+    При ошибке отметки возвращаются в буфер до следующей записи.
+    Возвращает число записанных пользователей
+    """
+
+    global _buffer, _sessions
+    if not _buffer and not _sessions:
+        return 0
+    marks, _buffer = _buffer, {}
+    seen, _sessions = _sessions, {}
+    try:
+        async with _database.AsyncSessionLocal() as se:
+            async with _database.transaction(se):
+                days = await _write(marks, seen, se)
+    except Exception:
+        for uid, (first, last) in marks.items():
+            buffered_first, buffered_last = _buffer.get(uid, (first, last))
+            _buffer[uid] = (min(first, buffered_first), max(last, buffered_last))
+        for sid, last in seen.items():
+            _sessions[sid] = max(last, _sessions.get(sid, last))
+        raise
+    today = _dt.datetime.utcnow().date()
+    for uid, day in ((uid, day) for day, firsts in days.items() for uid in firsts):
+        _recorded[uid] = day
+    for uid in [uid for uid, day in _recorded.items() if day < today]:
+        del _recorded[uid]
+    return len(marks)
+
+
+async def _run():
+    while True:
+        await _aio.sleep(PRESENCE_FLUSH_INTERVAL)
+        try:
+            await flush()
+        except Exception as e:
+            _logger.error(f"presence flush failed: {e=}")
+
+
+def start():
+
+    """
+    Запускает периодическую запись отметок в текущем цикле событий
+    """
+
+    global _task
+    if _task is None or _task.done():
+        _task = _aio.get_running_loop().create_task(_run())
+
+
+async def stop():
+
+    """
+    Останавливает периодическую запись и записывает оставшиеся отметки
+    """
+
+    global _task
+    if _task is not None and _task.get_loop() is _aio.get_running_loop():
+        _task.cancel()
+        _task = None
+    await flush()
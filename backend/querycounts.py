@@ -0,0 +1,141 @@
+import sys as _sys
+import asyncio as _aio
+import tempfile as _tempfile
+import collections as _collections
+import datetime as _dt
+import typing as _typing
+
+import sqlalchemy as _sql
+import sqlalchemy.orm as _orm
+from sqlalchemy.ext import asyncio as _asyncio
+
+import models as _models
+import services as _services
+import migrations as _migrations
+
+
+"""
+Проверка числа запросов, выполняемых сервисами чтения со связанными данными.
+Скрипт заполняет две временные базы SQLite данными разного размера (SIZES связанных строк
+каждого вида), вызывает на каждой функции из LIMITS и считает выполненные запросы.
+Число запросов не должно зависеть от размера данных (иначе связи загружаются по одной - N+1)
+и не должно превышать предел из LIMITS.
+Запуск: python querycounts.py, код возврата 1 при найденных ошибках
+
+"""
+
+
+# наибольшее число запросов на один вызов
+LIMITS = {
+    "get_company": 5,
+    "get_all_companies": 5,
+    "get_teacher_groups": 3,
+    "get_student_groups": 3,
+    "get_course": 4,
+}
+
+SIZES = (5, 50)
+
+
+def _seed(engine: _sql.Engine, size: int):
+    now = _dt.datetime.now()
+    with _orm.Session(engine) as se:
+        tags = [_models.Specialization(name=f"tag{i}") for i in range(size)]
+        companies = [_models.Company(name=f"company{i}") for i in range(size)]
+        teachers = [
+            _models.User(role="teacher", email=f"t{i}@x", password="", fname="T", lname="T",
+                         sign="", confirmed=True, date_created=now, date_online=now)
+            for i in range(size)
+        ]
+        students = [
+            _models.User(role="student", email=f"s{i}@x", password="", fname="S", lname="S",
+                         sign="", confirmed=True, date_created=now, date_online=now)
+            for i in range(size)
+        ]
+        se.add_all(tags + companies + teachers + students)
+        se.flush()
+        company = companies[0]
+        course = _models.Course(name="course", description="d", author_id=teachers[0].id,
+                                date_created=now.date(), date_updated=now.date(), views=0)
+        se.add(course)
+        groups = [_models.Group(name=f"group{i}", teacher_id=teachers[0].id) for i in range(size)]
+        se.add_all([_models.Teacher(user_id=t.id, company_id=company.id) for t in teachers])
+        se.flush()
+        se.add_all(groups)
+        se.flush()
+        for i, tag in enumerate(tags):
+            se.add_all([
+                _models.CompanyContacts(company_id=company.id, kind="phone", value=str(i)),
+                _models.CompanySpecializations(company_id=company.id, specialization_id=tag.id),
+                _models.CourseTags(course_id=course.id, specialization_id=tag.id),
+                _models.Lesson(course_id=course.id, number=i + 1, name=f"lesson{i}",
+                               description="d", duration=_dt.time(1)),
+            ])
+            se.add_all([_models.TeacherSpecializations(user_id=t.id, specialization_id=tag.id) for t in teachers])
+        for group in groups:
+            se.add_all([_models.GroupStudents(group_id=group.id, student_id=s.id) for s in students])
+        se.commit()
+        return course.id, company.id, teachers[0].id, students[0].id
+
+
+async def _count(path: str, size: int, ids: tuple) -> _typing.Dict[str, int]:
+    course_id, company_id, teacher_id, student_id = ids
+    engine = _asyncio.create_async_engine(f"sqlite+aiosqlite:///{path}")
+    counters = _collections.Counter()
+    _sql.event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: counters.update(["queries"]))
+    results = {}
+    async with _asyncio.AsyncSession(engine, expire_on_commit=False) as se:
+        teacher = await se.get(_models.Teacher, teacher_id)
+        student = await se.get(_models.User, student_id)
+        calls = {
+            "get_company": lambda: _services.get_company(company_id, se),
+            "get_all_companies": lambda: _services.get_all_companies(None, size, "id", False, se),
+            "get_teacher_groups": lambda: _services.get_teacher_groups(teacher, se),
+            "get_student_groups": lambda: _services.get_student_groups(student, se),
+            "get_course": lambda: _services.get_course(course_id, se),
+        }
+        for name, call in calls.items():
+            # связанные объекты не должны браться из карты идентичности прошлого вызова
+            se.expunge_all()
+            se.add_all([teacher, student])
+            counters.clear()
+            await call()
+            results[name] = counters["queries"]
+    await engine.dispose()
+    return results
+
+
+def check(directory: str) -> _typing.Tuple[_typing.Dict[int, _typing.Dict[str, int]], _typing.List[str]]:
+
+    """
+    Выполняет замер на базах в папке directory.
+    Возвращает число запросов по размерам данных и функциям и список ошибок
+    """
+
+    counts = {}
+    for size in SIZES:
+        path = f"{directory}/querycounts{size}.db"
+        engine = _sql.create_engine(f"sqlite:///{path}")
+        _migrations.migrate(engine)
+        ids = _seed(engine, size)
+        engine.dispose()
+        counts[size] = _aio.run(_count(path, size, ids))
+    errors = []
+    for name, limit in LIMITS.items():
+        values = [counts[size][name] for size in SIZES]
+        if len(set(values)) > 1:
+            errors.append(f"{name}: query count depends on data size: {values}")
+        if max(values) > limit:
+            errors.append(f"{name}: {max(values)} queries, limit is {limit}")
+    return counts, errors
+
+
+if __name__ == "__main__":
+    with _tempfile.TemporaryDirectory() as directory:
+        counts, errors = check(directory)
+    print(f"{'function':20}" + "".join(f"{f'N={size}':>8}" for size in SIZES) + f"{'limit':>8}")
+    for name, limit in LIMITS.items():
+        print(f"{name:20}" + "".join(f"{counts[size][name]:8}" for size in SIZES) + f"{limit:8}")
+    for error in errors:
+        print(f"FAILED {error}")
+    _sys.exit(1 if errors else 0)
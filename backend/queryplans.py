@@ -0,0 +1,240 @@
+import re as _re
+import sys as _sys
+import asyncio as _aio
+import sqlite3 as _sqlite3
+import tempfile as _tempfile
+import datetime as _dt
+import typing as _typing
+
+import fastapi as _fastapi
+import sqlalchemy as _sql
+from sqlalchemy.ext import asyncio as _asyncio
+
+import database as _database
+import schemas as _schemas
+import services as _services
+import links as _links
+import cookies as _cookies
+import migrations as _migrations
+
+
+"""
+Проверка планов запросов, выполняемых сервисами.
+Скрипт создает временную базу SQLite, приводит ее к последней версии схемы,
+выполняет сценарий с вызовами функций services.py, links.py и cookies.py
+и для каждого выполненного запроса получает план через EXPLAIN QUERY PLAN.
+Полный просмотр большой таблицы (SCAN без индекса) считается ошибкой,
+сортировка во временном B-дереве - предупреждением.
+Запуск: python queryplans.py, код возврата 1 при найденных ошибках
+
+"""
+
+
+# таблицы, размер которых ограничен, полный просмотр для них допустим
+SMALL_TABLES = {
+    "admin",
+    "specialization",
+    "company",
+    "company_contacts",
+    "company_specializations",
+    "schema_version",
+}
+
+# запросы, полный просмотр в которых ожидаем: (функция, таблица) -> причина
+ALLOWED_SCANS = {
+    ("search_courses", "course"): "sort=random пропускает случайное число строк через OFFSET",
+    ("get_all_teachers", "teacher"): "страница по первичному ключу: просмотр в порядке rowid до LIMIT",
+}
+
+_SCAN = _re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+_TEMP_SORT = _re.compile(r"^USE TEMP B-TREE FOR (ORDER BY|GROUP BY|DISTINCT)")
+
+
+class Query():
+
+    function: str
+    statement: str
+    parameters: tuple
+
+    def __init__(self, function: str, statement: str, parameters: tuple):
+        self.function = function
+        self.statement = statement
+        self.parameters = parameters
+
+
+_function: str = ""
+_queries: _typing.Dict[_typing.Tuple[str, str], Query] = {}
+_failures: _typing.List[str] = []
+
+
+def _capture(conn, cursor, statement, parameters, context, executemany):
+    if executemany or not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+        return
+    _queries.setdefault((_function, statement), Query(_function, statement, tuple(parameters)))
+
+
+async def _call(coroutine: _typing.Awaitable, name: str = ""):
+
+    """
+    Выполняет вызов сервиса, запоминая его имя для выполненных им запросов.
+    Ошибки сервисов не прерывают сценарий: запросы, выполненные до ошибки, уже записаны,
+    а неожиданные ошибки попадают в отчет
+    """
+
+    global _function
+    _function = name or coroutine.__qualname__
+    try:
+        return await coroutine
+    except (_fastapi.HTTPException, _links.LinkError, _cookies.CookieError):
+        return None
+    except Exception as e:
+        _failures.append(f"{_function}: {e!r}")
+        return None
+
+
+async def _scenario(se: _asyncio.AsyncSession):
+
+    """
+    Вызывает сервисы так, чтобы выполнить запросы всех основных сценариев приложения
+    """
+
+    await _call(_services.create_specializations(["python", "math", "art"], se))
+    tags = [t.id for t in (await _call(_services.get_all_tags(None, 20, se))).items]
+    await _call(_services.find_specializations("py", se))
+    await _call(_services.create_company(_schemas.CompanyCreate(
+        name="School",
+        tags=["python", "math"],
+        contacts=[_schemas.CompanyContactCreate(kind="phone", value="123")]
+    ), se))
+    await _call(_services.create_company(_schemas.CompanyCreate(name="Other", tags=["art"], contacts=[]), se))
+    company = await _call(_services.get_company_by_name("School", se))
+    await _call(_services.get_company(1, se))
+    await _call(_services.update_company(2, _schemas.CompanyUpdate(name="Other2", tags=["math"]), se))
+    for sort in ("id", "name"):
+        for desc in (False, True):
+            page = await _call(_services.get_all_companies(None, 1, sort, desc, se))
+            await _call(_services.get_all_companies(page.next_cursor, 1, sort, desc, se))
+            page = await _call(_services.get_all_companies_names(None, 1, sort, desc, se))
+            await _call(_services.get_all_companies_names(page.next_cursor, 1, sort, desc, se))
+
+    user, teacher = await _call(_services.create_teacher(_schemas.TeacherCreate(
+        email="t@x", fname="T", lname="L", company=company.id, specializations=["python"], password="p"
+    ), se))
+    student = await _call(_services.create_student(
+        _schemas.StudentCreate(email="s@x", fname="S", lname="L", password="p"), se
+    ))
+    link = await _call(_links.create_verify_email_link(student, se))
+    await _call(_links.verify_email(link.url, se))
+    await _call(_services.auth_student("s@x", "p", se))
+    await _call(_services.auth_teacher("t@x", "p", se))
+    cookie = await _call(_cookies.genetate_cookie(student, se))
+    account = await _call(_services.get_account(cookie, se))
+    await _call(_services.get_principal(cookie, se))
+    _cookies.principals.clear()
+    await _call(_services.get_principal(cookie, se))
+    await _call(_cookies.check_user_cookie(cookie, se))
+    await _call(_services.sign_out(account, se))
+    await _call(_services.get_teacher(user.id, se))
+    await _call(_services.update_student(_schemas.StudentUpdate(
+        confirmation_password="p", confirmation_email="s@x", fname="S2", password="p"
+    ), student, se))
+    await _call(_services.update_teacher(_schemas.TeacherUpdate(
+        confirmation_password="p", confirmation_email="t@x", specializations=["math"]
+    ), user, teacher, se))
+    await _call(_services.get_all_students(None, 20, se))
+    await _call(_services.get_all_teachers(None, 20, se))
+    await _call(_services.get_student_by_id(student.id, se))
+    await _call(_services.get_teacher_by_id(user.id, se))
+    await _call(_services.get_student_model(student.id, se))
+
+    await _call(_services.create_course(_schemas.CourseCreate(
+        name="Py", description="d", author_id=user.id, tags=["python", "math"]
+    ), se))
+    course = await _call(_services.get_course_model(1, se))
+    await _call(_services.create_lesson(course, _schemas.LessonCreate(
+        number=1, name="L", description="d", duration=_dt.time(1)
+    ), se))
+    await _call(_services.get_course(course.id, se))
+    lesson = await _call(_services.get_lesson_model(course, 1))
+    await _call(_services.update_lesson(lesson, _schemas.LessonUpdate(name="L2"), se))
+    await _call(_services.update_course(course, _schemas.CourseUpdate(name="Py2", tags=["art"]), se))
+    for sort in _typing.get_args(_schemas.course_search_sorts):
+        for match in _typing.get_args(_schemas.course_tags_match):
+            for selected in ([], tags[:1], tags[:2]):
+                page = await _call(_services.search_courses(selected, None, 1, False, sort, match, se))
+                if page and page.next_cursor:
+                    await _call(_services.search_courses(selected, page.next_cursor, 1, False, sort, match, se))
+
+    await _call(_services.create_group("G", teacher, se))
+    group = await _call(_services.get_group_model(1, se))
+    url = (await _call(_links.create_join_group_link(group, se))).split("/")[-1]
+    await _call(_links.create_join_group_link(group, se))
+    await _call(_links.join_group(url, student, se))
+    await _call(_services.get_teacher_groups(teacher, se))
+    await _call(_services.get_student_groups(student, se))
+    await _call(_services.start_group_session(group, course, se))
+    await _call(_services.get_group_sessions(group, se))
+    await _call(_services.get_student_sessions(student, se))
+    await _call(_services.ban_from_group(student, group, se))
+
+    await _call(_services.drop_lesson(lesson, se))
+    await _call(_services.drop_course(course, se))
+    await _call(_services.drop_student(student, se))
+    await _call(_services.drop_teacher(teacher, se))
+    await _call(_services.drop_company(2, se))
+
+
+def _explain(db: _sqlite3.Connection, query: Query) -> _typing.List[str]:
+    return [row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {query.statement}", query.parameters)]
+
+
+def check(path: str) -> _typing.Tuple[_typing.List[str], _typing.List[str]]:
+
+    """
+    Выполняет сценарий на базе по пути path и проверяет планы запросов.
+    Возвращает списки ошибок и предупреждений
+    """
+
+    engine = _sql.create_engine(f"sqlite:///{path}")
+    _migrations.migrate(engine)
+    engine.dispose()
+
+    async def run():
+        async_engine = _asyncio.create_async_engine(f"sqlite+aiosqlite:///{path}")
+        _sql.event.listen(async_engine.sync_engine, "before_cursor_execute", _capture)
+        async with _asyncio.AsyncSession(async_engine, expire_on_commit=False) as se:
+            await _scenario(se)
+        await async_engine.dispose()
+
+    _aio.run(run())
+
+    errors = []
+    warnings = []
+    db = _sqlite3.connect(path)
+    for query in _queries.values():
+        for detail in _explain(db, query):
+            scan = _SCAN.match(detail)
+            if (
+                scan
+                and scan[1] in _database.Base.metadata.tables
+                and scan[1] not in SMALL_TABLES
+                and (query.function, scan[1]) not in ALLOWED_SCANS
+            ):
+                errors.append(f"{query.function}: {detail}\n    {query.statement}")
+            elif _TEMP_SORT.match(detail):
+                warnings.append(f"{query.function}: {detail}\n    {query.statement}")
+    db.close()
+    return errors, warnings
+
+
+if __name__ == "__main__":
+    with _tempfile.TemporaryDirectory() as directory:
+        errors, warnings = check(f"{directory}/queryplans.db")
+    for f in _failures:
+        print(f"FAILED {f}")
+    for w in warnings:
+        print(f"WARNING {w}")
+    for e in errors:
+        print(f"FULL SCAN {e}")
+    print(f"{len(_queries)} queries checked, {len(errors)} full scans, {len(warnings)} temp sorts")
+    _sys.exit(1 if errors else 0)
@@ -60,6 +60,12 @@ course_search_sorts = _typing.Literal[
     "date"
 ]
 
+course_tags_match = _typing.Literal["any", "all"]
+
+user_import_formats = _typing.Literal["csv", "ndjson"]
+
+image_sizes = _typing.Literal["thumb", "medium", "full"]
+
 static_logos = _typing.Literal["logo.png", "alter-logo.png"]
 
 static_templates = _typing.Literal[
@@ -309,6 +315,36 @@ class LessonFull(SqlLesson):
     steps: _typing.List[int]
 
 
+class LessonBundleStep(_Base):
+
+    number: int
+    text: str
+    etag: str
+    image: _typing.Optional[str]
+    image_etag: _typing.Optional[str]
+
+
+class LessonBundle(SqlLesson):
+
+    steps: _typing.List[LessonBundleStep]
+
+
+class LessonImportStep(_Base):
+
+    text: str
+    image: _typing.Optional[str] = None
+
+
+class LessonImportManifest(_Base):
+
+    steps: _typing.List[LessonImportStep] = _Field(min_items=1)
+
+
+class LessonImportReport(_Base):
+
+    steps: _typing.List[int]
+
+
 class LessonCreate(_Base):
 
     number: int
@@ -346,8 +382,8 @@ class GroupCreate(_Base):
 class Session(_Base):
 
     course: CourseShort
-    date_started: _dt.datetime
-    date_endend: _typing.Optional[_dt.datetime] = None
+    date_started: _dt.date
+    date_endend: _typing.Optional[_dt.date] = None
     active: bool
 
 
@@ -586,3 +622,149 @@ class FullNews(_Base):
     title: str
     paragraphs: _typing.List[NewsParagraph]
     id: int
+
+
+#
+#
+#
+# Статистика SQL-запросов
+#
+#
+#
+
+
+class SqlRouteStats(_Base):
+
+    route: str
+    requests: int
+    queries: int
+    max_queries: int
+    avg_queries: float
+    time_ms: float
+    avg_time_ms: float
+    n_plus_one: int
+    repeated: _typing.Dict[str, int]
+
+
+#
+#
+#
+# Кэш владельцев cookie
+#
+#
+#
+
+
+class PrincipalCacheStats(_Base):
+
+    size: int
+    maxsize: int
+    ttl: float
+    hits: int
+    misses: int
+    invalidations: int
+
+
+#
+#
+#
+# Пул хеширования паролей
+#
+#
+#
+
+
+class PasswordHasherStats(_Base):
+
+    workers: int
+    rounds: int
+    maxqueue: int
+    pending: int
+    completed: int
+    rejected: int
+    failed: int
+    avg_wait_ms: float
+    avg_run_ms: float
+    max_latency_ms: float
+
+
+#
+#
+#
+# Импорт пользователей
+#
+#
+#
+
+
+class UserImport(_Base):
+
+    role: users_roles = "student"
+    email: str
+    fname: str
+    lname: str
+    sname: _typing.Optional[str] = _Field(default="")
+    password: str
+    company: _typing.Optional[int] = None
+    specializations: _typing.List[str] = _Field(default_factory=list)
+    bio: _typing.Optional[str] = _Field(default="")
+
+
+class UserImportRow(_Base):
+
+    row: int
+    email: _typing.Optional[str]
+    id: _typing.Optional[int]
+    error: _typing.Optional[str]
+
+
+class UserImportReport(_Base):
+
+    created: int
+    failed: int
+    rows: _typing.List[UserImportRow]
+
+
+#
+#
+#
+# Страницы списков
+#
+#
+#
+
+
+class _Page(_Base):
+
+    next_cursor: _typing.Optional[str] = None
+
+
+class StudentsPage(_Page):
+
+    items: _typing.List[StudentShort]
+
+
+class TeachersPage(_Page):
+
+    items: _typing.List[TeacherShort]
+
+
+class SpecializationsPage(_Page):
+
+    items: _typing.List[Specialization]
+
+
+class CompaniesPage(_Page):
+
+    items: _typing.List[Company]
+
+
+class CompaniesNamesPage(_Page):
+
+    items: _typing.List[CompanyShort]
+
+
+class CoursesPage(_Page):
+
+    items: _typing.List[CourseShort]
+    total: int
@@ -1,11 +1,12 @@
 import typing as _typing
+import random as _random
 
 import fastapi as _fastapi
 import datetime as _dt
-import sqlalchemy.orm as _orm
+import sqlalchemy.ext.asyncio as _asyncio
 from sqlalchemy import func as _func
 import sqlalchemy as _sql
-import passlib.hash as _hash
+import sqlalchemy.orm as _orm
 import pydantic as _pydantic
 from loguru import logger as _logger
 
@@ -14,6 +15,13 @@ import models as _models
 import schemas as _schemas
 from config import PASSWORD_SALT
 import cookies as _cookies
+import cascade as _cascade
+import loaders as _loaders
+import blobs as _blobs
+import pagination as _pagination
+import migrations as _migrations
+import presence as _presence
+import passwords as _passwords
 from courses import courses as _courses
 import tg as _tg
 
@@ -25,28 +33,36 @@ import tg as _tg
 
 
 def use_definition():
-    return _database.Base.metadata.create_all(bind=_database.engine)
+    return _migrations.migrate()
 
 
 async def check_password(password: str, model: _models.signable,) -> bool:
-    return hash.bcrypt.verify(password, model.password)
+    return await _passwords.hasher.verify(password + PASSWORD_SALT, model.password)
+
+
+async def get_db_session():
+    se = _database.AsyncSessionLocal()
+    try:
+        yield se
+    finally:
+        await se.close()
 
 
-def get_db_session():
-    se = _database.SessionLocal()
+async def get_db_read_session():
+    se = _database.ReadOnlySessionLocal()
     try:
         yield se
     finally:
-        se.close()
+        await se.close()
 
 
 async def create_student(
         data: _schemas.StudentCreate,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    if se.query(_models.User).filter_by(email=data.email).all():
+    if await se.scalar(_sql.select(_models.User).filter_by(email=data.email)):
         raise _fastapi.HTTPException(400, "Почта занята")
-    password = _hash.bcrypt.hash(data.password + PASSWORD_SALT)
+    password = await _passwords.hasher.hash(data.password + PASSWORD_SALT)
     user = _models.User(
         fname=data.fname,
         lname=data.lname,
@@ -58,31 +74,29 @@ async def create_student(
         date_online=_dt.datetime.utcnow(),
         sign=""
     )
-    se.add(user)
-    se.commit()
-    se.refresh(user)
+    async with _database.transaction(se):
+        se.add(user)
     return user
 
 
-def update_user_online(
+async def update_user_online(
         user: _models.User,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    user.date_online = _dt.datetime.now()
-    se.commit()
-    se.refresh(user)
+    # отметка записывается в базу пакетно модулем presence, модель не помечается измененной
+    _orm.attributes.set_committed_value(user, "date_online", _presence.touch(user.id))
     return user
 
 
 async def auth_student(
         login: str,
         password: str,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    user = se.query(_models.User).filter_by(email=login).first()
+    user = await se.scalar(_sql.select(_models.User).filter_by(email=login))
     if not user:
         raise _fastapi.HTTPException(404, "No such user")
-    if not _hash.bcrypt.hash(password + PASSWORD_SALT):
+    if not await check_password(password, user):
         raise _fastapi.HTTPException(401, "invalid password")
     if not user.confirmed:
         raise _fastapi.HTTPException(409, "email not verified")
@@ -91,121 +105,135 @@ async def auth_student(
 
 async def get_student_account(
         cookie: str,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
     stud = await _cookies.check_user_cookie(cookie, se)
-    update_user_online(stud, se)
+    await update_user_online(stud, se)
     return stud
 
 
-async def get_account_by_cookie(
+async def get_account(
         cookie: str,
-        se: _orm.Session
-):
+        se: _asyncio.AsyncSession
+) -> _typing.Optional[_cookies.Account]:
+
+    """
+    Определяет владельца cookie одним запросом.
+    Возвращает None для отсутствующей или недействительной cookie.
+    Отметку присутствия ставит вызывающий (mark_online)
+    """
+
     if not cookie:
-        return (None, None)
+        return None
     try:
-        admin = await _cookies.check_admin_cookie(cookie, se)
-        return (admin, "admin")
-    except (_cookies.CookieError, AttributeError):
-        try:
-            user, teacher = await get_teacher_account(cookie, se)
-            print(user, teacher)
-            update_user_online(user, se)
-            return (teacher, "teacher")
-        except (_cookies.CookieError, _fastapi.HTTPException):
-            try:
-                student = await get_student_account(cookie, se)
-                update_user_online(student, se)
-                return (student, "student")
-            except _cookies.CookieError:
-                return (None, None)
-
-
-def can_delete_student(user: _models.User):
-    return len(filter((lambda s: s.session.active),  user.sessions)) == 0
+        account = await _cookies.resolve(cookie, se)
+    except _cookies.CookieError:
+        _cookies.principals.invalidate(cookie)
+        return None
+    if not _cookies.is_token(cookie):
+        _cookies.principals.put(cookie, account.principal)
+    return account
+
+
+async def get_principal(
+        cookie: str,
+        se: _asyncio.AsyncSession
+) -> _typing.Optional[_cookies.Principal]:
+
+    """
+    Определяет владельца cookie без загрузки его моделей:
+    cookie-токен проверяется без базы, остальные cookie ищутся сначала в кэше.
+    Возвращает None для отсутствующей или недействительной cookie
+    """
+
+    if not cookie:
+        return None
+    try:
+        if _cookies.is_token(cookie):
+            return _cookies.decode_token(cookie)
+        principal = _cookies.principals.get(cookie)
+        if principal is None:
+            principal = (await _cookies.resolve(cookie, se)).principal
+            _cookies.principals.put(cookie, principal)
+        return principal
+    except _cookies.CookieError:
+        _cookies.principals.invalidate(cookie)
+        return None
+
+
+def mark_online(principal: _cookies.Principal):
+
+    """
+    Отмечает присутствие владельца cookie и использование его входа с устройства
+    """
+
+    if principal.session is not None:
+        _presence.touch_session(principal.session)
+    if principal.role != "admin":
+        _presence.touch(principal.id)
+
+
+async def can_delete_student(user: _models.User):
+    sessions = [await s.awaitable_attrs.session for s in await user.awaitable_attrs.sessions]
+    return len(list(filter((lambda s: s.active), sessions))) == 0
 
 
 async def drop_student(
         user: _models.User,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    if not can_delete_student(user):
+    if not await can_delete_student(user):
         raise _fastapi.HTTPException(423, "Cannot to delete user having active sessions")
-    for activity in user.activities:
-        se.delete(activity)
-        se.commit()
-    for hometask in user.hometasks:
-        se.delete(hometask)
-        se.commit()
-    for notification in user.notifications:
-        se.delete(notification)
-        se.commit()
-    for progress in user.progresses:
-        se.delete(progress)
-        se.commit()
-    for session in user.sessions:
-        se.delete(session)
-        se.commit()
-    for chat_membership in user.chats:
-        se.delete(chat_membership)
-        se.commit()
-    for group_membership in user.groups:
-        se.delete(group_membership)
-        se.commit()
-    se.delete(user)
-    se.commit()
+    try:
+        removed = await _cascade.delete(_models.User, [user.id], se)
+    except _cascade.CascadeRestrictedError as e:
+        raise _fastapi.HTTPException(423, f"Cannot delete user referenced by {e.table}")
+    _cookies.principals.invalidate_owner("user", user.id)
+    _logger.debug(f"user {user.id} deleted: {removed}")
+    return removed
 
 
 async def update_student(
     data: _schemas.StudentUpdate,
     model: _models.User,
-    se: _orm.Session
+    se: _asyncio.AsyncSession
 ):
-    if data.email:
-        model.email = data.email
-        se.commit()
-        se.refresh(model)
-    if data.fname:
-        model.fname = data.fname
-        se.commit()
-        se.refresh(model)
-    if data.sname:
-        model.sname = data.sname
-        se.commit()
-        se.refresh(model)
-    if data.lname:
-        model.lname = data.lname
-        se.commit()
-        se.refresh(model)
-    if data.password:
-        model.password = _hash.bcrypt.hash(data.password + PASSWORD_SALT)
-        se.commit()
-        se.refresh(model)
+    # хеш считается до начала транзакции, чтобы не держать ее открытой
+    password = await _passwords.hasher.hash(data.password + PASSWORD_SALT) if data.password else None
+    async with _database.transaction(se):
+        if data.fname:
+            model.fname = data.fname
+        if data.sname:
+            model.sname = data.sname
+        if data.lname:
+            model.lname = data.lname
+        if data.password:
+            model.password = password
+            await _cookies.revoke_sessions(model, se)
 
 
 async def create_teacher(
         data: _schemas.TeacherCreate,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    if se.query(_models.User).filter_by(email=data.email).all():
+    if await se.scalar(_sql.select(_models.User).filter_by(email=data.email)):
         raise _fastapi.HTTPException(400, "Почта занята")
 
-    company = se.get(_models.Company, data.company)
+    company = await se.get(_models.Company, data.company)
     if not company:
         raise _fastapi.HTTPException(404, "Компания не найдена")
 
-    specializations = list(
-        se
-        .query(_models.Specialization)
-        .filter_by(name=sp)
-        .first()
+    specializations = [
+        await se.scalar(
+            _sql.select(_models.Specialization)
+            .filter_by(name=sp)
+        )
         for sp in data.specializations
-    )
+    ]
     if None in specializations:
         raise _fastapi.HTTPException(404, "Не найдена специализация")
 
-    password = _hash.bcrypt.hash(data.password + PASSWORD_SALT)
+    password = await _passwords.hasher.hash(data.password + PASSWORD_SALT)
     user = _models.User(
         fname=data.fname,
         lname=data.lname,
@@ -217,39 +245,36 @@ async def create_teacher(
         date_online=_dt.datetime.utcnow(),
         sign=""
     )
-    se.add(user)
-    se.commit()
-    se.refresh(user)
-
-    teacher = _models.Teacher(
-        user_id=user.id,
-        company_id=company.id,
-        bio=data.bio
-    )
-    se.add(teacher)
-    se.commit()
-    se.refresh(teacher)
+    async with _database.transaction(se):
+        se.add(user)
+        await se.flush()
+
+        teacher = _models.Teacher(
+            user_id=user.id,
+            company_id=company.id,
+            bio=data.bio
+        )
+        se.add(teacher)
 
-    for s in specializations:
-        se.add(
+        se.add_all([
             _models.TeacherSpecializations(
-                user_id=teacher.user_id,
+                user_id=user.id,
                 specialization_id=s.id
             )
-        )
-        se.commit()
+            for s in specializations
+        ])
 
     return (user, teacher)
 
 
-def get_teacher(
+async def get_teacher(
         user_id: int,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    teacher = se.get(_models.Teacher, user_id)
+    teacher = await se.get(_models.Teacher, user_id)
     if not teacher:
         raise _fastapi.HTTPException(400, "User is not a teacher")
-    if not teacher.user.confirmed:
+    if not (await teacher.awaitable_attrs.user).confirmed:
         raise _fastapi.HTTPException(409, "email is not verified")
     else:
         return teacher
@@ -258,24 +283,24 @@ def get_teacher(
 async def auth_teacher(
         login: str,
         password: str,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    user = se.query(_models.User).filter_by(email=login).first()
+    user = await se.scalar(_sql.select(_models.User).filter_by(email=login))
     if not user:
         raise _fastapi.HTTPException(404, "No such user")
-    if not _hash.bcrypt.hash(password + PASSWORD_SALT):
+    if not await check_password(password, user):
         raise _fastapi.HTTPException(401, "invalid password")
-    teacher = get_teacher(user.id, se)
+    teacher = await get_teacher(user.id, se)
     return (user, teacher)
 
 
 async def get_teacher_account(
         cookie: str,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
     user = await _cookies.check_user_cookie(cookie, se)
-    update_user_online(user, se)
-    teacher = get_teacher(user.id, se)
+    await update_user_online(user, se)
+    teacher = await get_teacher(user.id, se)
     return (user, teacher)
 
 
@@ -283,134 +308,160 @@ async def update_teacher(
     data: _schemas.TeacherUpdate,
     user: _models.User,
     teacher: _models.Teacher,
-    se: _orm.Session
+    se: _asyncio.AsyncSession
 ):
-    if data.email:
-        user.email = data.email
-        se.commit()
-        se.refresh(user)
-    if data.fname:
-        user.fname = data.fname
-        se.commit()
-        se.refresh(user)
-    if data.sname:
-        user.sname = data.sname
-        se.commit()
-        se.refresh(user)
-    if data.lname:
-        user.lname = data.lname
-        se.commit()
-        se.refresh(user)
-    if data.password:
-        user.password = _hash.bcrypt.hash(data.password + PASSWORD_SALT)
-        se.commit()
-        se.refresh(user)
-    if data.company:
-        company = se.get(_models.Company, data.company)
-        if company:
-            teacher.company = company
-        se.commit()
-        se.refresh(teacher)
-    if data.specializations:
-        specializations = list(
-            filter(
-                se
-                .query(_models.Specialization)
-                .filter_by(name=sp)
-                .first()
-                for sp in data.specializations
+    password = await _passwords.hasher.hash(data.password + PASSWORD_SALT) if data.password else None
+    async with _database.transaction(se):
+        if data.email:
+            user.email = data.email
+        if data.fname:
+            user.fname = data.fname
+        if data.sname:
+            user.sname = data.sname
+        if data.lname:
+            user.lname = data.lname
+        if data.password:
+            user.password = password
+            await _cookies.revoke_sessions(user, se)
+        if data.bio:
+            teacher.bio = data.bio
+        if data.company:
+            company = await se.get(_models.Company, data.company)
+            if company:
+                teacher.company = company
+        if data.specializations:
+            specializations = list(
+                filter(None, [
+                    await se.scalar(
+                        _sql.select(_models.Specialization)
+                        .filter_by(name=sp)
+                    )
+                    for sp in data.specializations
+                ])
             )
-        )
-        teacher.specializations = specializations
-        se.commit()
-        se.refresh(teacher)
+            for old in await teacher.awaitable_attrs.specializations:
+                await se.delete(old)
+            # старые связи удаляются до вставки новых с тем же первичным ключом
+            await se.flush()
+            se.add_all([
+                _models.TeacherSpecializations(user_id=teacher.user_id, specialization_id=s.id)
+                for s in specializations
+            ])
 
 
 async def auth_admin(
         login: str,
         password: str,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    admin = (
-        se
-        .query(_models.Admin)
+    admin = await se.scalar(
+        _sql.select(_models.Admin)
         .filter_by(login=login)
-        .first()
     )
     if not admin:
         raise _fastapi.HTTPException(404, "No such admin")
-    if not _hash.bcrypt.verify(password+PASSWORD_SALT, admin.password):
+    if not await check_password(password, admin):
         raise _cookies.CookieError
     return admin
 
 
+async def sign_out(
+        account: _cookies.Account,
+        se: _asyncio.AsyncSession
+):
+
+    """
+    Выход из аккаунта: завершает вход с устройства, выдавшего cookie.
+    Cookie-токен нельзя отозвать отдельно, поэтому отзываются все токены владельца,
+    подпись прежнего вида сбрасывается
+    """
+
+    cookie = account.cookie
+    model = account.admin or account.user
+    async with _database.transaction(se):
+        await _cookies.revoke_session(cookie, se)
+        if _cookies.is_token(cookie):
+            _cookies.revoke_tokens(model)
+        elif model.sign and cookie.endswith(f".{model.sign}"):
+            model.sign = None
+
+
 async def drop_admin(
         cookie: str,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
     admin = await _cookies.check_admin_cookie(cookie, se)
-    se.delete(admin)
-    se.commit()
+    async with _database.transaction(se):
+        await _cookies.revoke_sessions(admin, se)
+        await se.delete(admin)
+    _cookies.principals.invalidate_owner("admin", admin.id)
 
 
 async def create_specializations(
         names: _typing.List[str],
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
     for name in names:
-        if se.query(_models.Specialization).filter_by(name=name).first():
+        if await se.scalar(_sql.select(_models.Specialization).filter_by(name=name)):
             continue
         spec = _models.Specialization(name=name)
         se.add(spec)
-        se.commit()
+        await se.commit()
 
 
 async def find_specializations(
         pattern: str,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
 
     return (
-        se
-        .query(_models.Specialization)
-        .filter(_func.lower(_models.Specialization.name).like(f"%{pattern}%"))
-        .all()
+        await se.scalars(
+            _sql.select(_models.Specialization)
+            .filter(_func.lower(_models.Specialization.name).like(f"%{pattern}%"))
+        )
+    ).all()
+
+
+async def company_model_to_schema(
+        model: _models.Company
+):
+    return _schemas.Company(
+        id=model.id,
+        name=model.name,
+        teachers=[
+            await teacher_model_to_schema(await teacher.awaitable_attrs.user, teacher)
+            for teacher in await model.awaitable_attrs.teachers
+        ],
+        tags=[(await s.awaitable_attrs.specialization).name for s in await model.awaitable_attrs.specializations],
+        contacts=list(_schemas.CompanyContact.from_orm(c) for c in await model.awaitable_attrs.contacts)
     )
 
 
-def get_company(
+async def get_company(
         id: int,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    model = se.get(_models.Company, id)
+    model = await se.get(_models.Company, id, options=_loaders.COMPANY)
     if not model:
         raise _fastapi.HTTPException(404, "no such company")
-    return _schemas.Company(
-        id=id,
-        name=model.name,
-        teachers=list(teacher_model_to_schema(teacher.user, teacher) for teacher in model.teachers),
-        tags=list(s.specialization.name for s in model.specializations),
-        contacts=list(_schemas.CompanyContact.from_orm(c) for c in model.contacts)
-    )
+    return await company_model_to_schema(model)
 
 
 async def get_company_by_name(
        name: str,
-       se: _orm.Session 
+       se: _asyncio.AsyncSession
 ):
-    model = se.query(_models.Company).filter_by(name=name).first()
+    model = await se.scalar(
+        _sql.select(_models.Company)
+        .filter_by(name=name)
+        .options(*_loaders.COMPANY)
+    )
     if not model:
         raise _fastapi.HTTPException(404, "no such company")
-    return _schemas.Company(
-        id=model.id,
-        name=model.name,
-        teachers=model.teachers,
-        tags=list(s.specialization.name for s in model.specializations),
-        contacts=list(_schemas.CompanyContact.from_orm(c) for c in model.contacts)
-    )
+    return await company_model_to_schema(model)
 
 
-def teacher_model_to_schema(
+async def teacher_model_to_schema(
         user: _models.User,
         teacher: _models.Teacher
 ):
@@ -421,41 +472,60 @@ def teacher_model_to_schema(
         lname=user.lname,
         sname=user.sname,
         date_online=user.date_online,
-        company=teacher.company.name,
-        specializations=list(
-            s.specialization.name for s in teacher.specializations
-        ),
+        company=(await teacher.awaitable_attrs.company).name,
+        specializations=[
+            (await s.awaitable_attrs.specialization).name for s in await teacher.awaitable_attrs.specializations
+        ],
         role="teacher"
     )
 
 
-async def get_all_students(se: _orm.Session):
-    return list(
-        _schemas.StudentShort.from_orm(s)
-        for s in
-        se.query(_models.User).filter_by(role="student")
+async def get_all_students(
+        cursor: _typing.Optional[str],
+        pagesize: int,
+        se: _asyncio.AsyncSession
+):
+    models, next_cursor = await _pagination.paginate(
+        _sql.select(_models.User).filter_by(role="student"),
+        "id", _models.User.id, _models.User.id,
+        cursor, pagesize, False, se
+    )
+    return _schemas.StudentsPage(
+        items=[_schemas.StudentShort.from_orm(s) for s in models],
+        next_cursor=next_cursor
     )
 
 
-async def get_all_teachers(se: _orm.Session):
-    return list(
-        _schemas.TeacherShort(
-            id=teacher.user_id,
-            fname=teacher.user.fname,
-            lname=teacher.user.lname,
-            sname=teacher.user.sname,
-            company=teacher.company_name,
-        )
-        for teacher in
-        se.query(_models.Teacher)
+async def get_all_teachers(
+        cursor: _typing.Optional[str],
+        pagesize: int,
+        se: _asyncio.AsyncSession
+):
+    models, next_cursor = await _pagination.paginate(
+        _sql.select(_models.Teacher).options(*_loaders.TEACHER),
+        "id", _models.Teacher.user_id, _models.Teacher.user_id,
+        cursor, pagesize, False, se
+    )
+    return _schemas.TeachersPage(
+        items=[
+            _schemas.TeacherShort(
+                id=teacher.user_id,
+                fname=(await teacher.awaitable_attrs.user).fname,
+                lname=teacher.user.lname,
+                sname=teacher.user.sname,
+                company=(await teacher.awaitable_attrs.company).name,
+            )
+            for teacher in models
+        ],
+        next_cursor=next_cursor
     )
 
 
 async def get_student_by_id(
         id: int,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    model = se.query(_models.User).filter_by(id=id).filter_by(role="student").first()
+    model = await se.scalar(_sql.select(_models.User).filter_by(id=id).filter_by(role="student"))
     if not model:
         raise _fastapi.HTTPException(404, "No such user")
     return _schemas.StudentFull(
@@ -465,7 +535,7 @@ async def get_student_by_id(
         lname=model.lname,
         sname=model.sname,
         date_online=model.date_online,
-        activities=list(a.date for a in model.activities),
+        activities=list(a.date for a in await model.awaitable_attrs.activities),
         telegram=model.telegram,
         role="student"
     )
@@ -473,11 +543,12 @@ async def get_student_by_id(
 
 async def get_teacher_by_id(
         id: int,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    teacher = se.get(_models.Teacher, id)
+    teacher = await se.get(_models.Teacher, id)
     if not teacher:
         raise _fastapi.HTTPException(404, "No such teacher")
+    await teacher.awaitable_attrs.user
     return _schemas.TeacherFull(
         id=teacher.user.id,
         email=teacher.user.email,
@@ -485,195 +556,197 @@ async def get_teacher_by_id(
         lname=teacher.user.lname,
         sname=teacher.user.sname,
         date_online=teacher.user.date_online,
-        company=teacher.company.name,
-        specializations=list(s.specialization.name for s in teacher.specializations),
-        activities=list(a.date for a in teacher.user.activities),
+        company=(await teacher.awaitable_attrs.company).name,
+        specializations=[
+            (await s.awaitable_attrs.specialization).name for s in await teacher.awaitable_attrs.specializations
+        ],
+        activities=list(a.date for a in await teacher.user.awaitable_attrs.activities),
         telegram=teacher.user.telegram,
         role="teacher"
     )
 
 
-def can_delete_teacher(teacher: _models.Teacher):
+async def can_delete_teacher(teacher: _models.Teacher):
+    groups = await teacher.awaitable_attrs.groups
     return (
-        len(teacher.groups) == 0
+        len(groups) == 0
         and
-        len(filter((lambda s: s.session.active),  teacher.user.sessions)) == 0
+        await can_delete_student(await teacher.awaitable_attrs.user)
         and
-        all((not session.session.active for session in group.sessions) for group in teacher.groups)
+        all([
+            all([not (await s.awaitable_attrs.session).active for s in await group.awaitable_attrs.sessions])
+            for group in groups
+        ])
     )
 
 
 async def drop_teacher(
         teacher: _models.Teacher,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    if not can_delete_teacher(teacher):
+    if not await can_delete_teacher(teacher):
         raise _fastapi.HTTPException(423, "Cannot delete teacher with active sessions")
-    for group in teacher.groups:
-        for group_student in group.students:
-            se.delete(group_student)
-            se.commit()
-        for session in group.sessions:
-            se.delete(session)
-            se.commit()
-    for tag in teacher.specializations:
-        se.delete(tag)
-        se.commit()
-    await drop_student(teacher.user, se)
-    se.delete(teacher)
-    se.commit()
+    try:
+        removed = await _cascade.delete(_models.User, [teacher.user_id], se)
+    except _cascade.CascadeRestrictedError as e:
+        raise _fastapi.HTTPException(423, f"Cannot delete teacher referenced by {e.table}")
+    _cookies.principals.invalidate_owner("user", teacher.user_id)
+    _logger.debug(f"teacher {teacher.user_id} deleted: {removed}")
+    return removed
 
 
 async def create_company(
         data: _schemas.CompanyCreate,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    if se.query(_models.Company).filter_by(name=data.name).first():
+    if await se.scalar(_sql.select(_models.Company).filter_by(name=data.name)):
         raise _fastapi.HTTPException(400, "Company already exists")
 
+    tags = []
     for tag in data.tags:
-        if not se.query(_models.Specialization).filter_by(name=tag).first():
+        tag_model = await se.scalar(_sql.select(_models.Specialization).filter_by(name=tag))
+        if not tag_model:
             raise _fastapi.HTTPException(404, f"no such tag: {tag}")
+        tags.append(tag_model)
 
-    company = _models.Company(name=data.name)
-    se.add(company)
-    se.commit()
-    se.refresh(company)
-    if not company:
-        raise _fastapi.HTTPException(409, "Unable to save company")
-
-    for tag in data.tags:
-        tag_model = se.query(_models.Specialization).filter_by(name=tag).first()
-        cp = _models.CompanySpecializations(
-            company_id=company.id,
-            specialization_id=tag_model.id
-        )
-        se.add(cp)
-        se.commit()
+    async with _database.transaction(se):
+        company = _models.Company(name=data.name)
+        se.add(company)
+        await se.flush()
 
-    for contact in data.contacts:
-        model = _models.CompanyContacts(
-            company_id=company.id,
-            kind=contact.kind,
-            value=contact.value
-        )
-        se.add(model)
-        se.commit()
+        se.add_all([
+            _models.CompanySpecializations(
+                company_id=company.id,
+                specialization_id=tag_model.id
+            )
+            for tag_model in tags
+        ])
+
+        se.add_all([
+            _models.CompanyContacts(
+                company_id=company.id,
+                kind=contact.kind,
+                value=contact.value
+            )
+            for contact in data.contacts
+        ])
 
 
-async def get_all_tags(se: _orm.Session):
-    return _pydantic.parse_obj_as(
-        _typing.List[_schemas.Specialization],
-        se.query(_models.Specialization).all()
+async def get_all_tags(
+        cursor: _typing.Optional[str],
+        pagesize: int,
+        se: _asyncio.AsyncSession
+):
+    models, next_cursor = await _pagination.paginate(
+        _sql.select(_models.Specialization),
+        "id", _models.Specialization.id, _models.Specialization.id,
+        cursor, pagesize, False, se
+    )
+    return _schemas.SpecializationsPage(
+        items=_pydantic.parse_obj_as(_typing.List[_schemas.Specialization], models),
+        next_cursor=next_cursor
     )
 
 
 async def update_company(
         id: int,
         update: _schemas.CompanyUpdate,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    company = se.get(_models.Company, id)
+    company = await se.get(_models.Company, id)
     if not company:
         raise _fastapi.HTTPException(404, "No such company")
-    if update.name:
-        company.name = update.name
-        se.commit()
-        se.refresh(company)
-    if update.contacts:
-        for oldc in company.contacts:
-            se.delete(oldc)
-            se.commit()
-        for new in update.contacts:
-            se.add(_models.CompanyContacts(kind=new.kind, value=new.value, company_id=company.id))
-            se.commit()
-    if update.tags:
-        new = list(se.query(_models.Specialization).filter_by(name=tag).first() for tag in update.tags)
-        if None in new:
-            raise _fastapi.HTTPException(404, "No such tag")
-        for olds in company.specializations:
-            se.delete(olds)
-            se.commit()
-        for n in new:
-            se.add(_models.CompanySpecializations(company_id=company.id, specialization_id=n.id))
-            se.commit()
+    async with _database.transaction(se):
+        if update.name:
+            company.name = update.name
+        if update.contacts:
+            for oldc in await company.awaitable_attrs.contacts:
+                await se.delete(oldc)
+            # значения контактов уникальны, поэтому старые удаляются до вставки новых
+            await se.flush()
+            se.add_all([
+                _models.CompanyContacts(kind=new.kind, value=new.value, company_id=company.id)
+                for new in update.contacts
+            ])
+        if update.tags:
+            new = [await se.scalar(_sql.select(_models.Specialization).filter_by(name=tag)) for tag in update.tags]
+            if None in new:
+                raise _fastapi.HTTPException(404, "No such tag")
+            for olds in await company.awaitable_attrs.specializations:
+                await se.delete(olds)
+            await se.flush()
+            se.add_all([
+                _models.CompanySpecializations(company_id=company.id, specialization_id=n.id)
+                for n in new
+            ])
 
 
 async def drop_company(
         id: int,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    company = se.get(_models.Company, id)
+    company = await se.get(_models.Company, id)
     if not company:
         raise _fastapi.HTTPException(404, "No such company")
-    if len(company.teachers) > 0:
+    if len(await company.awaitable_attrs.teachers) > 0:
         raise _fastapi.HTTPException(423, "Unable delete an organization that has registered teachers")
-    for tag in company.specializations:
-        se.delete(tag)
-        se.commit()
-    for contact in company.contacts:
-        se.delete(contact)
-        se.commit()
-    se.delete(company)
-    se.commit()
+    removed = await _cascade.delete(_models.Company, [company.id], se)
+    _logger.debug(f"company {company.id} deleted: {removed}")
+    return removed
 
 
 async def get_all_companies(
-        page: int,
+        cursor: _typing.Optional[str],
         pagesize: int,
         sort: _schemas.companies_sort_types,
         desc: bool,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    sort_column = _models.Company.id if sort == "id" else _models.Company.name
-    sort_column = sort_column.desc() if desc else sort_column
-    return list(
-        get_company(company.id, se)
-        for company in
-        (
-            se
-            .query(_models.Company)
-            .order_by(sort_column)
-            .offset(page*pagesize)
-            .limit(pagesize)
-        )
+    models, next_cursor = await _pagination.paginate(
+        _sql.select(_models.Company).options(*_loaders.COMPANY),
+        sort, _models.Company.id if sort == "id" else _models.Company.name, _models.Company.id,
+        cursor, pagesize, desc, se
+    )
+    return _schemas.CompaniesPage(
+        items=[await company_model_to_schema(company) for company in models],
+        next_cursor=next_cursor
     )
 
 
 async def create_course(
         data: _schemas.CourseCreate,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    if se.query(_models.Course).filter_by(name=data.name).first():
+    if await se.scalar(_sql.select(_models.Course).filter_by(name=data.name)):
         raise _fastapi.HTTPException(409, "Course name already in use")
-    tags = list(se.query(_models.Specialization).filter_by(name=tname).first() for tname in data.tags)
+    tags = [await se.scalar(_sql.select(_models.Specialization).filter_by(name=tname)) for tname in data.tags]
     if None in tags:
         raise _fastapi.HTTPException(404, "No such tag")
     course = _models.Course(
         author_id=data.author_id,
         name=data.name,
         description=data.description,
-        date_created=_dt.datetime.utcnow(),
-        date_updated=_dt.datetime.utcnow(),
+        date_created=_dt.datetime.utcnow().date(),
+        date_updated=_dt.datetime.utcnow().date(),
         views=0
     )
-    se.add(course)
-    se.commit()
-    se.refresh(course)
-    for tag in tags:
-        se.add(_models.CourseTags(
-            specialization_id=tag.id,
-            course_id=course.id
-        ))
-        se.commit()
-    se.refresh(course)
+    async with _database.transaction(se):
+        se.add(course)
+        await se.flush()
+        se.add_all([
+            _models.CourseTags(
+                specialization_id=tag.id,
+                course_id=course.id
+            )
+            for tag in tags
+        ])
     return course
 
 
 async def create_lesson(
         course: _models.Course,
         data: _schemas.LessonCreate,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
     lesson = _models.Lesson(
         name=data.name,
@@ -682,37 +755,41 @@ async def create_lesson(
         course_id=course.id,
         number=data.number
     )
-    se.add(lesson)
-    se.commit()
-    se.refresh(lesson)
+    if await se.scalar(_sql.select(_models.Lesson.id).filter_by(course_id=course.id, number=data.number)):
+        raise _fastapi.HTTPException(409, "Lesson number already in use")
+    async with _database.transaction(se):
+        se.add(lesson)
     return lesson
 
 
-def get_course_model(
+async def get_course_model(
         id: int,
-        se: _orm.Session
+        se: _asyncio.AsyncSession,
+        options: _typing.Sequence = (),
+        count_view: bool = True
 ):
-    course = se.get(_models.Course, id)
+    course = await se.get(_models.Course, id, options=options)
     if not course:
         raise _fastapi.HTTPException(404, "No such course")
-    course.views += 1
-    se.commit()
-    se.refresh(course)
+    if count_view:
+        course.views += 1
+        await se.commit()
     return course
 
 
 async def get_course(
         id: int,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    course = get_course_model(id, se)
-    if course.author.role == "teacher":
+    course = await get_course_model(id, se, _loaders.COURSE)
+    if (await course.awaitable_attrs.author).role == "teacher":
+        teacher = await course.author.awaitable_attrs.teacher
         author = _schemas.TeacherShort(
             id=course.author.id,
             fname=course.author.fname,
             lname=course.author.lname,
             sname=course.author.sname,
-            company=course.author.teacher.company.name
+            company=(await teacher.awaitable_attrs.company).name
         )
     else:
         author = _schemas.StudentShort.from_orm(course.author)
@@ -724,44 +801,42 @@ async def get_course(
         date_created=course.date_created,
         date_updated=course.date_updated,
         views=course.views,
-        tags=list(_schemas.Specialization.from_orm(t.specialization) for t in course.tags),
-        lessons=_pydantic.parse_obj_as(_typing.List[_schemas.LessonShort], course.lessons),
+        tags=[
+            _schemas.Specialization.from_orm(await t.awaitable_attrs.specialization)
+            for t in await course.awaitable_attrs.tags
+        ],
+        lessons=_pydantic.parse_obj_as(_typing.List[_schemas.LessonShort], await course.awaitable_attrs.lessons),
     )
 
 
-async def check_cookie_and_update_user_online(
-        cookie: str,
-        se: _orm.Session
-):
-    if not cookie:
-        return
-    try:
-        user = await get_student_account(cookie, se)
-        user.date_online = _dt.datetime.utcnow()
-        se.commit()
-        se.refresh(user)
-    except _cookies.CookieError:
-        return
-    except Exception as e:
-        _logger.warning(f"cannot update user date online {e=}")
-
-
 async def get_lesson_model(
         course: _models.Course,
         number: int
 ):
-    for lesson in course.lessons:
+    for lesson in await course.awaitable_attrs.lessons:
         if number == lesson.number:
             return lesson
     else:
         raise _fastapi.HTTPException(404, "No such lesson")
 
 
+async def get_lesson_by_number(
+        course_id: int,
+        number: int,
+        se: _asyncio.AsyncSession
+):
+    # один запрос без загрузки курса и без счетчика просмотров
+    lesson = await se.scalar(_sql.select(_models.Lesson).filter_by(course_id=course_id, number=number))
+    if not lesson:
+        raise _fastapi.HTTPException(404, "No such lesson")
+    return lesson
+
+
 async def get_lesson(
         course: _models.Course,
         number: int
 ):
-    for lesson in course.lessons:
+    for lesson in await course.awaitable_attrs.lessons:
         if number == lesson.number:
             return _schemas.LessonFull(
                 id=lesson.id,
@@ -777,179 +852,219 @@ async def get_lesson(
 
 async def drop_lesson(
         lesson: _models.Lesson,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    if True in tuple(p.session.active for p in lesson.progresses):
+    progresses = await lesson.awaitable_attrs.progresses
+    if True in tuple([(await p.awaitable_attrs.session).active for p in progresses]):
         raise _fastapi.HTTPException(423, "There are active sessions on this lesson")
     try:
-        for p in lesson.progresses:
-            se.delete(p)
-            se.commit()
-        se.delete(lesson)
-        se.commit()
+        # ссылки шагов на картинки снимаются той же транзакцией, дерево урока удаляет courses.drop_lesson
+        async with _database.transaction(se):
+            removed = await _cascade.delete_rows(_models.Lesson, [lesson.id], se)
+            await _blobs.detach_all(_blobs.steps_prefix(lesson.course_id, lesson.number), se)
     except Exception as e:
-        _logger.error(f"unable to delete lesson {lesson.number} in course {lesson.course.id}: {e=}")
-        await _tg.error(f"Не удалось удалить урок {lesson.number} с курса {lesson.course.id}:\n\n{e=}")
+        _logger.error(f"unable to delete lesson {lesson.number} in course {lesson.course_id}: {e=}")
+        await _tg.error(f"Не удалось удалить урок {lesson.number} с курса {lesson.course_id}:\n\n{e=}")
         raise _fastapi.HTTPException(409, "Unable to delete")
+    _logger.debug(f"lesson {lesson.number} in course {lesson.course_id} deleted: {removed}")
+    return removed
 
 
 async def drop_course(
         course: _models.Course,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    for s in course.sessions:
+    for s in await course.awaitable_attrs.sessions:
         if s.active:
             raise _fastapi.HTTPException(423, "There are active sessions on this course")
     try:
-        for ctag in course.tags:
-            se.delete(ctag)
-            se.commit()
-        for lessson in course.lessons:
-            se.delete(lessson)
-            se.commit()
-        se.delete(course)
-        se.commit()
+        async with _database.transaction(se):
+            removed = await _cascade.delete_rows(_models.Course, [course.id], se)
+            await _blobs.detach_all(_blobs.steps_prefix(course.id), se)
     except Exception as e:
         _logger.error(f"cannot delete course {course.id}: {e=}")
         await _tg.error(f"Не удалось удалить курс {course.id}\n\n{e=}")
-    _courses.drop_course(course.id)
+        raise _fastapi.HTTPException(409, "Unable to delete")
+    _logger.debug(f"course {course.id} deleted: {removed}")
+    return removed
 
 
 async def update_lesson(
         lesson: _models.Lesson,
         update: _schemas.LessonUpdate,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    if update.name:
-        lesson.name = update.name
-        se.commit()
-        se.refresh(lesson)
-    if update.description:
-        lesson.description = update.description
-        se.commit()
-        se.refresh(lesson)
-    if update.duration:
-        lesson.duration = update.duration
-        se.commit()
-        se.refresh(lesson)
+    async with _database.transaction(se):
+        if update.name:
+            lesson.name = update.name
+        if update.description:
+            lesson.description = update.description
+        if update.duration:
+            lesson.duration = update.duration
 
 
 async def update_course(
         course: _models.Course,
         update: _schemas.CourseUpdate,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    if update.name:
-        course.name = update.name
-        se.commit()
-        se.refresh(course)
-    if update.description:
-        course.description = update.description
-        se.commit()
-        se.refresh(course)
-    if update.tags:
-        new = list(se.query(_models.Specialization).filter_by(name=tag).first() for tag in update.tags)
-        if None in new:
-            raise _fastapi.HTTPException(404, "No such tag")
-        for old in course.tags:
-            se.delete(old)
-            se.commit()
-        for n in new:
-            se.add(_models.CourseTags(course_id=course.id, specialization_id=n.id))
-            se.commit()
+    async with _database.transaction(se):
+        if update.name:
+            course.name = update.name
+        if update.description:
+            course.description = update.description
+        if update.tags:
+            new = [await se.scalar(_sql.select(_models.Specialization).filter_by(name=tag)) for tag in update.tags]
+            if None in new:
+                raise _fastapi.HTTPException(404, "No such tag")
+            for old in await course.awaitable_attrs.tags:
+                await se.delete(old)
+            await se.flush()
+            se.add_all([
+                _models.CourseTags(course_id=course.id, specialization_id=n.id)
+                for n in new
+            ])
 
 
 async def search_courses(
         tags: _typing.List[int],
-        page: int,
+        cursor: _typing.Optional[str],
         pagesize: int,
         desc: bool,
         sort: _schemas.course_search_sorts,
-        se: _orm.Session
+        match: _schemas.course_tags_match,
+        se: _asyncio.AsyncSession
 ):
-    if tags:
-        tags_models = (se.get(_models.Specialization, tid) for tid in tags)
-        courses_ids = set()
-        for t in tags_models:
-            courses_ids.update(ct.course_id for ct in t.courses)
-    sort_column: _sql.Column = {
-        "date": _models.Course.date_created,
-        "name": _models.Course.name,
-        "views": _models.Course.views,
-        "random": _func.random()
-    }[sort]
-    if desc and sort != "random":
-        sort_column = sort_column.desc()
-    models = (
-        filter(
-            (lambda model: (model.id in courses_ids) if tags else (True)),
-            (se
-             .query(_models.Course)
-             .order_by(sort_column)
-             .offset(pagesize*(page-1))
-             .limit(pagesize))
+    # количество считается по course_tags, не затрагивая таблицу курсов
+    conditions = []
+    if not tags:
+        total_query = _sql.select(_func.count()).select_from(_models.Course)
+    elif match == "any":
+        tags = set(tags)
+        conditions.append(
+            _sql.exists()
+            .where(_models.CourseTags.course_id == _models.Course.id)
+            .where(_models.CourseTags.specialization_id.in_(tags))
+        )
+        total_query = (
+            _sql.select(_func.count(_sql.distinct(_models.CourseTags.course_id)))
+            .where(_models.CourseTags.specialization_id.in_(tags))
+        )
+    else:
+        tags = set(tags)
+        tagged = (
+            _sql.select(_models.CourseTags.course_id)
+            .where(_models.CourseTags.specialization_id.in_(tags))
+            .group_by(_models.CourseTags.course_id)
+            .having(_func.count() == len(tags))
+        )
+        conditions.append(_models.Course.id.in_(tagged))
+        total_query = _sql.select(_func.count()).select_from(tagged.subquery())
+    total = await se.scalar(total_query)
+    query = _sql.select(_models.Course).where(*conditions).options(*_loaders.COURSE_SHORT)
+    if sort == "random":
+        # ORDER BY random() сортирует всю таблицу и различается между СУБД,
+        # поэтому страница берется со случайного смещения и перемешивается на стороне приложения
+        query = (
+            query
+            .order_by(_models.Course.id)
+            .offset(_random.randint(0, max(total - pagesize, 0)))
+        )
+        page_models = list((await se.scalars(query.limit(pagesize))).all())
+        _random.shuffle(page_models)
+        next_cursor = None
+    else:
+        page_models, next_cursor = await _pagination.paginate(
+            query,
+            sort,
+            {
+                "date": _models.Course.date_created,
+                "name": _models.Course.name,
+                "views": _models.Course.views,
+            }[sort],
+            _models.Course.id,
+            cursor, pagesize, desc, se
         )
+    return _schemas.CoursesPage(
+        items=[
+            _schemas.CourseShort(
+                id=m.id,
+                name=m.name,
+                views=m.views,
+                tags=_pydantic.parse_obj_as(
+                    _typing.List[_schemas.Specialization],
+                    [await t.awaitable_attrs.specialization for t in await m.awaitable_attrs.tags]
+                ),
+            ) for m in page_models
+        ],
+        next_cursor=next_cursor,
+        total=total
     )
-    return list(
-        _schemas.CourseShort(
-            id=m.id,
-            name=m.name,
-            views=m.views,
-            tags=_pydantic.parse_obj_as(
-                _typing.List[_schemas.Specialization],
-                (t.specialization for t in m.tags)
-            ),
-        ) for m in models
+
+
+async def group_model_to_schema(
+        group: _models.Group
+):
+    teacher = await group.awaitable_attrs.teacher
+    return _schemas.Group(
+        id=group.id,
+        name=group.name,
+        teacher=await teacher_model_to_schema(await teacher.awaitable_attrs.user, teacher),
+        students=[
+            _schemas.StudentShort.from_orm(await s.awaitable_attrs.student)
+            for s in await group.awaitable_attrs.students
+        ]
     )
 
 
 async def get_teacher_groups(
         teacher: _models.Teacher,
+        se: _asyncio.AsyncSession
 ):
-    return list(
-        _schemas.Group(
-            id=group.id,
-            name=group.name,
-            students=list(_schemas.StudentShort.from_orm(student.student) for student in group.students),
-            teacher=teacher_model_to_schema(teacher=teacher, user=teacher.user)
+    groups = (
+        await se.scalars(
+            _sql.select(_models.Group)
+            .filter_by(teacher_id=teacher.user_id)
+            .options(*_loaders.GROUP)
         )
-        for group in
-        teacher.groups
-    )
+    ).all()
+    return [await group_model_to_schema(group) for group in groups]
 
 
 async def get_student_groups(
-        user: _models.User
+        user: _models.User,
+        se: _asyncio.AsyncSession
 ):
-    return list(
-        _schemas.Group(
-            id=g.group.id,
-            name=g.group.name,
-            teacher=teacher_model_to_schema(g.group.teacher.user, g.group.teacher),
-            students=list(_schemas.StudentShort.from_orm(s.student) for s in g.group.students)
-        ) for g in user.groups
-    )
+    groups = (
+        await se.scalars(
+            _sql.select(_models.Group)
+            .join(_models.Group.students)
+            .filter(_models.GroupStudents.student_id == user.id)
+            .options(*_loaders.GROUP)
+        )
+    ).all()
+    return [await group_model_to_schema(group) for group in groups]
 
 
 async def create_group(
         name: str,
         teacher: _models.Teacher,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
     group = _models.Group(
         name=name,
-        teacher_id=teacher.user.id
+        teacher_id=teacher.user_id
     )
     se.add(group)
-    se.commit()
-    se.refresh(group)
+    await se.commit()
+    await se.refresh(group)
 
 
-def get_group_model(
+async def get_group_model(
         id: int,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    group = se.get(_models.Group, id)
+    group = await se.get(_models.Group, id)
     if not group:
         raise _fastapi.HTTPException(404, "no such group")
     return group
@@ -958,26 +1073,24 @@ def get_group_model(
 async def ban_from_group(
         student: _models.User,
         group: _models.Group,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    gs = (
-        se
-        .query(_models.GroupStudents)
+    gs = await se.scalar(
+        _sql.select(_models.GroupStudents)
         .filter_by(group_id=group.id)
         .filter_by(student_id=student.id)
-        .first()
     )
     if not gs:
         raise _fastapi.HTTPException(400, "student not in group")
-    se.delete(gs)
-    se.commit()
+    await se.delete(gs)
+    await se.commit()
 
 
-def get_student_model(
+async def get_student_model(
         id: int,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    user = se.get(_models.User, id)
+    user = await se.get(_models.User, id)
     if not user:
         raise _fastapi.HTTPException(404, "no such user")
     if user.role != "student":
@@ -986,86 +1099,107 @@ def get_student_model(
 
 
 async def get_all_companies_names(
-        se: _orm.Session
+        cursor: _typing.Optional[str],
+        pagesize: int,
+        sort: _schemas.companies_sort_types,
+        desc: bool,
+        se: _asyncio.AsyncSession
 ):
-    return list(
-        _schemas.CompanyShort.from_orm(c)
-        for c in
-        se.query(_models.Company)
+    models, next_cursor = await _pagination.paginate(
+        _sql.select(_models.Company),
+        sort, _models.Company.id if sort == "id" else _models.Company.name, _models.Company.id,
+        cursor, pagesize, desc, se
+    )
+    return _schemas.CompaniesNamesPage(
+        items=[_schemas.CompanyShort.from_orm(c) for c in models],
+        next_cursor=next_cursor
     )
 
 
 async def start_individual_session(
         student: _models.User,
         course: _models.Course,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
     session = _models.Session(
         course_id=course.id,
-        date_started=_dt.datetime.now(),
+        date_started=_dt.date.today(),
         active=True
     )
     se.add(session)
-    se.commit()
-    se.refresh(session)
+    await se.commit()
+    await se.refresh(session)
     se.add(_models.IndividualSessions(
         session_id=session.id,
         student_id=student.id
     ))
-    se.commit()
+    await se.commit()
 
 
 async def start_group_session(
         group: _models.Group,
         course: _models.Course,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
     session = _models.Session(
         course_id=course.id,
-        date_started=_dt.datetime.now(),
+        date_started=_dt.date.today(),
         active=True
     )
     se.add(session)
-    se.commit()
-    se.refresh(session)
+    await se.commit()
+    await se.refresh(session)
     se.add(_models.GroupSessions(
         session_id=session.id,
         group_id=group.id
     ))
-    se.commit()
+    await se.commit()
+
+
+def _session_schema(session: _models.Session) -> _schemas.Session:
+    return _schemas.Session(
+        date_started=session.date_started,
+        date_endend=session.date_ended,
+        active=session.active,
+        course=_schemas.CourseShort(
+            id=session.course.id,
+            name=session.course.name,
+            views=session.course.views,
+            tags=_pydantic.parse_obj_as(
+                _typing.List[_schemas.Specialization],
+                [t.specialization for t in session.course.tags]
+            )
+        )
+    )
 
 
 async def get_student_sessions(
         student: _models.User,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    return list(
-        _schemas.Session(
-            id=s.session.id,
-            date_started=s.session.date_started,
-            date_endend=s.session.date_ended,
-            course=_schemas.CompanyShort.from_orm(s.session.course)
-        )
+    return [
+        _session_schema(s)
         for s in
-        (
-            se
-            .query(_models.IndividualSessions)
-            .filter_by(user_id=student.id)
+        await se.scalars(
+            _sql.select(_models.Session)
+            .join(_models.IndividualSessions)
+            .filter(_models.IndividualSessions.user_id == student.id)
+            .options(_orm.joinedload(_models.Session.course).options(*_loaders.COURSE_SHORT))
         )
-    )
+    ]
 
 
 async def get_group_sessions(
         group: _models.Group,
-        se: _orm.Session
+        se: _asyncio.AsyncSession
 ):
-    return list(
-        _schemas.Session(
-            id=s.session.id,
-            date_started=s.session.date_started,
-            date_endend=s.session.date_ended,
-            course=_schemas.CompanyShort.from_orm(s.session.course)
-        )
+    return [
+        _session_schema(s)
         for s in
-        se.query(_models.GroupSessions).filter_by(group_id=group.id)
-    )
+        await se.scalars(
+            _sql.select(_models.Session)
+            .join(_models.GroupSessions)
+            .filter(_models.GroupSessions.group_id == group.id)
+            .options(_orm.joinedload(_models.Session.course).options(*_loaders.COURSE_SHORT))
+        )
+    ]
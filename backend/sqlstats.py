@@ -0,0 +1,166 @@
+import os as _os
+import re as _re
+import time as _time
+import typing as _typing
+import collections as _collections
+import contextvars as _contextvars
+
+import sqlalchemy as _sql
+from loguru import logger as _logger
+
+import database as _database
+import schemas as _schemas
+
+
+"""
+Учет SQL-запросов, выполненных при обработке HTTP-запроса:
+количество запросов, суммарное время и повторяющиеся запросы (признак N+1)
+
+"""
+
+
+# запрос, выполнивший больше запросов к базе, попадает в лог
+QUERIES_THRESHOLD = int(_os.environ.get("SQL_QUERIES_THRESHOLD", 20))
+
+# запрос с одинаковым отпечатком, повторенный столько раз за HTTP-запрос, считается N+1
+REPEATS_THRESHOLD = int(_os.environ.get("SQL_REPEATS_THRESHOLD", 5))
+
+
+class RequestStats():
+
+    queries: int
+    time: float
+    fingerprints: _typing.Counter[str]
+
+    def __init__(self):
+        self.queries = 0
+        self.time = 0.0
+        self.fingerprints = _collections.Counter()
+
+    def add(self, statement: str, elapsed: float):
+        self.queries += 1
+        self.time += elapsed
+        self.fingerprints[fingerprint(statement)] += 1
+
+    def repeated(self) -> _typing.Dict[str, int]:
+        return {fp: n for fp, n in self.fingerprints.items() if n >= REPEATS_THRESHOLD}
+
+
+class RouteStats():
+
+    requests: int
+    queries: int
+    max_queries: int
+    time: float
+    n_plus_one: int
+    repeated: _typing.Counter[str]
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.time = 0.0
+        self.n_plus_one = 0
+        self.repeated = _collections.Counter()
+
+    def add(self, stats: RequestStats):
+        self.requests += 1
+        self.queries += stats.queries
+        self.max_queries = max(self.max_queries, stats.queries)
+        self.time += stats.time
+        repeated = stats.repeated()
+        if repeated:
+            self.n_plus_one += 1
+        for fp, n in repeated.items():
+            self.repeated[fp] = max(self.repeated[fp], n)
+
+
+_current: _contextvars.ContextVar[_typing.Optional[RequestStats]] = \
+    _contextvars.ContextVar("sql_request_stats", default=None)
+
+_routes: _typing.Dict[str, RouteStats] = _collections.defaultdict(RouteStats)
+
+
+def fingerprint(statement: str) -> str:
+
+    """
+    Приводит текст запроса к виду, не зависящему от значений:
+    литералы заменяются на ?, списки параметров IN (...) сворачиваются
+    """
+
+    statement = _re.sub(r"'(?:[^']|'')*'", "?", statement)
+    statement = _re.sub(r"\b\d+\b", "?", statement)
+    statement = _re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", statement)
+    return " ".join(statement.split())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # время начала хранится в контексте выполнения: он живет ровно один запрос,
+    # поэтому запросы, завершившиеся ошибкой, ничего не оставляют на соединении
+    context.sqlstats_start_time = _time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = _time.perf_counter() - context.sqlstats_start_time
+    stats = _current.get()
+    if stats is not None:
+        stats.add(statement, elapsed)
+
+
+def instrument(engine: _sql.engine.Engine):
+    _sql.event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    _sql.event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def start() -> _typing.Tuple[RequestStats, _contextvars.Token]:
+
+    """
+    Начинает учет запросов для текущего HTTP-запроса
+    """
+
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def finish(route: str, stats: RequestStats, token: _contextvars.Token):
+
+    """
+    Завершает учет, добавляет результаты в статистику маршрута
+    и пишет в лог запросы, превысившие пороги
+    """
+
+    _current.reset(token)
+    _routes[route].add(stats)
+    repeated = stats.repeated()
+    if stats.queries > QUERIES_THRESHOLD or repeated:
+        _logger.warning(
+            f"{route}: {stats.queries} queries in {stats.time*1000:.1f} ms"
+            + "".join(f"\n    x{n}: {fp}" for fp, n in repeated.items())
+        )
+
+
+def get_routes_stats() -> _typing.List[_schemas.SqlRouteStats]:
+
+    """
+    Возвращает накопленную статистику по маршрутам, начиная с самых затратных
+    """
+
+    return [
+        _schemas.SqlRouteStats(
+            route=route,
+            requests=s.requests,
+            queries=s.queries,
+            max_queries=s.max_queries,
+            avg_queries=s.queries / s.requests,
+            time_ms=s.time * 1000,
+            avg_time_ms=s.time * 1000 / s.requests,
+            n_plus_one=s.n_plus_one,
+            repeated=dict(s.repeated.most_common(5))
+        )
+        for route, s in sorted(_routes.items(), key=lambda item: item[1].time, reverse=True)
+    ]
+
+
+instrument(_database.engine)
+instrument(_database.async_engine.sync_engine)
+instrument(_database.readonly_async_engine.sync_engine)
@@ -1,4 +1,5 @@
 import telegram as _telegram
+import sqlalchemy as _sql
 from loguru import logger as _logger
 
 from config import TELEGRAM_ADMIN_BOT_TOKEN as _TOKEN
@@ -15,17 +16,17 @@ import emoji as _emoji
 
 async def admin_broadcast(message: str):
     _logger.debug("new admin broadcast")
+    se = _db.AsyncSessionLocal()
     try:
-        se = _db.SessionLocal()
         bot = _telegram.Bot(_TOKEN)
-        for admin in se.query(_models.Admin):
+        for admin in await se.scalars(_sql.select(_models.Admin)):
             if not admin.telegram:
                 continue
             await bot.send_message(text=message, chat_id=admin.telegram)
     except Exception as e:
         _logger.debug(f"failed to broadcast: {e}")
     finally:
-        se.close()
+        await se.close()
 
 
 async def error(message: str):
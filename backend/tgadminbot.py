@@ -2,7 +2,6 @@ import datetime as _dt
 
 import telegram as _telegram
 from telegram import ext as _ext
-from passlib import hash as _hash
 from loguru import logger as _logger
 
 from config import TELEGRAM_ADMIN_BOT_TOKEN as _TOKEN, PASSWORD_SALT as _SALT
@@ -10,6 +9,7 @@ import emoji as _emoji
 import time as _time
 import models as _models
 import database as _db
+import passwords as _passwords
 
 
 """
@@ -92,7 +92,7 @@ async def on_admmin_auth(update: _telegram.Update, context: _ext.ContextTypes.DE
                 text="Логин неверный"
             )
             return
-        if not _hash.bcrypt.verify(password + _SALT, admin.password):
+        if not await _passwords.hasher.verify(password + _SALT, admin.password):
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text="Пароль неверный"
@@ -1,11 +1,14 @@
 import threading as _threading
 import datetime as _dt
 
+import sqlalchemy as _sql
+
 from loguru import logger as _logger
 
 import database as _database
 import models as _models
 import schemas as _schemas
+import blobs as _blobs
 from config import UNVERIFIED_ACCOUNTS_TTL, TLL_CHECKS_FREQUENCY
 
 
@@ -38,6 +41,8 @@ class TtlController():
         try:
             self.check_expired_links()
             self.check_unverified_emails()
+            self.check_expired_sessions()
+            self.check_released_blobs()
         except Exception as e:
             _logger.error(f"check stopped with error: {e}")
         else:
@@ -67,11 +72,34 @@ class TtlController():
                 if schema.limit == schema.count_used:
                     se.delete(link)
                     se.commit()
-                    _logger.debug(f"link {schema.id} deleted: usage threshold exceeded")
+                    _logger.debug(f"link {schema.url} deleted: usage threshold exceeded")
                 elif schema.date_expired and schema.date_expired < now:
                     se.delete(link)
                     se.commit()
-                    _logger.debug(f"link {schema.id} deleted: date expired")
+                    _logger.debug(f"link {schema.url} deleted: date expired")
+        finally:
+            se.close()
+
+    def check_expired_sessions(self):
+        try:
+            se = _database.SessionLocal()
+            # одним запросом по индексу срока, без загрузки строк
+            removed = se.execute(
+                _sql.delete(_models.AuthSession)
+                .where(_models.AuthSession.date_expired < _dt.datetime.utcnow())
+            ).rowcount
+            se.commit()
+            if removed:
+                _logger.debug(f"{removed} auth sessions deleted: date expired")
+        finally:
+            se.close()
+
+    def check_released_blobs(self):
+        try:
+            se = _database.SessionLocal()
+            removed = _blobs.collect(se)
+            if removed:
+                _logger.debug(f"{removed} blobs deleted: no references")
         finally:
             se.close()
 
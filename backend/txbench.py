@@ -0,0 +1,102 @@
+import sys as _sys
+import asyncio as _aio
+import tempfile as _tempfile
+import collections as _collections
+import datetime as _dt
+import typing as _typing
+
+import sqlalchemy as _sql
+from sqlalchemy.ext import asyncio as _asyncio
+
+import schemas as _schemas
+import services as _services
+import migrations as _migrations
+
+
+"""
+Замер числа запросов и коммитов, выполняемых сервисами создания и изменения.
+Скрипт создает временную базу SQLite и вызывает функции create_* и update_* из services.py
+так же, как их вызывают обработчики запросов, считая выполненные запросы и коммиты каждого вызова.
+Каждый вызов должен записывать изменения одной транзакцией: больше одного коммита - ошибка.
+Запуск: python txbench.py, код возврата 1 при найденных ошибках
+
+"""
+
+
+async def _bench(path: str) -> _typing.List[_typing.Tuple[str, int, int]]:
+    engine = _asyncio.create_async_engine(f"sqlite+aiosqlite:///{path}")
+    counters = _collections.Counter()
+    _sql.event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: counters.update(["queries"]))
+    _sql.event.listen(engine.sync_engine, "commit", lambda *args: counters.update(["commits"]))
+    results = []
+
+    async def call(name: str, coroutine: _typing.Awaitable):
+        counters.clear()
+        result = await coroutine
+        results.append((name, counters["queries"], counters["commits"]))
+        return result
+
+    async with _asyncio.AsyncSession(engine, expire_on_commit=False) as se:
+        await _services.create_specializations(["python", "math", "art", "go", "c"], se)
+        await call("create_company", _services.create_company(_schemas.CompanyCreate(
+            name="School",
+            tags=["python", "math", "art"],
+            contacts=[
+                _schemas.CompanyContactCreate(kind="phone", value="1"),
+                _schemas.CompanyContactCreate(kind="site", value="2"),
+            ]
+        ), se))
+        user, teacher = await call("create_teacher", _services.create_teacher(_schemas.TeacherCreate(
+            email="t@x", fname="T", lname="L", company=1, specializations=["python", "math", "art"], password="tp"
+        ), se))
+        student = await call("create_student", _services.create_student(
+            _schemas.StudentCreate(email="s@x", fname="S", lname="L", password="sp"), se
+        ))
+        await call("update_student", _services.update_student(_schemas.StudentUpdate(
+            confirmation_password="sp", confirmation_email="s@x", fname="A", lname="B", sname="C", password="sp"
+        ), student, se))
+        await call("update_teacher", _services.update_teacher(_schemas.TeacherUpdate(
+            confirmation_password="tp", confirmation_email="t@x", fname="A", lname="B", sname="C",
+            password="tp", company=1, specializations=["go"]
+        ), user, teacher, se))
+        await call("update_company", _services.update_company(1, _schemas.CompanyUpdate(
+            name="School2",
+            tags=["go", "c"],
+            contacts=[_schemas.CompanyContactCreate(kind="site", value="3")]
+        ), se))
+        course = await call("create_course", _services.create_course(_schemas.CourseCreate(
+            name="Py", description="d", author_id=user.id, tags=["python", "math", "art"]
+        ), se))
+        lesson = await call("create_lesson", _services.create_lesson(course, _schemas.LessonCreate(
+            number=1, name="L1", description="d", duration=_dt.time(1)
+        ), se))
+        await call("update_lesson", _services.update_lesson(lesson, _schemas.LessonUpdate(
+            name="L1x", description="e", duration=_dt.time(2)
+        ), se))
+        await call("update_course", _services.update_course(course, _schemas.CourseUpdate(
+            name="Py2", description="e", tags=["go"]
+        ), se))
+    await engine.dispose()
+    return results
+
+
+def bench(path: str) -> _typing.List[_typing.Tuple[str, int, int]]:
+
+    """
+    Выполняет замер на базе по пути path.
+    Возвращает строки (функция, запросов, коммитов) на один вызов
+    """
+
+    engine = _sql.create_engine(f"sqlite:///{path}")
+    _migrations.migrate(engine)
+    engine.dispose()
+    return _aio.run(_bench(path))
+
+
+if __name__ == "__main__":
+    with _tempfile.TemporaryDirectory() as directory:
+        results = bench(f"{directory}/txbench.db")
+    print(f"{'function':16}{'queries':>9}{'commits':>9}")
+    for name, queries, commits in results:
+        print(f"{name:16}{queries:9}{commits:9}{'  MORE THAN ONE COMMIT' if commits > 1 else ''}")
+    _sys.exit(1 if any(commits > 1 for _, _, commits in results) else 0)
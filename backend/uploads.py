@@ -0,0 +1,69 @@
+import os as _os
+import typing as _typing
+
+import fastapi as _fastapi
+from sqlalchemy.ext import asyncio as _asyncio
+
+import models as _models
+import blobs as _blobs
+
+
+"""
+Прием загружаемых картинок. Файл копируется в хранилище blobs частями по UPLOAD_CHUNK_SIZE,
+в памяти процесса не бывает больше одной части.
+Картинка принимается полем формы multipart/form-data
+или телом запроса с типом image/png либо image/jpeg: в этом случае тело читается из сокета
+по мере записи, и загрузка больше MAX_IMAGE_SIZE прерывается, не дочитывая запрос.
+Тип определяется по первым байтам файла, а не по имени
+
+"""
+
+
+UPLOAD_CHUNK_SIZE = int(_os.environ.get("UPLOAD_CHUNK_SIZE", 65536))
+
+MAX_IMAGE_SIZE = int(_os.environ.get("MAX_IMAGE_SIZE", 1048576))
+
+
+async def _read_upload(upload: _fastapi.UploadFile) -> _typing.AsyncIterator[bytes]:
+    while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+        yield chunk
+
+
+def chunks(
+        request: _fastapi.Request,
+        upload: _typing.Optional[_fastapi.UploadFile],
+        limit: int,
+        detail: str = "Image too large"
+) -> _typing.AsyncIterator[bytes]:
+
+    """
+    Части загружаемого файла: из поля формы upload или, если его нет, из тела запроса
+    """
+
+    if upload is not None:
+        if upload.size is not None and upload.size > limit:
+            raise _fastapi.HTTPException(413, detail)
+        return _read_upload(upload)
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > limit:
+        raise _fastapi.HTTPException(413, detail)
+    return request.stream()
+
+
+async def receive_image(
+        request: _fastapi.Request,
+        upload: _typing.Optional[_fastapi.UploadFile],
+        se: _asyncio.AsyncSession,
+        limit: int = MAX_IMAGE_SIZE
+) -> _models.Blob:
+
+    """
+    Сохраняет загружаемую картинку в хранилище blobs. Транзакцию не фиксирует
+    """
+
+    try:
+        return await _blobs.put_stream(chunks(request, upload, limit), limit, se)
+    except _blobs.BlobTooLargeError:
+        raise _fastapi.HTTPException(413, "Image too large")
+    except _blobs.UnsupportedBlobError:
+        raise _fastapi.HTTPException(415, "Unsupportable image type")